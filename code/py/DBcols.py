@@ -1,3 +1,5 @@
+import pandas as pd
+
 # COlUMNS FOR DBmerging
 
 # all columns regarding any measurement
@@ -105,4 +107,102 @@ patient_cols = [
 db_cols = patient_cols + \
     case_cols + \
         [col for col in sample_cols if not col in patient_cols] + \
-            ['Note']
\ No newline at end of file
+            ['Note']
+
+
+#################################
+# KEY SCHEMA
+# the key columns are repeated in every row of the tidy luminex data and of the DB merge
+# numeric Run and Plate are stored as small ints, all string keys (also the luminex Run) as categoricals
+key_int_cols = [
+    'Run',
+    'Plate'
+    ]
+
+key_cat_cols = [
+    'Plex',
+    'Well',
+    'Type',
+    'Protein',
+    'Project',
+    'SampleName',
+    'PatientCode'
+    ]
+
+key_cols = key_int_cols + key_cat_cols
+
+
+def sort_categories(col):
+    '''
+    sorted categories make categoricals sort like the strings
+    '''
+
+    categories = col.cat.categories
+    if categories.is_monotonic_increasing:
+        return col
+    try:
+        return col.cat.reorder_categories(categories.sort_values())
+    except TypeError:
+        # mixed types cannot be sorted
+        return col
+
+
+def set_key_dtypes(df):
+    '''
+    applies the key schema to the key columns of df (in place)
+        numeric Run and Plate without missing values become the smallest fitting int
+        all other key columns become categoricals with sorted categories
+    '''
+
+    for col in [col for col in key_cols if col in df.columns]:
+        s = df[col]
+        if pd.api.types.is_bool_dtype(s):
+            continue
+        if pd.api.types.is_numeric_dtype(s):
+            if col in key_int_cols and s.notna().all():
+                df[col] = pd.to_numeric(s, downcast="integer")
+            continue
+        df[col] = sort_categories(s if s.dtype == "category" else s.astype("category"))
+    return df
+
+
+def get_union_dtype(cols):
+    '''
+    the categorical dtype holding the values of all cols
+    returns None if none of the cols is categorical or one is numeric (no common dtype)
+    '''
+
+    if not any(col.dtype == "category" for col in cols) or any(pd.api.types.is_numeric_dtype(col) for col in cols):
+        return None
+    categories = pd.Index([]).append([
+        col.cat.categories if col.dtype == "category" else pd.Index(col.dropna().unique()) for col in cols
+    ]).unique()
+    try:
+        categories = categories.sort_values()
+    except TypeError:
+        pass
+    return pd.CategoricalDtype(categories)
+
+
+def concat_keyed(dfs, **kwargs):
+    '''
+    pd.concat that keeps the categorical key columns (categories of the dfs are united)
+    '''
+
+    dfs = list(dfs)
+    for col in key_cols:
+        if (dtype := get_union_dtype([df[col] for df in dfs if col in df.columns])) is not None:
+            dfs = [df.assign(**{col: df[col].astype(dtype)}) if col in df.columns else df for df in dfs]
+    return set_key_dtypes(pd.concat(dfs, **kwargs))
+
+
+def merge_keyed(left, right, **kwargs):
+    '''
+    pd.merge that keeps the categorical key columns (both sides get the same categories)
+    '''
+
+    for col in [col for col in key_cols if col in left.columns and col in right.columns]:
+        if (dtype := get_union_dtype([left[col], right[col]])) is not None:
+            left = left.assign(**{col: left[col].astype(dtype)})
+            right = right.assign(**{col: right[col].astype(dtype)})
+    return set_key_dtypes(left.merge(right, **kwargs))
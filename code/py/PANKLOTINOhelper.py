@@ -1,6 +1,10 @@
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from script_utils import show_output
+from excel_cache import read_excel_sheets, read_excel_sheet
+from note_utils import aggregate_notes
 from PANKLOTINOcols import *
+from DBcols import set_key_dtypes
 #### utility functions to include all the data from the different data sources to create a 
 # combined database file
 
@@ -21,11 +25,11 @@ def expand_plexes(df, plexes=[]):
     return df
 
 
-def lumi21_wells(master_info_excel, plexes21=[3,11,23,38]):
+def lumi21_wells(lumi21_df, plexes21=[3,11,23,38]):
     '''
-    turns the master info wells into a df and converts the Run to 6 digit years
+    turns the master info wells (sheet LumiWells2021) into a df and converts the Run to 6 digit years
     '''
-    df = pd.read_excel(master_info_excel, sheet_name="LumiWells2021").rename({'sample_name':'SampleName', 'Weights':"Weight"}, axis=1)
+    df = lumi21_df.rename({'sample_name':'SampleName', 'Weights':"Weight"}, axis=1)
     # fix the date to short form
     df.loc[:, "Run"] = df['Run'] - 20000000
     # add all the plexes
@@ -61,14 +65,25 @@ def read_excel_96plate(excel_file, anchor="A1", orient="wide", **kwargs):
     return df.loc[:, ['Well', 'SampleName']]
 
 
-def lumi22_wells(excel_file, anchor="B4"):
+def read_96plates(excel_file, sheets, anchor="B4"):
+    '''
+    reads the plate setups of several sheets opening the workbook only once
+    returns a dict of the well setups per sheet
+    '''
+
+    with pd.ExcelFile(excel_file) as xls:
+        return {sheet: read_excel_96plate(xls, sheet_name=sheet, anchor=anchor) for sheet in sheets}
+
+
+def lumi22_wells(plate_dfs):
     '''
     returns the plate 
+    takes the well setups of Platte1 and Platte2 (from read_96plates)
     '''
     dfs = []
 
     for plate in [1,2]:
-        df = read_excel_96plate(excel_file, sheet_name=f"Platte{plate}", anchor=anchor)
+        df = plate_dfs[f"Platte{plate}"].copy()
         df.loc[:, ['Run', 'RunDesc', 'Plate', 'Plex', 'Note']] = [220906, "LuminexValidation2122", plate, "21-Plex", ""]
         dfs.append(df)
     df = pd.concat(dfs)
@@ -83,17 +98,17 @@ def lumi22_wells(excel_file, anchor="B4"):
     return df.loc[:, ['Project', 'Run', 'RunDesc', 'Plate', 'Plex', 'SampleName', 'Well', 'Note']]
 
 
-def load_tino_master(tino_master_excel):
+def load_tino_master(tino_sheets):
     '''
-    load the TinoMasterData and do some data wrangling
+    load the TinoMasterData (sheets Patients, Cases, Samples and Wells) and do some data wrangling
     '''
 
-    tino_patients = pd.read_excel(tino_master_excel, sheet_name="Patients").loc[:, ['Project', 'PatientCode', 'PatientCodeAlt', 'DOD', 'Sex', 'Note']]
+    tino_patients = tino_sheets["Patients"].loc[:, ['Project', 'PatientCode', 'PatientCodeAlt', 'DOD', 'Sex', 'Note']]
     # some patients have several entries (with and without extended data --> only use one)
     tino_patients = tino_patients.sort_values(['PatientCode', 'DOD', 'Sex', 'Note']).groupby(['PatientCode', 'PatientCodeAlt']).first().reset_index()
 
 
-    tino_cases = pd.read_excel(tino_master_excel, sheet_name="Cases").rename({
+    tino_cases = tino_sheets["Cases"].rename({
         "Age at TURB": "Age",
         'tumor surgery': 'TumorSurgery',
         ' Tumor state TURB': 'TumorStateTURB',
@@ -117,9 +132,9 @@ def load_tino_master(tino_master_excel):
     tino_cases.loc[tino_cases['NAC'] == "NO-NAC", 'Therapy'] = 'NO_NAC'
     tino_cases = tino_cases.drop(['NAC_regime', 'NAC_cycles', 'NAC'], axis=1)
 
-    tino_samples = pd.read_excel(tino_master_excel, sheet_name="Samples")
+    tino_samples = tino_sheets["Samples"]
 
-    tino_wells = pd.read_excel(tino_master_excel, sheet_name="Wells")
+    tino_wells = tino_sheets["Wells"]
     tino_wells.loc[:, "Project"] = "NAC"
     tino_wells.loc[:, "Weight"] = tino_wells['Weight'] * 1000
 
@@ -185,14 +200,9 @@ def merge_2122(df21, df22, pat_df):
 
 def flatten_notes(df):
     '''
-    takes a df with Note_x and Note_y and combines them into one Note
+    takes a df with Note_x and Note_y and combines them into one Note ("a|b")
     '''
-    for col in ["Note_x", "Note_y"]:
-        df[col] = df[col].fillna("")
-    df.loc[(df['Note_x'] ==  "") & (df['Note_y'] ==  ""), 'Note'] = ""
-    df.loc[(df['Note'] != "") & (df['Note_x'] ==  df['Note_y']), 'Note'] = df['Note_x']
-    df.loc[(df['Note'] != "") & (df['Note_x'] !=  df['Note_y']), 'Note'] = df['Note_x'].fillna("").astype(str) + "|" + df['Note_y'].fillna("").astype(str) .fillna("")
-    df.loc[:, 'Note'] = df['Note'].str.strip("|")
+    df['Note'] = aggregate_notes(df, ['Note_x', 'Note_y'], wrap=False)
     df = df.drop(['Note_x', 'Note_y'], axis=1)
     return df
 
@@ -252,15 +262,16 @@ def clean_PatientCode(df, tino_pats):
     return df.drop("PatientCodeUsed", axis=1)
 
 
-def get_tino_all(lumi21_excel, lumi22_excel, tino_master_excel, plexes21=[3,11,23,38]):
+def get_tino_all(lumi21_df, lumi22_plates, tino_sheets, plexes21=[3,11,23,38]):
     '''
     get the tino data from TinoMaster and from 2021/22 and merge them
     bring together all tino data and pass the remaining df2122 to the pancreas and LO data analyser
+    takes the pre-loaded sheets (see load_PANKLOTINO)
     '''
     # get the 2021/2022 sample info
-    df21 = lumi21_wells(lumi21_excel, plexes21=plexes21)
-    df22 = lumi22_wells(lumi22_excel)
-    tino_patients, tino_cases, tino_samples, tino_wells = load_tino_master(tino_master_excel)
+    df21 = lumi21_wells(lumi21_df, plexes21=plexes21)
+    df22 = lumi22_wells(lumi22_plates)
+    tino_patients, tino_cases, tino_samples, tino_wells = load_tino_master(tino_sheets)
     # quick fix
     tino_wells.loc[:, "RunDesc"] = tino_wells['RunDesc'].str.replace("sss", "ss")
     df2122 = merge_2122(df21, df22, tino_patients)
@@ -348,15 +359,15 @@ def get_tino_all(lumi21_excel, lumi22_excel, tino_master_excel, plexes21=[3,11,2
 
 ############# PANKREAS DATA ########################################
 
-def get_pankreas(df2122, pancreas_excel):
+def get_pankreas(df2122, pancreas_df):
     '''
     + extract pankreas wells from df
-    + load data from LuminexMasterInfo
+    + use data from LuminexMasterInfo (sheet PankreasSamples)
     + check integrity (luminex wells match?)
     + add data to sample_df
     '''
     pank_wells = df2122.query('Project == "PankreasCharite"').sort_values("SampleName")
-    samples_pank = pd.read_excel(pancreas_excel, sheet_name="PankreasSamples").rename({'PatientID':'PatientCodeAlt'}, axis=1).drop(["Run", "Well"], axis=1)
+    samples_pank = pancreas_df.rename({'PatientID':'PatientCodeAlt'}, axis=1).drop(["Run", "Well"], axis=1)
     samples_pank['SampleName'] = samples_pank['SampleName'].str.replace("  ", " ")
     ### check integrity
     # compare sample names
@@ -410,13 +421,13 @@ def get_pankreas(df2122, pancreas_excel):
     return pank_pat_codes, pank_patients, pank_cases, pank_samples, pank_wells
 
 
-def get_LO_data(df2122, LO_excel):
+def get_LO_data(df2122, LO_sheets):
     '''
-    get the LungOrganoid data and combine with the well data
+    get the LungOrganoid data (sheets PatientData and dataTable) and combine with the well data
     '''
     
     # get the patient/case-relevant data
-    LO_patient_df = pd.read_excel(LO_excel, sheet_name="PatientData").rename({'Operation': 'TumorSurgery'}, axis=1)
+    LO_patient_df = LO_sheets["PatientData"].rename({'Operation': 'TumorSurgery'}, axis=1)
     # extract and add data
     LO_patient_df['PatientCode'] = LO_patient_df['PatientCode'].str.replace("_", "-")
     LO_patient_df.loc[:, ['Project', 'DOD']] = ["LO", -1]
@@ -436,7 +447,7 @@ def get_LO_data(df2122, LO_excel):
 
     
     ## read the data tables for sample meta data
-    LO_sample_df = pd.read_excel(LO_excel, sheet_name="dataTable").rename({
+    LO_sample_df = LO_sheets["dataTable"].rename({
         'Tumor from patient': 'PatientCode',
         'name for Checkimmune': 'SampleName',
         'mg in sample':'amount',
@@ -464,6 +475,33 @@ def get_LO_data(df2122, LO_excel):
     return LO_pat_codes, LO_patients, LO_cases, LO_samples, LO_wells
 
 
+def run_tasks(tasks, pool=None):
+    '''
+    runs the tasks (dict of name: (func, *args)) in the pool (or one by one without pool)
+    returns the dict of the results
+    '''
+
+    if pool is None:
+        return {name: func(*args) for name, (func, *args) in tasks.items()}
+    futures = {name: pool.submit(func, *args) for name, (func, *args) in tasks.items()}
+    return {name: future.result() for name, future in futures.items()}
+
+
+def load_PANKLOTINO(lumi21_excel, lumi22_excel, tino_master_excel, pancreas_excel, LO_excel, pool=None):
+    '''
+    the loading stage: reads all source workbooks (each opened once) concurrently in the pool
+    returns the dict of the pre-loaded sheets per source
+    '''
+
+    return run_tasks(dict(
+        lumi21=(read_excel_sheet, lumi21_excel, "LumiWells2021"),
+        lumi22=(read_96plates, lumi22_excel, ["Platte1", "Platte2"]),
+        tino=(read_excel_sheets, tino_master_excel, ["Patients", "Cases", "Samples", "Wells"]),
+        pancreas=(read_excel_sheet, pancreas_excel, "PankreasSamples"),
+        LO=(read_excel_sheets, LO_excel, ["PatientData", "dataTable"])
+    ), pool=pool)
+
+
 def gather_PANKLOTINO(
     lumi21_excel="", 
     lumi22_excel="",
@@ -471,19 +509,33 @@ def gather_PANKLOTINO(
     pancreas_excel="",
     LO_excel="",
     plexes21=[3,11,23,38],
-    excel_out=""
+    excel_out="",
+    n_workers=1
     ):
     '''
     bring all data together and return individual dfs
+    the source workbooks are loaded serially or, with n_workers > 1, concurrently using n_workers processes
+    the pancreas and LO data are wrangled in parallel once df2122 is there
     '''
 
+    pool = ProcessPoolExecutor(max_workers=n_workers) if n_workers > 1 else None
+    try:
+        sources = load_PANKLOTINO(lumi21_excel, lumi22_excel, tino_master_excel, pancreas_excel, LO_excel, pool=pool)
 
-    # collect all the tino and 2021/22 data
-    df2122, tino_pat_codes, tino_patients, tino_cases, tino_samples, tino_wells = get_tino_all(lumi21_excel, lumi22_excel, tino_master_excel, plexes21=plexes21)
+        # collect all the tino and 2021/22 data
+        df2122, tino_pat_codes, tino_patients, tino_cases, tino_samples, tino_wells = get_tino_all(sources['lumi21'], sources['lumi22'], sources['tino'], plexes21=plexes21)
 
-    pank_pat_codes, pank_patients, pank_cases, pank_samples, pank_wells = get_pankreas(df2122, pancreas_excel)
+        # pankreas and LO only depend on df2122
+        results = run_tasks(dict(
+            pancreas=(get_pankreas, df2122, sources['pancreas']),
+            LO=(get_LO_data, df2122, sources['LO'])
+        ), pool=pool)
+    finally:
+        if pool:
+            pool.shutdown()
+    pank_pat_codes, pank_patients, pank_cases, pank_samples, pank_wells = results['pancreas']
 
-    LO_pat_codes, LO_patients, LO_cases, LO_samples, LO_wells = get_LO_data(df2122, LO_excel)
+    LO_pat_codes, LO_patients, LO_cases, LO_samples, LO_wells = results['LO']
 
     # concat the data
     pat_code_df = pd.concat([tino_pat_codes, pank_pat_codes, LO_pat_codes]).reset_index(drop=True)
@@ -542,6 +594,10 @@ def gather_PANKLOTINO(
     sample_df.loc[sample_df['SourceAmount'] != 0, 'ExtractVolume'] =300 * sample_df['Dilution']
     sample_df = sample_df.drop('Dilution', axis=1).rename({'DOX':'LumiDOX'}, axis=1)
     well_df = well_df.rename({'RunDesc': 'RunGroup'}, axis=1)
+    # compact dtypes for the key columns
+    pat_code_df, patient_df, case_df, biopsy_df, sample_df, well_df = [
+        set_key_dtypes(df) for df in [pat_code_df, patient_df, case_df, biopsy_df, sample_df, well_df]
+    ]
     ### write to file
     if excel_out:
         show_output(f"Data written to {excel_out}!", color="success")
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 from script_utils import show_output
 from TinoMastercols import *
@@ -17,32 +18,78 @@ def get_patient_code(df, org_col="sample code", target_col="PatientCode", remove
     return df
 
 ####
-def get_subdata_index(data, sheet, sep="Run"):
+def get_subdata_index(raw_df, sep="Run"):
     '''
     finds the structure in the data table for the incremental import
-    retrieve the coords of the subtables in "all_martin" by detecting the "Run" (or sep) column header
+    retrieve the coords of the subtables in "all_martin" by detecting the "Run" (or sep) column header in the first column of the raw sheet
     '''
-    # load the df's first column
-    df = pd.read_excel(data, sheet_name=sheet, header=None, usecols="A").rename({0:"col"}, axis=1)
-    indices = list(df.query('col == @sep').index) + [len(df.index)]
+
+    indices = list(np.flatnonzero(raw_df.iloc[:, 0].to_numpy() == sep)) + [len(raw_df.index)]
     return indices
 
-def read_subtable(tino_file, all_sheet="", **args):
+
+def get_header(row):
     '''
-    imports all the subfiles
-    takes positional args (skiprows, nrows) from consumption of the subdata_index and returns one full data table with some data edits
+    column names from a header row of the raw sheet like read_excel does
+    empty cells become "Unnamed: i" and duplicates are numbered (X, X.1, ..)
     '''
-    
-    # read the df with the respective 
-    df2 = pd.read_excel(tino_file, sheet_name=all_sheet, **args).rename({'weight [g]': 'Weight', 'Platte':'Plate'}, axis=1)
-    # print(list(df2.columns)[:14])
+
+    header, seen = [], {}
+    for i, col in enumerate(row):
+        col = f"Unnamed: {i}" if pd.isna(col) else str(col)
+        if col in seen:
+            seen[col] += 1
+            col = f"{col}.{seen[col]}"
+        else:
+            seen[col] = 0
+        header.append(col)
+    return header
+
+
+def convert_column(col):
+    '''
+    numeric conversion of a raw (object) column like read_excel does (all or nothing)
+    '''
+
+    try:
+        return pd.to_numeric(col)
+    except (ValueError, TypeError):
+        return col.infer_objects()
+
+
+def read_subtable(raw_df, start, stop):
+    '''
+    cuts a subtable from the raw sheet (header row at start, data rows until stop)
+    returns the wide subtable with some column edits
+    '''
+
+    header = get_header(raw_df.iloc[start])
+    # skip the empty rows at the end of the subtable (like read_excel with nrows)
+    rows = raw_df.iloc[start+1:stop].to_numpy()
+    filled = np.flatnonzero(pd.notna(rows).any(axis=1))
+    rows = rows[:filled[-1] + 1] if len(filled) else rows[:0]
+    df2 = pd.DataFrame(rows, columns=header).apply(convert_column)
+    df2 = df2.rename({'weight [g]': 'Weight', 'Platte':'Plate'}, axis=1)
     df2 = df2.loc[:, [col for col in df2.columns if not col.startswith("Unnamed")]]
-    # stack the proteins using melt
-    df2 = df2.melt(id_vars=list(df2.columns[:13]), var_name="Protein", value_name="conc").dropna(subset="conc", axis=0)
-    # extract the Proteins
-    df2.loc[:, ['Gene', 'altGene', 'PlexCol']] = df2['Protein'].str.extract(r"([^(/]+)(?:/([^(/]+))?(?: \(([0-9]+)\))").rename({0:"Gene", 1:"altGene",2:"PlexCol"}, axis=1)
-    df2 = df2.drop("Protein", axis=1)    
     return df2
+
+
+def melt_subtables(dfs, n_id_cols=13):
+    '''
+    stacks the proteins of all subtables in one melt and extracts Gene, altGene and PlexCol from the Protein names
+    the first n_id_cols columns of the subtables are the id columns
+    '''
+
+    id_cols = list(dfs[0].columns[:n_id_cols])
+    df = pd.concat(dfs, ignore_index=True)
+    # stack the proteins using melt (proteins missing in a subtable are dropped with the missing conc)
+    df = df.melt(id_vars=id_cols, var_name="Protein", value_name="conc").dropna(subset="conc", axis=0)
+    # extract the Proteins (once per Protein name)
+    proteins = df['Protein'].unique()
+    protein_df = pd.Series(proteins, index=proteins).str.extract(r"([^(/]+)(?:/([^(/]+))?(?: \(([0-9]+)\))")
+    df.loc[:, ['Gene', 'altGene', 'PlexCol']] = protein_df.reindex(df['Protein']).to_numpy()
+    df = df.drop("Protein", axis=1)
+    return df
     
     
 ####### Aggregate TINO DATA from back then
@@ -89,22 +136,19 @@ def get_patients_clean(patients_file, project_name="NAC"):
 def import_tino_data(tino_file, sheet=""):
     '''
     import data incrementally and wrangle some data
-    cycles through the subtable_index and imports and concatenates the data and wrangles the data a bit
+    the sheet is loaded once and split at the subtable_index, the subtables are stacked and the data wrangled a bit
     
     '''
     
-    # detect the row coords of the sub tables
-    ins = get_subdata_index(tino_file, sheet=sheet)
+    # load the sheet once and detect the row coords of the sub tables
+    raw_df = pd.read_excel(tino_file, sheet_name=sheet, header=None, dtype=object)
+    ins = get_subdata_index(raw_df)
     show_output(f"Detected header rows in data at following lines: {', '.join([str(i+1) for i in ins[:-1]])}")
 
     
-    # go through all the subtables and import
-    dfs = []
-    for i in range(len(ins)-1):
-        df = read_subtable(tino_file, all_sheet=sheet, skiprows=ins[i], nrows=ins[i+1] - ins[i]-1)
-        dfs.append(df)
-    
-    df = pd.concat(dfs).reset_index(drop=True)
+    # cut all the subtables from the raw sheet and stack them in one go
+    dfs = [read_subtable(raw_df, ins[i], ins[i+1]) for i in range(len(ins)-1)]
+    df = melt_subtables(dfs).reset_index(drop=True)
     # print(list(df2.columns))
     # data wrangling
 
@@ -0,0 +1,335 @@
+import os
+import sys
+import json
+import shutil
+import argparse
+import platform
+import subprocess
+import numpy as np
+import pandas as pd
+from time import perf_counter
+from datetime import date, datetime, timedelta
+from openpyxl import Workbook
+from yaml import dump
+
+from script_utils import show_output, load_config, stage_times
+from kernel_5PL import PL5
+from collect_luminex import read_luminex_folder
+
+#### benchmark for read_luminex_folder on synthetic plates
+# the generated raw files follow the layout of the luminex raw data files:
+#   - 6 header lines "<key>: <value>" + 1 empty line
+#   - the table Well | Type | <PlexName> ... | Sampling Errors with FI as strings with decimal comma
+# usage: python bench_luminex.py --plates 500 --raw-format mixed --report bench_report.json
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../config/default_config.yml")
+# wells are filled column by column (A1, B1, ..., H1, A2, ...)
+WELLS = [f"{row}{col}" for col in range(1, 13) for row in "ABCDEFGH"]
+# standards S1-S6 and blank in duplicates and the controls like on the real plates
+STANDARD_TYPES = ["S1", "S1", "S2", "S2", "S3", "S3", "S4", "S4", "S5", "S5", "S6", "S6", "C1", "C2", "B", "B"]
+S1 = 20000
+DILUTION = 4
+
+
+def make_proteins(plexes=[11, 3], seed=0):
+    '''
+    creates the protein panel for every plex with random (but realistic) 5PL params
+    returns a df with PlexName, Protein, Plex and the params A-E
+    '''
+
+    rng = np.random.default_rng(seed)
+    proteins = []
+    for plex_size in plexes:
+        plex = f"{plex_size}-Plex"
+        for i in range(plex_size):
+            protein = f"P{plex_size:02d}{i:02d}"
+            proteins.append(dict(
+                PlexName=f"{protein} ({rng.integers(10, 80)})",
+                Protein=protein,
+                Plex=plex,
+                A=rng.uniform(10, 100),
+                B=rng.uniform(12000, 30000),
+                C=rng.uniform(500, 5000),
+                D=rng.uniform(-1.5, -0.7),
+                E=rng.uniform(0.5, 2)
+            ))
+    return pd.DataFrame(proteins)
+
+
+def write_params_file(params_file, protein_df):
+    '''
+    writes the Luminex params file (sheets Controls and Proteins) for the protein panel
+    '''
+
+    control_df = protein_df.loc[:, ['PlexName']].assign(C1="100 - 300", C2="1000 - 3000", S1=S1)
+    with pd.ExcelWriter(params_file, mode="w") as writer:
+        control_df.to_excel(writer, sheet_name="Controls", index=False)
+        protein_df.loc[:, ['PlexName', 'Protein', 'Plex']].to_excel(writer, sheet_name="Proteins", index=False)
+
+
+def get_plate_header(raw_file, run_date):
+    '''
+    the 6 header lines of a luminex raw data file
+    '''
+
+    return [
+        f"File Name: C:\\Luminex\\{os.path.basename(raw_file).split('.')[0]}.rbx",
+        f"Acquisition Date: {run_date.strftime('%d-%b-%Y')}, 10:00",
+        "Reader Serial Number: LX10010000000",
+        "RP1 PMT (Volts): 571,18",
+        "RP1 Target: 3514",
+        "Plate ID: "
+    ]
+
+
+def make_plate_data(plex_df, has_standard=True, rng=None, noise=0.05):
+    '''
+    simulates the FI table of one plate for the proteins in plex_df
+    the samples have random concentrations (log-uniform) and multiplicative noise
+    returns a df with Well, Type, the FI as strings (decimal comma) for every PlexName and Sampling Errors
+    '''
+
+    rng = rng or np.random.default_rng()
+    n_samples = len(WELLS) - len(STANDARD_TYPES)
+    types = STANDARD_TYPES + [f"X{i+1}" for i in range(n_samples)]
+    # plates without standard only have samples
+    if not has_standard:
+        types = [f"X{i+1}" for i in range(len(WELLS))]
+    conc = np.power(10, rng.uniform(-1, np.log10(S1 * 2), len(WELLS)))
+    for i, sample_type in enumerate(types):
+        if sample_type.startswith("S"):
+            conc[i] = S1 / np.power(DILUTION, int(sample_type[1]) - 1)
+        elif sample_type == "B":
+            conc[i] = 0
+        elif sample_type == "C1":
+            conc[i] = 200
+        elif sample_type == "C2":
+            conc[i] = 2000
+
+    data = dict(Well=WELLS, Type=types)
+    for _, protein in plex_df.iterrows():
+        fi = PL5(conc, protein.loc[['A', 'B', 'C', 'D', 'E']].to_numpy(dtype=float))
+        fi = np.round(fi * rng.lognormal(0, noise, len(fi)) * 2) / 2
+        data[protein['PlexName']] = [f"{f:.1f}".replace(".", ",") for f in fi]
+    data['Sampling Errors'] = rng.choice(["", "", "", "", "1", "1,4"], len(WELLS))
+    return pd.DataFrame(data)
+
+
+def write_raw_xlsx(raw_file, header, data_df):
+    '''
+    writes a raw data file in the luminex excel layout
+    '''
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    for line in header:
+        ws.append([line])
+    ws.append([])
+    ws.append(list(data_df.columns))
+    for row in data_df.itertuples(index=False):
+        ws.append([value if value != "" else None for value in row])
+    wb.save(raw_file)
+
+
+def write_raw_csv(raw_file, header, data_df):
+    '''
+    writes a raw data file in the luminex csv layout (; separated, ISO-8859-1)
+    '''
+
+    lines = [f"{line};" for line in header] + [""]
+    lines += [";".join(data_df.columns)] + [";".join(row) for row in data_df.itertuples(index=False)]
+    with open(raw_file, "w", encoding="ISO-8859-1") as stream:
+        stream.write("\n".join(lines) + "\n")
+
+
+def make_bench_data(bench_folder, n_plates=100, plates_per_run=2, plexes=[11, 3], raw_format="mixed", no_standard=0.1, seed=0, **kwargs):
+    '''
+    creates a luminex data folder with n_plates raw data files and the fitting params file
+    every run has plates_per_run plates of every plex
+    raw_format: "xlsx", "csv" or "mixed" (alternating)
+    no_standard is the fraction of plates without standard (these need the external standards)
+    returns the data_path and the params_file
+    '''
+
+    rng = np.random.default_rng(seed)
+    data_path = os.path.join(bench_folder, "data")
+    info_path = os.path.join(bench_folder, "info")
+    for folder in [data_path, info_path]:
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    protein_df = make_proteins(plexes, seed=seed)
+    params_file = os.path.join(info_path, "LuminexParams.xlsx")
+    write_params_file(params_file, protein_df)
+
+    plate_count = 0
+    run = 0
+    while plate_count < n_plates:
+        run_date = date(2018, 1, 1) + timedelta(days=run)
+        run_folder = os.path.join(data_path, f"Run_{run_date.strftime('%Y%m%d')}")
+        if not os.path.isdir(run_folder):
+            os.makedirs(run_folder)
+        for plex_size in plexes:
+            plex_df = protein_df.loc[protein_df['Plex'] == f"{plex_size}-Plex", :]
+            for plate in range(1, plates_per_run + 1):
+                if plate_count >= n_plates:
+                    break
+                # the first plate of every run always has a standard
+                has_standard = plate == 1 or rng.uniform() >= no_standard
+                file_format = raw_format if raw_format != "mixed" else ["xlsx", "csv"][plate_count % 2]
+                raw_file = os.path.join(run_folder, f"{run_date.strftime('%Y%m%d')}_{plex_size}-Plex_Plate{plate}_RawData.{file_format}")
+                data_df = make_plate_data(plex_df, has_standard=has_standard, rng=rng)
+                write_raw = write_raw_xlsx if file_format == "xlsx" else write_raw_csv
+                write_raw(raw_file, get_plate_header(raw_file, run_date), data_df)
+                plate_count += 1
+        run += 1
+    return data_path, params_file
+
+
+def write_bench_config(bench_folder, config_file=DEFAULT_CONFIG, **kwargs):
+    '''
+    writes the config for the benchmark run based on the default config
+    all paths point into bench_folder, kwargs overwrite top-level keys
+    '''
+
+    config = load_config(config_file)
+    config['paths'].update(
+        base_path=os.path.abspath(bench_folder),
+        data_path="data",
+        output_path="output",
+        params_file="info/LuminexParams.xlsx",
+        fit_cache_file="cache/fit_cache.json"
+    )
+    config.update(use_existing=False, use_file="", raw_pattern="rawdata", conc_pattern="", plate_pattern="Plate", plex_pattern="Plex")
+    config.update(kwargs)
+    bench_config = os.path.join(bench_folder, "bench_config.yml")
+    with open(bench_config, "w") as stream:
+        dump(config, stream)
+    return bench_config
+
+
+def get_version():
+    '''
+    the git version of the code (if available)
+    '''
+
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        return ""
+
+
+def run_bench(bench_folder="bench", n_plates=100, n_workers=1, plot_fit=False, use_cache=False, results_format="parquet", write_excel=True, keep_data=False, report_file="", **data_config):
+    '''
+    generates the synthetic data (if not present), runs read_luminex_folder on it
+    and returns the report with the run time of every stage (in seconds)
+    stages inside the plate reading (read_raw incl. header, fit, read_conc) and the melt of the plate matrices are summed over all plates (and workers)
+    read_plates is the wall time of reading all plates
+    '''
+
+    data_config = dict(data_config, n_plates=n_plates)
+    data_info = os.path.join(bench_folder, "bench_data.json")
+    # reuse the data only if it has been created with the same settings
+    if keep_data and os.path.isfile(data_info):
+        with open(data_info, "r") as stream:
+            keep_data = json.load(stream) == data_config
+    if not keep_data:
+        show_output(f"Generating {n_plates} synthetic plates in {bench_folder}")
+        shutil.rmtree(bench_folder, ignore_errors=True)
+        start = perf_counter()
+        make_bench_data(bench_folder, **data_config)
+        show_output(f"Generated plates in {round(perf_counter() - start, 2)}s")
+        with open(data_info, "w") as stream:
+            json.dump(data_config, stream)
+    # start without fit cache
+    shutil.rmtree(os.path.join(bench_folder, "cache"), ignore_errors=True)
+
+    bench_config = write_bench_config(bench_folder, n_workers=n_workers, plot_fit=plot_fit, fit_cache=dict(use_cache=use_cache), results_format=results_format, write_excel=write_excel)
+    start = perf_counter()
+    plate_df, standard_df, _, data_df = read_luminex_folder(analysis_name="bench", config_file=bench_config)
+    total = perf_counter() - start
+
+    report = dict(
+        created=datetime.now().isoformat(timespec="seconds"),
+        version=get_version(),
+        host=platform.node(),
+        python=platform.python_version(),
+        packages={module.__name__: module.__version__ for module in [np, pd]},
+        data=data_config,
+        config=dict(n_workers=n_workers, plot_fit=plot_fit, use_cache=use_cache, results_format=results_format, write_excel=write_excel),
+        counts=dict(plates=len(plate_df.index), standards=len(standard_df.index), rows=len(data_df.index)),
+        stages={stage: round(seconds, 4) for stage, seconds in stage_times.items()},
+        total=round(total, 4),
+        plates_per_second=round(len(plate_df.index) / total, 3)
+    )
+    if report_file:
+        with open(report_file, "w") as stream:
+            json.dump(report, stream, indent=2)
+        show_output(f"Benchmark report written to {report_file}", color="success")
+    return report
+
+
+def compare_reports(report, baseline):
+    '''
+    shows the run time of every stage relative to a baseline report
+    '''
+
+    show_output(f"{'stage':<12}{'baseline':>10}{'current':>10}{'ratio':>8}")
+    stages = list(dict.fromkeys(list(baseline['stages']) + list(report['stages']))) + ['total']
+    for stage in stages:
+        old = baseline['total'] if stage == "total" else baseline['stages'].get(stage, np.nan)
+        new = report['total'] if stage == "total" else report['stages'].get(stage, np.nan)
+        ratio = new / old if old else np.nan
+        color = "warning" if ratio > 1.1 else "success" if ratio < 0.9 else "normal"
+        show_output(f"{stage:<12}{old:>10.3f}{new:>10.3f}{ratio:>8.2f}", color=color)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark read_luminex_folder on synthetic luminex plates")
+    parser.add_argument("--folder", default="bench", help="folder for the synthetic data and the output")
+    parser.add_argument("--plates", type=int, default=100, help="number of raw data files")
+    parser.add_argument("--plates-per-run", type=int, default=2, help="plates per run and plex")
+    parser.add_argument("--plexes", type=int, nargs="+", default=[11, 3], help="number of proteins of every plex")
+    parser.add_argument("--raw-format", choices=["xlsx", "csv", "mixed"], default="mixed")
+    parser.add_argument("--no-standard", type=float, default=0.1, help="fraction of plates without standard")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1, help="n_workers for reading the plates")
+    parser.add_argument("--plot", action="store_true", help="also render the fit plots (at most 10 runs)")
+    parser.add_argument("--cache", action="store_true", help="use the fit cache")
+    parser.add_argument("--format", choices=["parquet", "feather", ""], default="parquet", help="results_format of the columnar results (\"\" for none)")
+    parser.add_argument("--no-excel", action="store_true", help="do not write luminexcel.xlsx")
+    parser.add_argument("--keep-data", action="store_true", help="reuse the synthetic data of the last run")
+    parser.add_argument("--report", default="bench_report.json", help="json file for the report")
+    parser.add_argument("--baseline", default="", help="report of an earlier run to compare with")
+    args = parser.parse_args()
+
+    report = run_bench(
+        bench_folder=args.folder,
+        n_plates=args.plates,
+        n_workers=args.workers,
+        plot_fit=args.plot,
+        use_cache=args.cache,
+        results_format=args.format,
+        write_excel=not args.no_excel,
+        keep_data=args.keep_data,
+        report_file=args.report,
+        plates_per_run=args.plates_per_run,
+        plexes=args.plexes,
+        raw_format=args.raw_format,
+        no_standard=args.no_standard,
+        seed=args.seed
+    )
+    if args.baseline:
+        with open(args.baseline, "r") as stream:
+            compare_reports(report, json.load(stream))
+    else:
+        for stage, seconds in report['stages'].items():
+            show_output(f"{stage:<12}{seconds:>10.3f}")
+        show_output(f"{'total':<12}{report['total']:>10.3f}", color="success")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
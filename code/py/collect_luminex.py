@@ -1,116 +1,248 @@
 import pandas as pd
 import os
+import shutil
 import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
-from script_utils import show_output
+from script_utils import show_output, time_stage, stage_times, add_stage_times
 from lumipy_utils import *
 from compute_5PL import *
-from plot_fit import plot_fitting, plot_multi
+from fit_cache import *
+from plot_queue import PlotQueue
+from lumi_store import (
+    get_results_folder, get_result_file, get_plate_key, has_results, load_manifest, get_new_plates, 
+    write_results, read_results, read_table, read_protein_plates, update_table, write_results_excel
+)
+from DBcols import set_key_dtypes, concat_keyed
+from plate_matrix import PlateMatrix
 
 
-def fit_standard_row(standard_row, data_df=pd.DataFrame(), **fit_config):
+def fit_standard_row(standard_row, plate_matrix=None, **fit_config):
     '''
     for every row of the standards the fit_params and other coefficients
+    the conc and Fpos of the protein are stored in the plate_matrix
     pass kwargs for standards and plotting
     '''
     
-    # filter for the protein
-    s = data_df.loc[data_df['Protein'] == standard_row['Protein'], :]  
-    
-    standard_row = analyse_standard(standard_row, s, **fit_config)
+    # the view of the protein
+    s = plate_matrix.get_protein(standard_row['Protein'])
+    # use the precomputed fit from fit_plate_standards
+    fit = standard_row['fit'] if 'fit' in standard_row.index else None
+    standard_row = analyse_standard(standard_row.drop('fit', errors='ignore'), s, fit=fit, **fit_config)
     # get the confidence information about the control samples
     standard_row = analyse_control(standard_row, s)
     # get the samples and compute the sample values
 
     # if you want to exclude the controls and standards
     # s = s.loc[s['Type'] == "X", :]
-    standard_row['data'] = compute_conc(s, standard_row)
+    s = compute_conc(s, standard_row)
+    standard_row['data'] = plate_matrix.set_conc(standard_row['Protein'], s['conc'], s['Fpos'])
 
     return standard_row
 
 
+def fit_plate_standards(standard_df, plate_matrix, dilution=4, fit_cache=None, **fit_config):
+    '''
+    fits the standard curves of all proteins in standard_df at once using fit_standards
+    with a fit_cache:
+        - standards with unchanged FI values, S1, dilution and fit_config are taken from the cache
+        - all other standards start from the last good params for the same Protein/Plex
+    returns a list of (params, R) aligned to the rows of standard_df
+    '''
+
+    standard_rows = [standard_row for _, standard_row in standard_df.iterrows()]
+    ss_list = [
+        get_standard_series(standard_row, plate_matrix.get_protein(standard_row['Protein']), dilution=dilution)
+        for standard_row in standard_rows
+    ]
+    fits = [None] * len(ss_list)
+    p0 = [P0] * len(ss_list)
+    if fit_cache is not None:
+        fit_keys = [get_fit_key(ss, standard_row['S1'], dilution=dilution, **fit_config) for ss, standard_row in zip(ss_list, standard_rows)]
+        for i, standard_row in enumerate(standard_rows):
+            fits[i] = get_cached_fit(fit_cache, fit_keys[i])
+            if (warm_params := get_warm_start(fit_cache, standard_row['Protein'], standard_row['Plex'])):
+                p0[i] = warm_params
+
+    # only fit the standards that are not cached
+    todo = [i for i, fit in enumerate(fits) if fit is None]
+    params, R, status = fit_standards([ss_list[i] for i in todo], p0=[p0[i] for i in todo], **fit_config)
+    for j, i in enumerate(todo):
+        fits[i] = (params[j], R[j])
+        if fit_cache is not None:
+            store_fit(fit_cache, fit_keys[i], standard_rows[i]['Protein'], standard_rows[i]['Plex'], params[j], R[j], status[j])
+    return fits
+
+
 def apply_external_standards(data_df, standard_df, fit_config):
     '''
     computes concentrations for all samples for all available standards
+    the summary statistics are computed on the (rows x runs) matrices
+    the conc{run} and Fpos{run} columns are only added once for the output
     '''
 
-    for _, standard_row in standard_df.iterrows():
-        data_df = compute_external_fit(standard_row, df=data_df)
+    runs, conc, Fpos = get_external_conc(data_df, standard_df)
     
     # now get the summary statistics
-    sum_cols = ['concMean', 'concStd', 'FposMean']
-    data_df.loc[:, sum_cols] = data_df.apply(mean_row, standard_df=standard_df, axis=1, **fit_config)
+    mean_df = get_external_means(conc, Fpos, **fit_config).set_index(data_df.index)
+    # interleave conc{run} and Fpos{run} columns
+    ext_df = pd.DataFrame(
+        np.stack([conc, Fpos], axis=2).reshape(len(data_df.index), -1),
+        columns=[f"{col}{run}" for run in runs for col in ['conc', 'Fpos']],
+        index=data_df.index
+    )
+    data_df = pd.concat([data_df.drop(list(ext_df.columns) + list(mean_df.columns), axis=1, errors="ignore"), ext_df, mean_df], axis=1)
     return data_df
 
 
-def make_protein_summary(data_df, minFpos=0):
+def fill_external_Fpos(data_df):
     '''
-    creates summary statistics for proteins
+    samples without conc from their own standard get the maximum of all external Fpos as Fpos
     '''
 
-    # create an Fpos from the maximum of all external Fpos
-    data_df.loc[data_df['conc'] != data_df['conc'], "Fpos"] = data_df.loc[data_df['conc'] != data_df['conc'], [col for col in data_df.columns if re.match("Fpos[0-9]+", col)]].max(axis=1)
+    no_conc = data_df['conc'] != data_df['conc']
+    data_df.loc[no_conc, "Fpos"] = data_df.loc[no_conc, [col for col in data_df.columns if re.match("Fpos[0-9]+", col)]].max(axis=1)
+    return data_df
 
-    
-    all_df = data_df.groupby("Protein").agg(
+
+def get_plate_stats(data_df, minFpos=0, **kwargs):
+    '''
+    the partial protein statistics of every plate (sums, counts, min and max)
+    the stats of any set of plates add up to their ProteinStats (see combine_plate_stats)
+    '''
+
+    valid = data_df['conc'] == data_df['conc']
+    good = data_df['Fpos'] > minFpos
+    df = data_df.loc[:, ['Run', 'Plex', 'Plate', 'Protein', 'FI', 'Fpos']].assign(
+        good=good,
+        FposValid=data_df['Fpos'].where(valid),
+        goodValid=good & valid,
+        valid=valid,
+        FposMeanExt=data_df['FposMean'].where(~valid),
+        goodExt=good & ~valid,
+        ext=~valid
+    )
+    stats_df = df.groupby(['Run', 'Plex', 'Plate', 'Protein'], observed=True).agg(
         FImin=pd.NamedAgg("FI", "min"),
         FImax=pd.NamedAgg("FI", "max"),
-        FImean=pd.NamedAgg("FI", "mean"),
-        FposMean=pd.NamedAgg("Fpos", "mean"),
-        goodFposCount=pd.NamedAgg("Fpos", lambda fpos: np.sum(fpos > minFpos)),
-        Count=pd.NamedAgg(f"Fpos", "size")
-    )
-        
-    
-    ### data with standard
-    valid_df = data_df.query('conc == conc').groupby("Protein").agg(
-        FposMeanValid=pd.NamedAgg(f"Fpos", "mean"),
-        goodFposCountValid=pd.NamedAgg(f"Fpos", lambda fpos: np.sum(fpos > minFpos)),
-        CountValid=pd.NamedAgg(f"Fpos", "size")
-    )
-    
-    ### external data
-    ext_df = data_df.query('conc != conc').groupby("Protein").agg(
-        FposMeanExt=pd.NamedAgg(f"FposMean", "mean"),
-        goodFposCountExt=pd.NamedAgg(f"Fpos", lambda fpos: np.sum(fpos > minFpos)),
-        CountExt=pd.NamedAgg(f"Fpos", "size")
+        FIsum=pd.NamedAgg("FI", "sum"),
+        FIn=pd.NamedAgg("FI", "count"),
+        Fpossum=pd.NamedAgg("Fpos", "sum"),
+        Fposn=pd.NamedAgg("Fpos", "count"),
+        goodFposCount=pd.NamedAgg("good", "sum"),
+        Count=pd.NamedAgg("Fpos", "size"),
+        FposValidsum=pd.NamedAgg("FposValid", "sum"),
+        FposValidn=pd.NamedAgg("FposValid", "count"),
+        goodFposCountValid=pd.NamedAgg("goodValid", "sum"),
+        CountValid=pd.NamedAgg("valid", "sum"),
+        FposMeanExtsum=pd.NamedAgg("FposMeanExt", "sum"),
+        FposMeanExtn=pd.NamedAgg("FposMeanExt", "count"),
+        goodFposCountExt=pd.NamedAgg("goodExt", "sum"),
+        CountExt=pd.NamedAgg("ext", "sum")
     )
-    sum_df = all_df.join(valid_df).join(ext_df)
-    
-    for col in sum_df.columns:
-        if "Count" in col:
-            sum_df.loc[:, col] = sum_df[col].fillna(0).astype(int)
-    
-    return sum_df.reset_index(drop=False), data_df
+    # the stats depend on minFpos
+    return stats_df.reset_index().assign(minFpos=minFpos)
+
+
+def combine_plate_stats(stats_df):
+    '''
+    adds up the plate stats (from get_plate_stats) to the summary statistics per protein
+    the means of proteins without values (like FposMeanValid without own standard) are NaN
+    '''
+
+    count_cols = ['goodFposCount', 'Count', 'goodFposCountValid', 'CountValid', 'goodFposCountExt', 'CountExt']
+    sum_cols = [col + suff for col in ['FI', 'Fpos', 'FposValid', 'FposMeanExt'] for suff in ["sum", "n"]]
+    df = stats_df.groupby("Protein", observed=True).agg(
+        FImin=pd.NamedAgg("FImin", "min"),
+        FImax=pd.NamedAgg("FImax", "max"),
+        **{col: pd.NamedAgg(col, "sum") for col in sum_cols + count_cols}
+    ).sort_index()
+
+    def mean(col):
+        return df[f"{col}sum"] / df[f"{col}n"].where(df[f"{col}n"] > 0)
+
+    sum_df = pd.DataFrame(dict(
+        FImin=df['FImin'],
+        FImax=df['FImax'],
+        FImean=mean("FI"),
+        FposMean=mean("Fpos"),
+        goodFposCount=df['goodFposCount'],
+        Count=df['Count'],
+        FposMeanValid=mean("FposValid"),
+        goodFposCountValid=df['goodFposCountValid'],
+        CountValid=df['CountValid'],
+        FposMeanExt=mean("FposMeanExt"),
+        goodFposCountExt=df['goodFposCountExt'],
+        CountExt=df['CountExt']
+    ))
+    sum_df.loc[:, count_cols] = sum_df[count_cols].astype(int)
+    return sum_df.reset_index(drop=False)
+
+
+def make_protein_summary(data_df, minFpos=0, **kwargs):
+    '''
+    creates summary statistics for proteins (from the plate stats, see get_plate_stats)
+    '''
+
+    data_df = fill_external_Fpos(data_df)
+    return combine_plate_stats(get_plate_stats(data_df, minFpos=minFpos)), data_df
+
 
+def get_stored_plate_stats(results_folder, minFpos=0, **kwargs):
+    '''
+    the PlateStats of a store
+    stores without them (or with stats for another minFpos) get them computed once from all partitions
+    '''
+
+    manifest = load_manifest(results_folder)
+    if os.path.isfile(stats_file := get_result_file(results_folder, "PlateStats", manifest['results_format'])):
+        if ((stats_df := read_table(stats_file))['minFpos'] == minFpos).all():
+            return stats_df
+    show_output(f"Computing the plate stats of all plates in {results_folder}")
+    return get_plate_stats(read_results(results_folder, tables=['tidyDataFull'])['tidyDataFull'], minFpos=minFpos)
 
-def read_raw_plate(plate, control_df, config={}):
+
+def read_stored_results(results_folder):
+    '''
+    the output of read_luminex_folder if no plate has been added to a store:
+    the stored Plates, Standards and ProteinStats and an empty tidyDataFull
+    '''
+
+    stored = read_results(results_folder, tables=['Plates', 'Standards', 'ProteinStats'])
+    return stored['Plates'], stored['Standards'], stored['ProteinStats'], pd.DataFrame(columns=load_manifest(results_folder)['tidy_cols'])
+
+
+def read_raw_plate(plate, control_df, config={}, fit_cache=None):
     '''
     reads a Luminex raw data file
     autodetects format
+    fit_cache (from load_fit_cache) is used for the standard fits and updated with new fits
     returns: 
         plate_info as series with information about the plate
         standard_df with computed fit params
-        raw_df containing raw FI and computed concentrations
+        plate_matrix containing raw FI and computed concentrations (see PlateMatrix)
     '''
 
     # set the raw_file with the data_path
     raw_file = os.path.join(config['data_path'], plate['rawPath'])
+    # show the process id if plates are read in parallel
+    multi = config.get('n_workers', 1) > 1
 
-    ############## HEADER ##########################
+    ############## HEADER AND RAW DATA ############
     ################################################
     # read file depending on extension 
     is_excel = raw_file.split(".")[-1].startswith("xls")
-    show_output(f"Run {plate['Run']} {plate['Plex']} Plate{plate['Plate']}: Loading raw data file {plate['rawPath']}.")
-    # read header and add 
-    plate = pd.concat([plate,read_header(raw_file, is_excel)])
-
-    ############## READ RAW ########################
-    ################################################
-    if is_excel:
-        data_df = pd.read_excel(raw_file, skiprows=7)
-    else:
-        data_df = pd.read_csv(raw_file, skiprows=7, sep=";", encoding = "ISO-8859-1")
+    show_output(f"Run {plate['Run']} {plate['Plex']} Plate{plate['Plate']}: Loading raw data file {plate['rawPath']}.", multi=multi)
+    # read header and data
+    with time_stage("read_raw"):
+        # header and data (with float FI) in one pass over the file
+        if is_excel:
+            plate_info, data_df = read_excel_plate(raw_file)
+        else:
+            plate_info, data_df = read_csv_plate(raw_file)
+    # add the header info
+    plate = pd.concat([plate, rename_plate_info(plate_info)])
     data_df = data_df.rename({'Sampling Errors':'SE'}, axis=1)
 
 
@@ -140,31 +272,27 @@ def read_raw_plate(plate, control_df, config={}):
     # check for consistency in Luminex Params
     if (len(miss_prots := standard_df.loc[standard_df['Protein'] != standard_df['Protein'], 'PlexName'])):
         miss_list = '; '.join([f'<{prot}>' for prot in miss_prots])
-        show_output(f"The following Proteins were not found in the Luminex Params [{miss_list}]", color="warning")
+        show_output(f"The following Proteins were not found in the Luminex Params [{miss_list}]", color="warning", multi=multi)
         return
     # apply the cleaned gene names to the column names
     data_df.columns = list(data_df.columns[:2]) + list(standard_df['Protein']) + list(data_df.columns[-1:])
 
-    ############## TIDY ############################
+    ############## PLATE MATRIX ####################
     ################################################
-    # tidy the data into Well-Type-SamplingErrors
-    raw_df = data_df.melt(id_vars=['Well', 'Type', 'SE'], var_name="Protein", value_name="FI")
-    raw_df.loc[:, 'FI'] = raw_df['FI'].str.replace(",", ".").str.replace(r"***", "0", regex=False).astype(float)
-    # add RunPlexPlate and reorder cols
-    data_cols = list(raw_df.columns)
+    # keep the data as (wells x proteins) arrays (the FI are already float from the readers)
+    # the long tidy frame is only created by to_frame when the plates are combined
     base_cols = ['Run', 'Plex', 'Plate']
-    raw_df.loc[:, base_cols] = list(plate.loc[base_cols])
-    raw_df = raw_df.loc[:, base_cols + data_cols]
+    plate_matrix = PlateMatrix.from_data_df(data_df, *plate.loc[base_cols])
 
     ############ GET PLATE INFO ####################
     ################################################
     # detect if control has been included
-    plate['hasControl'] = len(raw_df.loc[raw_df['Type'].str.match(r"^C[12]$"), :].index) > 0
+    plate['hasControl'] = bool(plate_matrix.match_types(r"^C[12]$").any())
     # detect if there is any data
-    plate['DataWells'] = (has_data := len(data_df.query('Type == "X"')))
+    plate['DataWells'] = (has_data := int(np.sum(plate_matrix.types == "X")))
     if not has_data:
         if config['verbose']:
-            show_output(f"Plate {plate['rawPath']} has no data!", color = "warning")
+            show_output(f"Plate {plate['rawPath']} has no data!", color = "warning", multi=multi)
 
     ############## FIT STANDARD ####################
     ################################################
@@ -175,30 +303,27 @@ def read_raw_plate(plate, control_df, config={}):
         standard_cols = list(standard_df.columns)
         standard_df.loc[:, base_cols] = list(plate.loc[base_cols])
         standard_df = standard_df.loc[:, base_cols + standard_cols]
-        # calculate the standard fit and add to standard_df
-        standard_df = standard_df.apply(fit_standard_row, data_df=raw_df, axis=1, **config['fitting'])
-        if config['plot_fit']:
-            standard_df.apply(plot_fitting, axis=1, **config['plotting'], verbose=config['verbose'])
+        with time_stage("fit"):
+            # fit all standard curves of the plate in one batch
+            standard_df['fit'] = fit_plate_standards(standard_df, plate_matrix, fit_cache=fit_cache, **config['fitting'])
+            # calculate the standard fit and add to standard_df (conc and Fpos go into the plate_matrix)
+            standard_df = standard_df.apply(fit_standard_row, plate_matrix=plate_matrix, axis=1, **config['fitting'])
+        # the fit plots are rendered in read_luminex_folder (PlotQueue)
         # #####
         #     print(standard_df['Type'].unique())
         # #####
-
-        # extract the data from the standard_df into raw_df
-        raw_df = pd.concat(list(standard_df['data']))
         # standard_df = standard_df.drop(['ss', 'sc', 'data'], axis=1)
     else:
         # return no standard_df if there is no standard_data
         # standard_df = None
         if config['verbose']:
-            show_output(f"Plate {plate['rawPath']} has no standards!", color = "warning")
+            show_output(f"Plate {plate['rawPath']} has no standards!", color = "warning", multi=multi)
         if has_data:
-            # at least get the data - nothing else to do, already stored in raw_df
+            # at least get the data - nothing else to do, already stored in plate_matrix
             pass
         standard_df = pd.DataFrame()
 
-    raw_df = raw_df.sort_values(['Run','Plex', 'Type', 'Protein', 'Well'])
-
-    return plate, standard_df, raw_df
+    return plate, standard_df, plate_matrix
 
 
 def read_conc_plate(plate, control_df, config={}):
@@ -209,14 +334,15 @@ def read_conc_plate(plate, control_df, config={}):
 
     # output empty dataframe with respective columns for compatibility
     conc_file = os.path.join(config['data_path'], plate['concPath'])
+    multi = config.get('n_workers', 1) > 1
     if conc_file:
         # read the concentration
-        show_output(f"Run {plate['Run']} {plate['Plex']} Plate{plate['Plate']}: Loading precomputed concentrations from {plate['concPath']}")
+        show_output(f"Run {plate['Run']} {plate['Plex']} Plate{plate['Plate']}: Loading precomputed concentrations from {plate['concPath']}", multi=multi)
         conc_df = pd.read_excel(conc_file, skiprows=7, sheet_name="Obs Conc").iloc[1:, :].reset_index(drop=True).rename(
             {'Unnamed: 0': 'Type', 'Unnamed: 1': 'Well'}, axis=1).dropna(subset="Well")
     else:
         # return an empty df if there is no conc file
-        show_output(f"Run {plate['Run']} {plate['Plex']} Plate{plate['Plate']}: No concentration file found!", color="warning")
+        show_output(f"Run {plate['Run']} {plate['Plex']} Plate{plate['Plate']}: No concentration file found!", color="warning", multi=multi)
         return pd.DataFrame()
     # remove external standards (eS1...)
     conc_df = conc_df.loc[~(conc_df['Type'].str.match(r"[eE][SC][1-8]")), :].reset_index(drop=True)
@@ -234,10 +360,64 @@ def read_conc_plate(plate, control_df, config={}):
     return conc_df.loc[:, base_cols + org_cols]
 
 
+def read_plate(plate, control_df, config={}, fit_cache=None):
+    '''
+    reads the raw data and (if present) the precomputed concentrations of one plate
+    the fit_cache is only read, new fits are returned as cache_updates
+    returns plate, standard_df, plate_matrix, cache_updates
+    '''
+
+    plate_cache = overlay_fit_cache(fit_cache) if fit_cache is not None else None
+    plate, standard_df, plate_matrix = read_raw_plate(plate, control_df, config=config, fit_cache=plate_cache)
+    if plate['concPath']:
+        with time_stage("read_conc"):
+            conc_df = read_conc_plate(plate, control_df, config=config)
+        plate_matrix.add_concCI(conc_df)
+    cache_updates = get_cache_updates(plate_cache) if plate_cache is not None else None
+    return plate, standard_df, plate_matrix, cache_updates
+
+
+# the fit_cache of a plate worker process (set once per process by init_plate_worker)
+worker_fit_cache = None
+
+
+def init_plate_worker(fit_cache):
+    '''
+    initializer for the process pool: ships the fit_cache once per worker instead of once per plate
+    '''
+
+    global worker_fit_cache
+    worker_fit_cache = fit_cache
+
+
+def read_plate_worker(plate, control_df, config={}):
+    '''
+    read_plate for the process pool using the fit_cache of the worker
+    returns the read_plate result and the stage_times of that plate
+    '''
+
+    stage_times.clear()
+    return read_plate(plate, control_df, config=config, fit_cache=worker_fit_cache), dict(stage_times)
+
+
+def collect_worker_times(worker_results):
+    '''
+    adds the stage_times of the plate workers to the stage_times of this process
+    and passes on the read_plate results
+    '''
+
+    for result, worker_times in worker_results:
+        add_stage_times(worker_times)
+        yield result
+
+
 def read_luminex_folder(analysis_name="results", config_file={}, **kwargs):
     '''
     read all the luminex data from one folder
-    
+    returns plate_df, standard_df, sum_df (ProteinStats) and data_full (tidyDataFull) in every mode
+    when appending to a store, Plates, Standards and ProteinStats cover the complete store and
+    tidyDataFull only the plates written in this run (the new plates and the stored plates computed again)
+    the complete data is available through LumiStore or read_results
     '''
     
     ############## INIT ############################
@@ -245,6 +425,8 @@ def read_luminex_folder(analysis_name="results", config_file={}, **kwargs):
     base_cols = ['Run', 'Plex', 'Plate']
     data_cols = base_cols + ['Well', 'Type', 'Protein']
     
+    # the run times of the stages of this analysis (see script_utils.time_stage)
+    stage_times.clear()
     # load the config_file and pass extra kwargs
     show_output(f"Loading Luminex configs from {config_file}.")
     config = load_lumi_config(config_file=config_file, analysis_name=analysis_name, **kwargs)
@@ -259,31 +441,51 @@ def read_luminex_folder(analysis_name="results", config_file={}, **kwargs):
         show_output(f"Luminex params file {params_file} cannot be found!!! Aborting", color="warning")
         return
     # load in the controls from the params
-    control_df = pd.read_excel(params_file, sheet_name="Controls").merge(pd.read_excel(params_file, sheet_name="Proteins").loc[:, ['PlexName', 'Protein']]).loc[:, ['PlexName', 'Protein', 'C1', 'C2', 'S1']]
+    params = read_excel_sheets(params_file, ["Controls", "Proteins"], use_cache=config.get('excel_cache', True))
+    control_df = params['Controls'].merge(params['Proteins'].loc[:, ['PlexName', 'Protein']]).loc[:, ['PlexName', 'Protein', 'C1', 'C2', 'S1']]
     
     # create the output file and check for existing
     excel_file = os.path.join(config['analysis_folder'], "luminexcel.xlsx")
+    results_format = config.get('results_format', "")
+    results_folder = get_results_folder(config['analysis_folder'])
     csv_file = os.path.join(config['analysis_folder'], "luminextern.csv.gz")
 
     ############## DETECT PLATES IN FOLDER AND INTEGRATE OLD #########
     ################################################
     # create this empty old_data marker
     use_old = 0
+    # an existing store only gets the partitions of the new plates
+    append = False
     
     if (old_file :=config['use_file']):
-        if os.path.isfile(old_file):
+        if os.path.isdir(old_file) and has_results(old_file):
+            # a store is copied to the results_folder of this analysis and gets the new plates appended
+            if os.path.abspath(old_file) != os.path.abspath(results_folder):
+                show_output(f"Copying preexisting results from {old_file} to {results_folder}")
+                shutil.rmtree(results_folder, ignore_errors=True)
+                shutil.copytree(old_file, results_folder)
+            append = True
+        elif os.path.isfile(old_file):
             old_data = load_existing(old_file)
             use_old = 1
         else:
             show_output(f"{old_file} for appending new data cannot be found! Please check!", color="warning")
             return
-    else:
-        if os.path.isfile(excel_file) and config['use_existing']:
+    elif config['use_existing']:
+        # prefer the columnar results over the excel file
+        if results_format and has_results(results_folder):
+            append = True
+        elif os.path.isfile(excel_file):
             old_data = load_existing(excel_file)
             use_old = 2
 
+    # load the cache for the standard fits
+    fit_cache_config = config.get('fit_cache', {})
+    fit_cache = load_fit_cache(config['fit_cache_file']) if fit_cache_config.get('use_cache', False) else None
+
     # load the plates and remove the duplicates from old runs
-    plate_df = get_luminex_plates(**config)
+    with time_stage("discovery"):
+        plate_df = get_luminex_plates(**config)
 
     # exit if no patterns have been set
     if isinstance(plate_df, str):
@@ -301,6 +503,13 @@ def read_luminex_folder(analysis_name="results", config_file={}, **kwargs):
         )
         return plate_df, pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
 
+    if append:
+        # only read the plates that are not stored yet or whose source files have changed
+        plate_df = get_new_plates(plate_df, results_folder, data_path=config['data_path'])
+        if not len(plate_df.index):
+            show_output(f"No new data found in {config['data_path']}. Exiting!", color="success")
+            return read_stored_results(results_folder)
+
     if use_old:
         # only use the new plates (drop duplicates)
         old_plates = old_data['Plates'].loc[:, base_cols + ['rawPath', 'concPath']]
@@ -331,97 +540,172 @@ def read_luminex_folder(analysis_name="results", config_file={}, **kwargs):
     plate_rows = []
     standard_dfs = []
     data_dfs = []
-    # cycle through files using df.iterrows
+    # get the plates with raw data files
+    raw_plates = []
     for _, plate in plate_df.iterrows():
         if not plate['rawPath']:
             show_output(f"Run {plate['Run']} {plate['Plex']} Plate{plate['Plate']}: No raw data file detected. Skipping {plate['concPath']}", color="warning")
             continue
-        plate, standard_df, data_df = read_raw_plate(plate, control_df, config=config)
-        if plate['concPath']:
-            conc_df = read_conc_plate(plate, control_df, config=config)
-            data_df = data_df.merge(conc_df, how="left")
-        plate_rows.append(plate)
-        standard_dfs.append(standard_df)
-        data_dfs.append(data_df)
-    
-    # combine to dfs
-    if len(plate_rows):
-        plate_df = pd.DataFrame(plate_rows)
-    else:
-        show_output(f"No new data found in {config['data_path']}. Exiting!", color="success")
-        if use_old:
-            # for consistency, return the old data if nothing new is there
-            return old_data['Plates'], old_data['Standards'], old_data['ProteinStats'], old_data['tidyData']
-        # really nothing there
+        raw_plates.append(plate)
+
+    # the plots are rendered in the background while the plates are read
+    plot_queue = PlotQueue(config.get('plot_workers', 2), verbose=config['verbose']) if config['plot_fit'] else None
+    try:
+        # read the plates (in parallel if n_workers > 1)
+        # results come back in the order of plate_df (sorted by Run, Plex, Plate)
+        if (n_workers := config.get('n_workers', 1)) > 1 and len(raw_plates) > 1:
+            show_output(f"Reading {len(raw_plates)} plates using {n_workers} processes")
+            pool = ProcessPoolExecutor(max_workers=n_workers, initializer=init_plate_worker, initargs=(fit_cache,))
+            plate_results = collect_worker_times(pool.map(read_plate_worker, raw_plates, repeat(control_df), repeat(config)))
         else:
-            # for consistency, return 4 empty dfs 
-            return [pd.DataFrame()] * 4
-    # maybe no new standard has been added
-    if len(standard_dfs):
-        standard_df = pd.concat(standard_dfs).sort_values(base_cols + ['Protein']).drop_duplicates(base_cols + ['Protein']).reset_index(drop=True)
-    data_df = pd.concat(data_dfs).sort_values(['Run', 'Plex', 'Protein', 'Type', 'Well']).reset_index(drop=True)
-
-    ############## ADD EXTERNAL STANDARDS ##########
-    ################################################
-    show_output("Computing concentrations from external standards")
-    data_cols = list(data_df.columns)
-    sum_cols = ['concMean', 'concStd', 'FposMean']
-    data_df = apply_external_standards(data_df, standard_df, config['fitting'])
-
-
-    ############## MULTIFIT PLOT ###################
-    ################################################
-    # plotting should only be done on new data
-    # set the run colors for this folder and load into configs
-    if config['plot_fit']:
-        config['plotting']['run_colors'] = {run:config['plotting']['use_colors'][i] for i, run in enumerate(standard_df['Run'].unique())}
-        for protein in standard_df['Protein'].unique():
-            _ = plot_multi(standard_df, data_df, protein=protein, verbose=config['verbose'], **config['plotting'])
-
-
-    ############## COMBINE WITH OLD ################
-    ################################################
-    if use_old:
-        # add the new stuff to the old sheets and sort again
-        if use_old == 1:
-            show_output(f"Combining preexisting data from {config['use_file']} and new data to {excel_file}")
-        if use_old == 2:
-            show_output(f"Adding new data to {excel_file}")
-        plate_df = pd.concat([old_data['Plates'], plate_df]).sort_values(base_cols).reset_index(drop=True)
-        standard_df = pd.concat([old_data['Standards'], standard_df]).sort_values(base_cols + ['Protein']).drop_duplicates().reset_index(drop=True)
-        data_df = pd.concat([old_data['tidyData'], data_df]).sort_values(data_cols).drop_duplicates().reset_index(drop=True)
-    else:
-        show_output(f"Writing excel output to {excel_file}")
-
-
-    ############## PROTEIN SUMMARY #################
-    ################################################
-    # protein summary should be performed on combined data
-    sum_df, data_df = make_protein_summary(data_df, **config['summary'])
-    # reduce the data_df to fewer output
-    data_full = data_df.copy()
-    data_df = data_df.loc[:, data_cols + sum_cols]
-
-
-    ############ OUTPUT #############################
-    # ##### output
-    if config['write_excel']:
-        with pd.ExcelWriter(excel_file, mode="w") as writer:
-            plate_df.to_excel(writer, sheet_name="Plates", index=False)
-            # drop the dfs in standard_df for output
-            standard_df.drop(['ss', 'sc', 'data'], axis=1).to_excel(writer, sheet_name="Standards", index=False)
-            sum_df.to_excel(writer, sheet_name="ProteinStats", index=False)
-            data_df.to_excel(writer, sheet_name="tidyData", index=False)
-            data_full.to_excel(writer, sheet_name="tidyDataFull", index=False)
-            if config['output_untidy']:
-                # get the all the proteins that had been used in this setup
-                used_proteins = list(set(control_df['Protein']).intersection(data_df['Protein'].unique()))
-                for col in ['FI', 'conc', 'concCI', 'Fpos']:
-                    set_cols = ['Run', 'Plex', 'Plate', 'Well', 'Type', 'SE']
-                    pivot_df = data_df.set_index(set_cols).pivot(columns="Protein", values=col).loc[:, used_proteins].dropna(how="all").reset_index(drop=False)
-                    pivot_df.to_excel(writer, sheet_name=col, index=False)
-
-    show_output(f"Writing complete external conc file output to {csv_file}")
-    data_full.to_csv(csv_file, index=False, sep="\t", compression="gzip")
-    show_output(f"Finished collecting Luminex data for folder {config['data_path']}", color="success")
-    return plate_df, standard_df, sum_df, data_full
+            pool = None
+            plate_results = (read_plate(plate, control_df, config=config, fit_cache=fit_cache) for plate in raw_plates)
+
+        try:
+            with time_stage("read_plates"):
+                for plate, standard_df, plate_matrix, cache_updates in plate_results:
+                    plate_rows.append(plate)
+                    standard_dfs.append(standard_df)
+                    # the long tidy frame of the plate
+                    with time_stage("melt"):
+                        data_dfs.append(plate_matrix.to_frame())
+                    if fit_cache is not None:
+                        update_fit_cache(fit_cache, cache_updates)
+                    if plot_queue and plate['hasStandard']:
+                        plot_queue.add_fitting(standard_df, **config['plotting'])
+        finally:
+            if pool:
+                pool.shutdown(cancel_futures=True)
+
+        # store the new fits
+        if fit_cache is not None:
+            save_fit_cache(fit_cache, config['fit_cache_file'], **fit_cache_config)
+
+        # combine to dfs
+        if len(plate_rows):
+            plate_df = pd.DataFrame(plate_rows)
+        else:
+            show_output(f"No new data found in {config['data_path']}. Exiting!", color="success")
+            if append:
+                return read_stored_results(results_folder)
+            if use_old:
+                # for consistency, return the old data if nothing new is there
+                return old_data['Plates'], old_data['Standards'], old_data['ProteinStats'], old_data['tidyDataFull']
+            # really nothing there
+            else:
+                # for consistency, return 4 empty dfs 
+                return [pd.DataFrame()] * 4
+        # maybe no new standard has been added
+        if len(standard_dfs := [df for df in standard_dfs if len(df.index)]):
+            standard_df = pd.concat(standard_dfs).sort_values(base_cols + ['Protein']).drop_duplicates(base_cols + ['Protein']).reset_index(drop=True)
+        else:
+            standard_df = pd.DataFrame(columns=base_cols + ['Protein', 'curve'])
+        # the key columns are categoricals from here on
+        data_df = set_key_dtypes(pd.concat(data_dfs)).sort_values(['Run', 'Plex', 'Protein', 'Type', 'Well']).reset_index(drop=True)
+        sum_cols = ['concMean', 'concStd', 'FposMean']
+        if append:
+            # new plates without standard lack the conc columns of the stored data
+            stored_cols = [col for col in load_manifest(results_folder)['tidy_cols'] if col not in sum_cols]
+            data_df = data_df.reindex(columns=stored_cols + [col for col in data_df.columns if col not in stored_cols])
+
+        ############## ADD EXTERNAL STANDARDS ##########
+        ################################################
+        show_output("Computing concentrations from external standards")
+        data_cols = list(data_df.columns)
+        n_new = len(data_df.index)
+        with time_stage("external"):
+            # the new plates of a store also use the stored standards (new standards replace stored ones of the same plate)
+            ext_standard_df = standard_df
+            if append:
+                ext_standard_df = pd.concat([read_results(results_folder, tables=['Standards'])['Standards'], standard_df])
+                ext_standard_df = ext_standard_df.drop_duplicates(base_cols + ['Protein'], keep="last").sort_values(base_cols + ['Protein'])
+                # every standard applies to all samples of its protein and the conc above the ceiling of a curve depend on all of them
+                # so the stored plates sharing proteins with the new plates are computed again together with the new plates
+                # (only these partitions are read and rewritten, all other plates of the store are not touched)
+                new_keys = [get_plate_key(*plate[base_cols]) for _, plate in plate_df.iterrows()]
+                if len((update_df := read_protein_plates(results_folder, data_df['Protein'].unique(), exclude=new_keys)).index):
+                    show_output(f"Updating the external concentrations of {update_df.groupby(base_cols, observed=True).ngroups} stored plates")
+                    data_df = concat_keyed([data_df, update_df]).reset_index(drop=True)
+            data_df = apply_external_standards(data_df, ext_standard_df, config['fitting'])
+
+
+        ############## MULTIFIT PLOT ###################
+        ################################################
+        # plotting should only be done on new data
+        # set the run colors for this folder and load into configs
+        if plot_queue:
+            config['plotting']['run_colors'] = {run:config['plotting']['use_colors'][i] for i, run in enumerate(standard_df['Run'].unique())}
+            plot_queue.add_multi(standard_df, data_df.iloc[:n_new], **config['plotting'])
+
+
+        ############## COMBINE WITH OLD ################
+        ################################################
+        if append:
+            show_output(f"Adding new data to {results_folder}")
+        elif use_old:
+            # add the new stuff to the old sheets and sort again
+            if use_old == 1:
+                show_output(f"Combining preexisting data from {config['use_file']} and new data to {excel_file}")
+            if use_old == 2:
+                show_output(f"Adding new data to {excel_file}")
+            plate_df = pd.concat([old_data['Plates'], plate_df]).sort_values(base_cols).reset_index(drop=True)
+            # the fit arrays (ss, sc, data) are not hashable, new standards replace the old ones of the same plate
+            standard_df = pd.concat([old_data['Standards'], standard_df]).drop_duplicates(base_cols + ['Protein'], keep="last").sort_values(base_cols + ['Protein']).reset_index(drop=True)
+            data_df = concat_keyed([old_data['tidyData'], data_df]).sort_values(data_cols).drop_duplicates().reset_index(drop=True)
+
+
+        ############## PROTEIN SUMMARY #################
+        ################################################
+        # protein summary should be performed on combined data
+        # it is added up from the stats per plate, a store only needs the stats of the written plates
+        with time_stage("summary"):
+            data_df = fill_external_Fpos(data_df)
+            stats_df = get_plate_stats(data_df, **config['summary'])
+            all_stats_df = update_table(get_stored_plate_stats(results_folder, **config['summary']), stats_df, base_cols + ['Protein']) if append else stats_df
+            sum_df = combine_plate_stats(all_stats_df)
+        # reduce the data_df to fewer output
+        data_full = data_df.copy()
+        data_df = data_df.loc[:, data_cols + sum_cols]
+
+
+        ############ OUTPUT #############################
+        # ##### output
+        tables = dict(Plates=plate_df, Standards=standard_df, ProteinStats=sum_df, PlateStats=stats_df, tidyData=data_df, tidyDataFull=data_full)
+        if append or results_format:
+            # appending only writes the new and updated plates
+            if not append:
+                show_output(f"Writing {results_format} results to {results_folder}")
+            with time_stage("store"):
+                write_results(tables, results_folder, results_format=results_format, data_path=config['data_path'], append=append)
+        # the exports are derived from the same tables
+        export_tables = tables
+        if append:
+            stored = read_results(results_folder, tables=['Plates', 'Standards'])
+            plate_df, standard_df = stored['Plates'], stored['Standards']
+            # rewriting the exports reads the complete store (cost grows with the store)
+            if config.get('append_export', False):
+                with time_stage("store"):
+                    export_tables = read_results(results_folder)
+            else:
+                export_tables = None
+                show_output(f"{excel_file} and {csv_file} are not updated when appending to {results_folder} (set append_export or use results2excel)")
+        if export_tables and config['write_excel']:
+            show_output(f"Writing excel output to {excel_file}")
+            # get the all the proteins that had been used in this setup
+            untidy_proteins = list(set(control_df['Protein']).intersection(export_tables['tidyData']['Protein'].unique())) if config['output_untidy'] else []
+            with time_stage("excel"):
+                write_results_excel(export_tables, excel_file, untidy_proteins=untidy_proteins)
+        if export_tables:
+            show_output(f"Writing complete external conc file output to {csv_file}")
+            with time_stage("csv"):
+                export_tables['tidyDataFull'].to_csv(csv_file, index=False, sep="\t", compression="gzip")
+        # wait for the plots
+        if plot_queue:
+            with time_stage("plots"):
+                plot_queue.drain()
+        show_output(f"Finished collecting Luminex data for folder {config['data_path']}", color="success")
+        return plate_df, standard_df, sum_df, data_full
+    finally:
+        # no render processes are left behind (also on errors and early returns)
+        if plot_queue:
+            plot_queue.close()
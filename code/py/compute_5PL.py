@@ -1,67 +1,210 @@
+import re
 import pandas as pd
 import numpy as np
 from scipy.optimize import least_squares
 
+from kernel_5PL import PL5, jac_5PL, inv_5PL, dconc_dFI, retro_conc, get_Fpos
+from standard_curve import StandardCurve, add_curves, export_standards
+from plate_matrix import match_types
+
+# the default starting params for the 5PL fit (domain-specific)
+P0 = [10, 1000, 10000, -1, 1]
 
-def PL5(conc,params):
-    '''
-    equation for regression
-    f(conc) = FI
-    '''
-    
-    A,B,C,D,E = params
-    return A + (B-A)/np.power(1+np.power(conc/C, D), E)
 
 def retro_5PL(fi, params):
     '''
     equation for deriving conc from FI
+    thin pandas wrapper around kernel_5PL.retro_conc
     '''
-    
-    A,B,C,D,E = params
-    conc = C * np.power(np.power((B-A)/(fi-A), 1/E)-1, 1/D).fillna(0)
-    # for values above Fmax set the highest value
-    conc.loc[conc<0] = conc.max()
-    return np.round(conc,2)
-    
-    
+
+    return pd.Series(retro_conc(fi.to_numpy(dtype=float), params), index=fi.index)
+
+
 def residuals(params, x, y):
     return y - PL5(x,params)
 
 
+def jac_residuals(params, x, y):
+    '''
+    jacobian of residuals for least_squares
+    '''
+    
+    return -jac_5PL(x, params)
+
+
+def param_cov(params, s):
+    '''
+    covariance matrix of the fit params from the jacobian at the solution
+    cov = (J^T J)^-1 * res_ss / (n - 5)
+    pinv is used as params at a bound make J^T J singular
+    '''
+
+    conc, FI = np.asarray(s['conc'], dtype=float), np.asarray(s['FI'], dtype=float)
+    J = jac_5PL(conc, params)
+    dof = max(len(FI) - len(params), 1)
+    res_ss = np.sum(residuals(params, conc, FI) ** 2)
+    return np.linalg.pinv(J.T @ J) * res_ss / dof
+
+
 def r_squared(params, s):
     '''
     regression coefficient
     '''
     
-    y_mean = np.mean(s['FI'])
+    # missing FI (OOR) are skipped
+    conc, FI = np.asarray(s['conc'], dtype=float), np.asarray(s['FI'], dtype=float)
+    valid = FI == FI
+    y_mean = np.mean(FI[valid]) if valid.any() else np.nan
     
-    res_ss = np.sum(residuals(params, s['conc'], s['FI']) ** 2)
-    tot_ss = np.sum((s['FI'] - y_mean)**2)
+    res_ss = np.nansum(residuals(params, conc, FI) ** 2)
+    tot_ss = np.nansum((FI - y_mean)**2)
     return 1 - (res_ss / tot_ss)
     
 
+def solve_standard(conc, FI, p0=P0, B_bound=np.inf):
+    '''
+    runs the least_squares solver for one standard curve on plain arrays
+    returns the OptimizeResult
+    '''
+
+    return least_squares(residuals, p0, jac=jac_residuals, method="trf", args=(conc, FI), bounds=([-np.inf,-np.inf,-np.inf,-1,0.1],[np.inf, B_bound, np.inf,0,5]))
+
+
 def fit_standard(s, B_bound=np.inf, **kwargs):
     '''
     takes a standard with columns conc and FI 
     and returns the params for the 5LP regression
     '''
     
-    # init the params to sensible values (domain-specific)
-    p0 = [10, 1000, 10000, -1, 1]
-    # fit using leastsq
-    plsq = least_squares(residuals, p0, jac="2-point", method="trf", args=(s['conc'], s['FI']), bounds=([-np.inf,-np.inf,-np.inf,-1,0.1],[np.inf, B_bound, np.inf,0,5]))
+    # fit using leastsq on the plain arrays (Series arithmetic is the main cost per iteration)
+    plsq = solve_standard(np.asarray(s['conc'], dtype=float), np.asarray(s['FI'], dtype=float), p0=P0, B_bound=B_bound)
     
     params = list(plsq['x'])
     
     return params, r_squared(params, s)
 
 
+def PL5_stack(conc, P):
+    '''
+    evaluates PL5 for a stack of curves
+    conc is (curves x points), P is (curves x 5)
+    '''
+
+    return PL5(conc, P.T[:, :, None])
+
+
+def jac_5PL_stack(conc, P):
+    '''
+    jacobian of PL5_stack with respect to the 5 params
+    returns (curves x points x 5)
+    '''
+
+    return jac_5PL(conc, P.T[:, :, None])
+
+
+def fit_standards(ss_list, B_bound=np.inf, p0=None, max_iter=1000, ftol=1e-8, xtol=1e-8, gtol=1e-8, **kwargs):
+    '''
+    batched version of fit_standard for a list of standards (columns conc and FI)
+    all curves are fitted at once with a vectorized Levenberg-Marquardt over a (curves x 5) param array
+        - params sitting on a bound with the gradient pointing outwards are frozen for that step
+        - every curve converges on its own (status like least_squares: 1 gtol, 2 ftol, 3 xtol)
+        - curves that do not converge (status 0) or end with a param on a bound are refitted with the single-curve solver
+    p0 can hold starting params per curve (curves x 5), default is P0 for all curves
+    returns the params, R^2 and status per curve
+    '''
+
+    n = len(ss_list)
+    if not n:
+        return [], [], []
+    # pad the standards into (curves x points) arrays with weight w=0 for the padding
+    m = max(len(ss['FI']) for ss in ss_list)
+    conc, FI, w = np.ones((n, m)), np.zeros((n, m)), np.zeros((n, m))
+    for i, ss in enumerate(ss_list):
+        l = len(ss['FI'])
+        conc[i, :l], FI[i, :l], w[i, :l] = ss['conc'], ss['FI'], 1
+
+    lb = np.array([-np.inf, -np.inf, -np.inf, -1, 0.1])
+    ub = np.array([np.inf, B_bound, np.inf, 0, 5])
+    eye = np.eye(5)
+    # init the params to the same values as fit_standard or the given starting params
+    p0 = np.tile(np.array(P0, dtype=float), (n, 1)) if p0 is None else np.array(p0, dtype=float)
+    P = np.clip(p0, lb, ub)
+    fit = PL5_stack(conc, P)
+    res = (FI - fit) * w
+    cost = 0.5 * np.sum(res ** 2, axis=1)
+    J = jac_5PL_stack(conc, P) * w[..., None]
+    damp = np.full(n, 1e-3)
+    status = np.zeros(n, dtype=int)
+
+    for _ in range(max_iter):
+        # only work on the curves that are still running
+        a = np.flatnonzero(status == 0)
+        if not len(a):
+            break
+        Pa, Ja = P[a], J[a]
+        g = np.einsum('nmk,nm->nk', Ja, res[a])
+        JTJ = np.einsum('nmk,nml->nkl', Ja, Ja)
+        # freeze the params that would leave the bounds
+        fixed = ((Pa <= lb) & (g < 0)) | ((Pa >= ub) & (g > 0))
+        free = ~fixed
+        g = np.where(fixed, 0, g)
+        status[a[np.max(np.abs(g), axis=1) <= gtol * np.maximum(cost[a], 1)]] = 1
+        # damped normal equations (Marquardt scaling with the diagonal of JTJ)
+        diag = np.maximum(np.diagonal(JTJ, axis1=1, axis2=2), 1e-12)
+        M = JTJ + damp[a, None, None] * diag[:, :, None] * eye
+        M = M * (free[:, :, None] & free[:, None, :]) + fixed[:, :, None] * eye
+        step = np.linalg.solve(M, g[..., None])[..., 0]
+        P_new = np.clip(Pa + step, lb, ub)
+        fit_new = PL5_stack(conc[a], P_new)
+        res_new = (FI[a] - fit_new) * w[a]
+        cost_new = 0.5 * np.sum(res_new ** 2, axis=1)
+        better = np.isfinite(cost_new) & (cost_new < cost[a])
+        small_f = better & (cost[a] - cost_new <= ftol * cost[a])
+        small_x = np.linalg.norm(P_new - Pa, axis=1) <= xtol * (xtol + np.linalg.norm(Pa, axis=1))
+        # accept the improved curves and relax their damping
+        b = a[better]
+        P[b], fit[b], res[b], cost[b] = P_new[better], fit_new[better], res_new[better], cost_new[better]
+        J[b] = jac_5PL_stack(conc[b], P[b]) * w[b, :, None]
+        damp[b] = np.maximum(damp[b] / 3, 1e-15)
+        damp[a[~better]] *= 2
+        running = status[a] == 0
+        status[a[running & small_f]] = 2
+        status[a[running & ~small_f & small_x & (better | (damp[a] > 1e10))]] = 3
+
+    # a flat curve (D = 0) or a negative C are degenerate solutions that go to the fallback
+    status[(P[:, 2] <= 0) | (P[:, 3] >= 0)] = 0
+    # with a param at (or next to) a bound, the frozen LM steps can end in another optimum than least_squares (trf)
+    # these go to the fallback as well
+    status[np.any(np.isclose(P, lb, rtol=1e-4, atol=0) | np.isclose(P, ub, rtol=1e-4, atol=0) | (P <= lb) | (P >= ub), axis=1)] = 0
+    params_list, R_list = [], []
+    for i, ss in enumerate(ss_list):
+        if status[i]:
+            params = list(P[i])
+        else:
+            # fallback to the single-curve solver
+            plsq = solve_standard(conc[i, w[i] > 0], FI[i, w[i] > 0], p0=p0[i], B_bound=B_bound)
+            params, status[i] = list(plsq['x']), plsq['status']
+        params_list.append(params)
+        R_list.append(r_squared(params, ss))
+    return params_list, R_list, list(status)
+
+
+def nan_mean(values):
+    '''
+    mean of the valid values of an array (NaN if there are none)
+    '''
+
+    values = values[values == values]
+    return values.mean() if len(values) else np.nan
+
+
 def compute_conc(df, standard_row, conc_col_suff=""):
     '''
     calculate the expected controls/samples from 5PL fit and compare to bounds from
     luminex params
     computed values are stored in conc_col
     Fpos is the relative distance between Fmin and Fmax as a measure of confidence
+    df can be a DataFrame or a dict of arrays (view of a PlateMatrix)
     '''
 
 
@@ -69,14 +212,13 @@ def compute_conc(df, standard_row, conc_col_suff=""):
 
     conc_col = "conc" + conc_col_suff
     Fpos_col = "Fpos" + conc_col_suff
-    # extract the params from the standard_row params string
-    params = [float(p) for p in standard_row['params'].split(" | ")]
-    df.loc[:, conc_col] = retro_5PL(df['FI'], params)
-    # extract Fmin and Fmax
-    Fmin, Fmax = standard_row.loc[['Fmin', 'Fmax']]
-    df.loc[:, Fpos_col] = np.round((df['FI'] - Fmin) / (Fmax - Fmin),3)
-    # upgrade 0 values to 0.001
-    df.loc[df[conc_col] == 0, conc_col] = MINVALUE
+    # the curve holds the float64 params and the cached inverse
+    curve = StandardCurve.from_row(standard_row)
+    FI = np.asarray(df['FI'], dtype=float)
+    conc = curve.conc(FI)
+    # upgrade 0 values to MINVALUE
+    df[conc_col] = np.where(conc == 0, MINVALUE, conc)
+    df[Fpos_col] = curve.Fpos(FI)
     # distances in the C space should be log-linear
     # Cbound = np.log(Cmin/Cmax) / 2
     # df['Coff'] = (np.log((df[conc_col] + .1) / Cmin) - Cbound) / Cbound
@@ -89,19 +231,34 @@ def get_confidence(params, fraction=0.9):
     this is calculated from the definition of the params
     ?? should the FI confidence be determined from log2 ?
     '''
-    Frange = (params[1] - params[0])
-    FoffSet = Frange * (1-fraction) / 2
-    Fmin = params[0] + FoffSet
-    Fmax = params[1] - FoffSet
-    conf = retro_5PL(pd.Series([Fmin, Fmax]), params)
-    conf.index = ['ConcMin', 'ConcMax']
-    # add Fmin and Fmax to the pd.Series
-    return pd.concat([pd.Series(dict(Fmin=Fmin, Fmax=Fmax)), conf])
+    curve = StandardCurve(params, fraction=fraction)
+    return pd.Series(dict(Fmin=curve.Fmin, Fmax=curve.Fmax, ConcMin=curve.ConcMin, ConcMax=curve.ConcMax))
 
 
-def analyse_standard(standard_row, s, dilution=4, confidence=0.9, **kwargs):
+def get_standard_series(standard_row, s, dilution=4):
     '''
-    take a standard_row and and samples reduced to one protein
+    take a standard_row and the data of one protein (dict of arrays from PlateMatrix.get_protein)
+    return the standard dilution series (ss) with the expected conc as dict of arrays
+    '''
+
+    # retrieve standard wells from s
+    is_standard = match_types(s['Type'], r"^[SB][1-8]?$")
+    types = np.asarray(s['Type'], dtype=object)[is_standard]
+    types[types == "B"] = "S8"
+
+    # get the starting concentration for that dilution
+    starting_conc = standard_row['S1']
+
+    # fill the dilution series with the last being 0
+    steps = np.array([int(re.search(r"S([1-8])", t).group(1)) for t in types], dtype=int)
+    conc = starting_conc / np.power(dilution, steps - 1)
+    conc[types == "S8"] = 0
+    return dict(Well=np.asarray(s['Well'], dtype=object)[is_standard], Type=types, FI=np.asarray(s['FI'], dtype=float)[is_standard], conc=conc)
+
+
+def analyse_standard(standard_row, s, dilution=4, confidence=0.9, fit=None, **kwargs):
+    '''
+    take a standard_row and the data of one protein
     return (all squeeced into the returned standard_row):
         - ConcMin, ConcMax and Fmin and Fmax and C2pos as a confidence interval
         - Fpos as a measure of how well the samples fit into the sigmoidal curve
@@ -109,26 +266,26 @@ def analyse_standard(standard_row, s, dilution=4, confidence=0.9, **kwargs):
         - StMax as maximum Fpos in the standard dilution series as a measure of control suitability
             this is a measure of the reach of the maximal standard concentrations
             StMax < 0.6 mean the sigmoidal curve is largely extrapolated 
-        - the standard_df (ss)
+        - the standard series (ss)
+    fit can be passed as precomputed (params, R) from fit_standards
     '''
 
-    # retrieve standard rows from s
-    ss = s.loc[s['Type'].str.match(r"^[SB][1-8]?$"),:]
-    ss.loc[ss['Type'] == "B", "Type"] = "S8"
+    ss = get_standard_series(standard_row, s, dilution=dilution)
 
-    # get the starting concentration for that dilution
-    starting_conc = standard_row['S1']
-
-    # fill the dilution series with the last being 0
-    ss.loc[:, 'conc'] = starting_conc / np.power(dilution, ss['Type'].str.extract(r"S([1-8])", expand=False).astype(int) -1)
-    ss.loc[ss['Type'] == "S8", 'conc'] = 0
-    
-    # fit the params
-    params, R = fit_standard(ss, **kwargs)
-    # add the params and fit to the standard_row
-    fit_series = pd.Series([" | ".join([str(round(p,3)) for p in params]), round(R, 6)], index=['params','R^2'])
+    # fit the params (if not already done for the whole plate in fit_standards)
+    params, R = fit if fit else fit_standard(ss, **kwargs)
+    # the curve keeps the float64 params, R^2 and the confidence range
+    curve = StandardCurve(params, R=R, fraction=confidence)
+    # the param uncertainty comes from the jacobian at the solution
+    cov = param_cov(params, ss)
+    fit_series = pd.Series([
+        curve,
+        round(R, 6),
+        " | ".join([f"{se:.4g}" for se in np.sqrt(np.abs(np.diag(cov)))]),
+        " | ".join([f"{c:.6g}" for c in cov.ravel()])
+        ], index=['curve','R^2', 'paramsSE', 'paramsCov'])
     # add the ConcMin and ConcMax to standard_row
-    conf_series = get_confidence(params, fraction=confidence)
+    conf_series = pd.Series(dict(Fmin=curve.Fmin, Fmax=curve.Fmax, ConcMin=curve.ConcMin, ConcMax=curve.ConcMax))
 
     standard_row = pd.concat([standard_row, fit_series, conf_series])
 
@@ -137,9 +294,9 @@ def analyse_standard(standard_row, s, dilution=4, confidence=0.9, **kwargs):
     # compute StMax as maximum Fpos in the standard dilution series
     # this is a measure of the reach of the maximal standard concentrations
     # StMax < 0.6 mean the sigmoidal curve is largely extrapolated 
-    Fmin, Fmax = standard_row.loc[['Fmin', 'Fmax']]
-    ss.loc[:, 'Fpos'] = np.round((ss['FI'] - Fmin) / (Fmax - Fmin),3)
-    standard_row["StMax"] = np.round(ss['Fpos'].max(),2)
+    ss['Fpos'] = curve.Fpos(ss['FI'])
+    Fpos = ss['Fpos'][ss['Fpos'] == ss['Fpos']]
+    standard_row["StMax"] = np.round(Fpos.max(), 2) if len(Fpos) else np.nan
 
     # fix if StMax is very small Fmax needs to
 
@@ -148,82 +305,108 @@ def analyse_standard(standard_row, s, dilution=4, confidence=0.9, **kwargs):
 
 def analyse_control(standard_row, s):
     '''
-    take a standard_row and and samples reduced to one protein
+    take a standard_row and the data of one protein
     return (all squeeced into the returned standard_row):
         - C1pos and C2pos as a measure of control suitability (should be between 0 and 1 (optimally around 0.5))
         - C1fit and C1fit as a measure of fit of known concentration to estimated conc (0 < 0.5 < 1)
-        - the control_df (sc)
+        - the controls (sc) as dict of arrays
     '''
     
     # extract the controls and load the controls into sc
-    sc = s.loc[s['Type'].str.match("^C[12]$"),:]
+    is_control = match_types(s['Type'], "^C[12]$")
     
     # skip if controls are not included
-    if not len(sc.index):
+    if not is_control.any():
         standard_row['sc'] = None
         return standard_row
+    sc = {col: np.asarray(s[col])[is_control] for col in ['Well', 'Type', 'FI']}
     
+    # the known conc range of the controls from the luminex params
     C_extract_pattern = r"(?P<Cmin>[0-9]+(?:\.[0-9])?) ?[-–] ?(?P<Cmax>[0-9]+(?:\.[0-9])?)"
-    sc = sc.merge(standard_row.loc[['C1', 'C2']].str.extract(C_extract_pattern).astype(float), left_on='Type', right_index=True)
+    C_range = {}
+    for control in ['C1', 'C2']:
+        match = re.search(C_extract_pattern, C) if isinstance(C := standard_row[control], str) else None
+        C_range[control] = (float(match['Cmin']), float(match['Cmax'])) if match else (np.nan, np.nan)
+    sc['Cmin'] = np.array([C_range[control][0] for control in sc['Type']])
+    sc['Cmax'] = np.array([C_range[control][1] for control in sc['Type']])
     
     # calculate the conc estimated from params
     sc = compute_conc(sc, standard_row)
     
-    control_pos = sc.groupby('Type')['Fpos'].mean().rename({'C1':'C1Pos', 'C2':'C2pos'})
+    controls = sorted(set(sc['Type']))
+    control_pos = pd.Series({control: nan_mean(sc['Fpos'][sc['Type'] == control]) for control in controls}, dtype=float).rename({'C1':'C1Pos', 'C2':'C2pos'})
     # compute the fit of the control samples
-    sc.loc[:, 'Cfit'] = np.log(sc['conc'] / sc['Cmin']) / (np.log(sc['Cmax'] / sc['Cmin']))
-    control_fit = sc.groupby('Type')['Cfit'].mean().rename({'C1':'C1fit', 'C2':'C2fit'})
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sc['Cfit'] = np.log(sc['conc'] / sc['Cmin']) / (np.log(sc['Cmax'] / sc['Cmin']))
+    control_fit = pd.Series({control: nan_mean(sc['Cfit'][sc['Type'] == control]) for control in controls}, dtype=float).rename({'C1':'C1fit', 'C2':'C2fit'})
     
     # add these metrices to the standard_row
     standard_row = pd.concat([standard_row,control_pos, control_fit])
-    # load control_df (sc) into standard_row
+    # load controls (sc) into standard_row
     standard_row['sc'] = sc
     return standard_row
 
 
-def compute_external_fit(standard_row, df=pd.DataFrame()):
+def get_external_conc(df, standard_df):
     '''
-    for all samples, goes through the standard rows and applies where applicable
+    for all samples, applies all standards (Runs) of the same protein
+    samples are grouped by protein once and the inverse 5PL of all standards of that protein
+    is evaluated as one (samples x runs) array operation
+    if a Run has several standards for one protein, the last one is used
+    returns the runs and the (rows x runs) matrices for conc and Fpos
     '''
-    
-    # extract run and protein for df extraction
-    run, protein = standard_row.loc[['Run', 'Protein']]
-    cols = [f"conc{run}", f"Fpos{run}"]
-    
-    df.loc[df['Protein'] == protein, cols] = compute_conc(df.loc[df['Protein'] == protein, :], standard_row, conc_col_suff = run).loc[:, cols]
-    return df
 
+    MINVALUE=0.01
+
+    runs = list(standard_df['Run'].unique())
+    run_pos = {run: i for i, run in enumerate(runs)}
+    conc = np.full((len(df.index), len(runs)), np.nan)
+    Fpos = np.full((len(df.index), len(runs)), np.nan)
+    FI = df['FI'].to_numpy(dtype=float)
+
+    protein_rows = df.groupby('Protein', sort=False, observed=True).indices
+    used_standards = standard_df.drop_duplicates(['Run', 'Protein'], keep="last")
+    for protein, prot_standard in used_standards.groupby('Protein', sort=False, observed=True):
+        if not protein in protein_rows:
+            continue
+        rows = protein_rows[protein]
+        cols = [run_pos[run] for run in prot_standard['Run']]
+        curves = list(prot_standard['curve'])
+        P = np.array([curve.params for curve in curves])
+        # FI as a column against one param row per curve gives (samples x curves)
+        prot_conc = retro_conc(FI[rows, None], [p[None, :] for p in P.T])
+        # upgrade 0 values to MINVALUE
+        conc[np.ix_(rows, cols)] = np.where(prot_conc == 0, MINVALUE, prot_conc)
+        Fmin, Fmax = np.array([curve.Fmin for curve in curves]), np.array([curve.Fmax for curve in curves])
+        Fpos[np.ix_(rows, cols)] = get_Fpos(FI[rows, None], Fmin, Fmax)
+    return runs, conc, Fpos
+
+
+def get_external_means(conc, Fpos, external_mean_method="arithmetic", minFpos=0, **kwargs):
+    '''
+    get the mean of the conc of all runs (standards) for all rows at once
+    works on the (rows x runs) matrices of conc and Fpos from get_external_conc
+        - conc only counts if Fpos > minFpos
+        - FposMean is the mean of all available Fpos
+        - the geometric mean is computed in log space (no overflow of the product)
+    rows without any valid conc get NaN
+    returns a df with concMean, concStd and FposMean
+    '''
+
+    # only use conc if Fpos > minFpos (NaN is never used)
+    use = Fpos > minFpos
+    n = use.sum(axis=1)
+    has_Fpos = Fpos == Fpos
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        conc_mean = np.sum(np.where(use, conc, 0), axis=1) / n
+        # population std like np.std
+        conc_std = np.sqrt(np.sum(np.where(use, (conc - conc_mean[:, None]) ** 2, 0), axis=1) / n)
+        Fpos_mean = np.sum(np.where(has_Fpos, Fpos, 0), axis=1) / has_Fpos.sum(axis=1)
+        if external_mean_method == "geometric":
+            conc_mean = np.round(np.exp(np.sum(np.where(use, np.log(np.abs(conc)), 0), axis=1) / n), 3)
 
-def mean_row(row, standard_df=pd.DataFrame(), external_mean_method="arithmetic", minFpos=0, **kwargs):
-    '''
-    get the mean of all these runs and standards
-    '''
-    conc = []
-    Fpos = [] 
-    # cycle through conc and Fpos for all standard_runs
-    for run in standard_df['Run'].unique():
-        ccol = f"conc{run}"
-        fcol = f"Fpos{run}"
-        # only append Fpos if not NaN
-        if row[fcol] == row[fcol]:
-            Fpos.append(row[fcol])
-        # only append conc if Fpos > minFpos
-        if row[fcol] > minFpos:
-            conc.append(row[ccol])
-    if (l := len(conc)):
-        if external_mean_method=="arithmetic":
-            return pd.Series(
-                dict(
-                    concMean=sum(conc) / len(conc),
-                    concStd=np.std(conc),
-                    FposMean=sum(Fpos) / len(Fpos)             
-                    ))
-        elif external_mean_method=="geometric":
-            geo_mean = np.power(np.prod(np.abs(conc)), 1/l)
-            return pd.Series(
-                dict(
-                    concMean=round(geo_mean, 3),
-                    concStd=np.std(conc),
-                    FposMean=sum(Fpos) / len(Fpos)
-                )
-            )
\ No newline at end of file
+    mean_df = pd.DataFrame(dict(concMean=conc_mean, concStd=conc_std, FposMean=Fpos_mean))
+    # no valid conc --> no mean at all
+    mean_df.loc[n == 0, :] = np.nan
+    return mean_df
@@ -0,0 +1,109 @@
+import os
+import pickle
+import hashlib
+import pandas as pd
+
+from script_utils import show_output
+
+# bump to invalidate all sidecars if the way the sheets are read changes
+EXCEL_CACHE_VERSION = 1
+
+
+def get_sidecar_file(excel_file):
+    '''
+    the sidecar with the parsed sheets lives next to the workbook: <folder>/.<workbook>.sheets.pkl
+    '''
+
+    folder, name = os.path.split(os.path.abspath(excel_file))
+    return os.path.join(folder, f".{name}.sheets.pkl")
+
+
+def get_file_hash(file, chunk_size=1 << 20):
+    '''
+    sha1 of the file content
+    '''
+
+    file_hash = hashlib.sha1()
+    with open(file, "rb") as stream:
+        while (chunk := stream.read(chunk_size)):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def load_sidecar(excel_file):
+    '''
+    loads the sidecar of excel_file if it belongs to the current content of the workbook
+    the hash is only computed if the mtime or size have changed (e.g. file copied or touched)
+    returns the sidecar dict (hash, mtime, size, sheets) and if it has to be saved again
+    '''
+
+    stat = os.stat(excel_file)
+    sidecar = dict(version=EXCEL_CACHE_VERSION, hash="", mtime=stat.st_mtime, size=stat.st_size, sheets={})
+    sidecar_file = get_sidecar_file(excel_file)
+    if not os.path.isfile(sidecar_file):
+        return sidecar, True
+    try:
+        with open(sidecar_file, "rb") as stream:
+            cached = pickle.load(stream)
+    except Exception:
+        show_output(f"Sidecar {sidecar_file} could not be read and will be rebuilt", color="warning")
+        return sidecar, True
+    if cached.get('version') != EXCEL_CACHE_VERSION:
+        return sidecar, True
+    if (cached['mtime'], cached['size']) == (stat.st_mtime, stat.st_size):
+        return cached, False
+    # content unchanged although touched --> keep the sheets
+    if cached['size'] == stat.st_size and cached['hash'] == get_file_hash(excel_file):
+        return dict(cached, mtime=stat.st_mtime), True
+    return sidecar, True
+
+
+def save_sidecar(sidecar, excel_file):
+    '''
+    writes the sidecar (atomic replace)
+    a workbook in a read-only folder simply has no sidecar
+    '''
+
+    sidecar_file = get_sidecar_file(excel_file)
+    tmp_file = f"{sidecar_file}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, "wb") as stream:
+            pickle.dump(sidecar, stream, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, sidecar_file)
+    except OSError:
+        show_output(f"Sidecar {sidecar_file} could not be written", color="warning")
+
+
+def read_excel_sheets(excel_file, sheets, use_cache=True):
+    '''
+    loads the sheets of excel_file into a dict of dfs
+    the workbook is opened once for all sheets that are not in the sidecar cache
+    with use_cache, the parsed sheets are stored in a sidecar keyed on hash and mtime of the workbook
+    the sidecar is invalidated as soon as the workbook changes
+    '''
+
+    sheets = list(sheets)
+    if not use_cache:
+        return pd.read_excel(excel_file, sheet_name=sheets)
+
+    sidecar, changed = load_sidecar(excel_file)
+    if (missing := [sheet for sheet in sheets if sheet not in sidecar['sheets']]):
+        # read the missing sheets (and get the hash) before the workbook changes again
+        stat = os.stat(excel_file)
+        file_hash = get_file_hash(excel_file)
+        if file_hash != sidecar['hash']:
+            sidecar = dict(sidecar, hash=file_hash, mtime=stat.st_mtime, size=stat.st_size, sheets={})
+            missing = sheets
+        sidecar['sheets'].update(pd.read_excel(excel_file, sheet_name=missing))
+        changed = True
+    if changed:
+        save_sidecar(sidecar, excel_file)
+    return {sheet: sidecar['sheets'][sheet] for sheet in sheets}
+
+
+def read_excel_sheet(excel_file, sheet, use_cache=True):
+    '''
+    loads one sheet of excel_file (see read_excel_sheets)
+    '''
+
+    return read_excel_sheets(excel_file, [sheet], use_cache=use_cache)[sheet]
@@ -0,0 +1,144 @@
+import os
+import json
+import time
+import hashlib
+import numpy as np
+from collections import ChainMap
+
+from script_utils import show_output
+
+# bump to invalidate all cached fits if the fitting itself changes
+FIT_CACHE_VERSION = 2
+# the keys of the fitting config that change the fit (bounds and solver settings of fit_standards)
+FIT_CONFIG_KEYS = ['B_bound', 'max_iter', 'ftol', 'xtol', 'gtol']
+
+
+def load_fit_cache(cache_file):
+    '''
+    loads the fit cache from a json file
+    returns a cache dict with
+        fits: fit_key -> {params, R, status, created, used}
+        warm: Protein|Plex -> last good params (used as starting point for new fits)
+    '''
+
+    cache = dict(fits={}, warm={})
+    if cache_file and os.path.isfile(cache_file):
+        try:
+            with open(cache_file, "r") as stream:
+                cache.update(json.load(stream))
+        except (ValueError, OSError):
+            show_output(f"Fit cache {cache_file} could not be read and will be rebuilt", color="warning")
+    return cache
+
+
+def evict_fits(cache, max_entries=50000, max_age=365, **kwargs):
+    '''
+    removes fits that have not been used for max_age days
+    and keeps only the max_entries most recently used fits
+    '''
+
+    min_used = time.time() - max_age * 86400
+    fits = {key: fit for key, fit in cache['fits'].items() if fit['used'] >= min_used}
+    if len(fits) > max_entries:
+        fits = dict(sorted(fits.items(), key=lambda item: item[1]['used'])[-max_entries:])
+    cache['fits'] = fits
+    return cache
+
+
+def save_fit_cache(cache, cache_file, **cache_config):
+    '''
+    evicts old fits and writes the cache to cache_file (atomic replace)
+    '''
+
+    if not cache_file:
+        return
+    cache = evict_fits(cache, **cache_config)
+    if (cache_folder := os.path.dirname(cache_file)) and not os.path.isdir(cache_folder):
+        os.makedirs(cache_folder)
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "w") as stream:
+        json.dump(cache, stream)
+    os.replace(tmp_file, cache_file)
+
+
+def get_fit_key(ss, S1, dilution=4, **fit_config):
+    '''
+    hashes everything that determines the fit of a standard:
+    the standard FI values (ordered by Type and Well), S1, dilution and the FIT_CONFIG_KEYS of the fitting config
+    the other keys (confidence, minFpos...) only act on the fitted curve and keep the cached fits valid
+    '''
+
+    # ss is a dict of arrays (get_standard_series), ordered by Type and Well
+    types, wells = np.asarray(ss['Type'], dtype=str), np.asarray(ss['Well'], dtype=str)
+    order = np.lexsort((wells, types))
+    key_data = json.dumps(dict(
+        version=FIT_CACHE_VERSION,
+        Type=list(types[order]),
+        Well=list(wells[order]),
+        FI=[float(fi) for fi in np.asarray(ss['FI'], dtype=float)[order]],
+        S1=float(S1),
+        dilution=dilution,
+        config={k: str(v) for k, v in sorted(fit_config.items()) if k in FIT_CONFIG_KEYS}
+        ))
+    return hashlib.sha1(key_data.encode()).hexdigest()
+
+
+def get_cached_fit(cache, fit_key):
+    '''
+    returns the cached (params, R) for fit_key or None
+    '''
+
+    if (fit := cache['fits'].get(fit_key)):
+        # write back a refreshed copy so that overlay caches record the use
+        cache['fits'][fit_key] = dict(fit, used=time.time())
+        return fit['params'], fit['R']
+    return None
+
+
+def get_warm_start(cache, protein, plex):
+    '''
+    returns the last good params for that Protein/Plex or None
+    '''
+
+    return cache['warm'].get(f"{protein}|{plex}")
+
+
+def store_fit(cache, fit_key, protein, plex, params, R, status):
+    '''
+    adds a new fit to the cache
+    converged fits become the warm start for that Protein/Plex
+    '''
+
+    now = time.time()
+    params = [float(p) for p in params]
+    cache['fits'][fit_key] = dict(params=params, R=float(R), status=int(status), created=now, used=now)
+    if status > 0 and np.all(np.isfinite(params)):
+        cache['warm'][f"{protein}|{plex}"] = params
+    return cache
+
+
+def overlay_fit_cache(cache):
+    '''
+    returns a cache that reads from cache but writes new and used fits into a separate layer
+    this keeps cache unchanged (every plate sees the same fits and warm starts)
+    '''
+
+    return dict(fits=ChainMap({}, cache['fits']), warm=ChainMap({}, cache['warm']))
+
+
+def get_cache_updates(overlay_cache):
+    '''
+    returns the written layer of an overlay cache as a plain cache dict
+    '''
+
+    return dict(fits=overlay_cache['fits'].maps[0], warm=overlay_cache['warm'].maps[0])
+
+
+def update_fit_cache(cache, cache_updates):
+    '''
+    merges the updates of an overlay cache into cache
+    '''
+
+    cache['fits'].update(cache_updates['fits'])
+    cache['warm'].update(cache_updates['warm'])
+    return cache
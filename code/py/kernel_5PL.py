@@ -0,0 +1,143 @@
+import numpy as np
+
+#### array-in/array-out kernels for the 5PL model
+# all functions work on numpy arrays (1-D or 2-D) and broadcast the params:
+#   - one curve: fi (samples,) and params as 5 scalars
+#   - several curves: fi (samples, 1) and params as 5 arrays of shape (1, curves)
+# FI = A + (B-A) / (1 + (conc/C)^D)^E
+
+
+def PL5(conc, params):
+    '''
+    forward 5PL: f(conc) = FI
+    '''
+
+    A,B,C,D,E = params
+    with np.errstate(all="ignore"):
+        return A + (B-A)/np.power(1+np.power(conc/C, D), E)
+
+
+def jac_5PL(conc, params):
+    '''
+    closed-form partial derivatives of PL5 with respect to A, B, C, D, E
+    returns an array of shape conc.shape + (5,)
+    with u = (conc/C)^D and w = 1 + u:
+        dA = 1 - w^-E
+        dB = w^-E
+        dC = (B-A) * E * w^(-E-1) * D * u / C
+        dD = -(B-A) * E * w^(-E-1) * u * ln(conc/C)
+        dE = -(B-A) * w^-E * ln(w)
+    for conc = 0 (blank) and D < 0 the limit FI = A is used (derivatives [1, 0, 0, 0, 0])
+    '''
+
+    A,B,C,D,E = params
+    with np.errstate(all="ignore"):
+        u = np.power(conc/C, D)
+        w = 1 + u
+        wE = np.power(w, -E)
+        dfdu = -(B-A) * E * wE / w
+        J = np.stack(np.broadcast_arrays(
+            1 - wE,
+            wE,
+            -dfdu * D * u / C,
+            dfdu * u * np.log(conc/C),
+            -(B-A) * wE * np.log(w)
+            ), axis=-1)
+    # the inf * 0 products at the blank are the zero limits
+    return np.nan_to_num(J, nan=0, posinf=0, neginf=0)
+
+
+def get_curve_pos(fi, params):
+    '''
+    relative position of fi between the floor A (0) and the ceiling B (1)
+    '''
+
+    A,B,_,_,_ = params
+    with np.errstate(all="ignore"):
+        return (fi - A) / (B - A)
+
+
+def get_inv_params(params):
+    '''
+    the constants of the inverse 5PL (A, B-A, C, 1/D, 1/E)
+    can be computed once per curve and passed to inv_conc
+    '''
+
+    A,B,C,D,E = params
+    return A, B-A, C, 1/D, 1/E
+
+
+def inv_conc(fi, inv_params):
+    '''
+    plain inverse 5PL on the constants from get_inv_params
+    conc = C * (((B-A)/(fi-A))^(1/E) - 1)^(1/D)
+    (no masking, numpy semantics outside the curve range)
+    '''
+
+    A, BA, C, invD, invE = inv_params
+    with np.errstate(all="ignore"):
+        return C * np.power(np.power(BA/(fi-A), invE)-1, invD)
+
+
+def inv_5PL(fi, params, extrapolate=False, inv_params=None):
+    '''
+    inverse 5PL: conc from FI
+    returns conc, below, above
+        below: fi at or below the floor A (no conc)
+        above: fi at or above the ceiling B (no finite conc)
+    conc is NaN for below and above unless extrapolate=True
+    (then the formula is evaluated everywhere with numpy semantics)
+    '''
+
+    r = get_curve_pos(fi, params)
+    below = r <= 0
+    above = r >= 1
+    conc = inv_conc(fi, inv_params if inv_params is not None else get_inv_params(params))
+    if not extrapolate:
+        conc = np.where(below | above, np.nan, conc)
+    return conc, below, above
+
+
+def dconc_dFI(fi, params):
+    '''
+    derivative of the inverse 5PL dConc/dFI for error propagation
+    (sd_conc = dconc_dFI * sd_FI)
+    with r = (fi-A)/(B-A) and q = r^(-1/E) - 1:
+        dconc/dFI = -C / (D * E * (B-A)) * q^(1/D - 1) * r^(-1/E - 1)
+    NaN outside the curve range (below or above)
+    '''
+
+    A,B,C,D,E = params
+    r = get_curve_pos(fi, params)
+    inside = (r > 0) & (r < 1)
+    r = np.where(inside, r, 0.5)
+    with np.errstate(all="ignore"):
+        q = np.power(r, -1/E) - 1
+        dconc = -C / (D * E * (B-A)) * np.power(q, 1/D - 1) * np.power(r, -1/E - 1)
+    return np.where(inside, dconc, np.nan)
+
+
+def retro_conc(fi, params, decimals=2, inv_params=None):
+    '''
+    conc from FI with the rules of the luminex output:
+        - undefined values (mostly below the floor) are set to 0
+        - negative values (above the ceiling) are set to the highest conc of that curve
+        - conc is rounded to decimals
+    for 2-D input the highest conc is taken per curve (column)
+    inv_params from get_inv_params can be passed to skip recomputing them
+    '''
+
+    conc = inv_conc(fi, inv_params if inv_params is not None else get_inv_params(params))
+    conc = np.where(conc == conc, conc, 0)
+    if conc.size:
+        conc = np.where(conc < 0, conc.max(axis=0), conc)
+    return np.round(conc, decimals)
+
+
+def get_Fpos(fi, Fmin, Fmax, decimals=3):
+    '''
+    relative position of fi between Fmin and Fmax
+    '''
+
+    with np.errstate(all="ignore"):
+        return np.round((fi - Fmin) / (Fmax - Fmin), decimals)
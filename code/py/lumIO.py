@@ -1,8 +1,17 @@
+import os
+import json
+import pickle
 import pandas as pd
 import numpy as np
 from script_utils import show_output
+from excel_cache import read_excel_sheets
+from note_utils import aggregate_notes
+from lumi_store import read_results, LumiStore, to_run
 from DBcols import *
 
+# bump to invalidate the state of incremental DB merges if the merge itself changes
+DB_STATE_VERSION = 1
+
 
 def show_dups(df):
     '''
@@ -18,12 +27,12 @@ def show_dups(df):
 def read_lumi_data(lumi_file):
     '''
     read all the luminex conc data into lumi_dict
+    lumi_file is a luminexcel file or the luminexresults folder of a store
     '''
 
-    ld = {}
-    for data in ['Plates', 'Standards', 'ProteinStats', 'tidyData', 'tidyDataFull']:
-        ld[data] = pd.read_excel(lumi_file, sheet_name=data)
-    return ld
+    if os.path.isdir(lumi_file):
+        return read_results(lumi_file)
+    return read_excel_sheets(lumi_file, ['Plates', 'Standards', 'ProteinStats', 'tidyData', 'tidyDataFull'])
 
 
 def read_MSH_DB(DB_file):
@@ -31,30 +40,20 @@ def read_MSH_DB(DB_file):
     read everything into a data dictionary
     '''
 
-    dd = {}
-    for data in ['PatientCodes', 'Patients', 'Cases', 'Biopsies', 'Samples', 'Wells']:
-        dd[data] = pd.read_excel(DB_file, sheet_name=data)
-    return dd
+    db_dict = read_excel_sheets(DB_file, ['PatientCodes', 'Patients', 'Cases', 'Biopsies', 'Samples', 'Wells'])
+    # the key columns get their compact dtypes (the cached sheets stay untouched)
+    return {sheet: set_key_dtypes(df.copy()) for sheet, df in db_dict.items()}
 
 
 def flatten_notes(df):
     '''
-    aggregates multiple Note-fields (starting with "Note") into one "Note" field
+    aggregates multiple Note-fields (starting with "Note") into one "Note" field ("|a|b|")
     removes duplicate info
     '''
     note_cols = [col for col in df.columns if col.startswith("Note")]
-    new_cols = [col + "_1" for col in note_cols]
-    df = df.rename({col:col + "_1" for col in note_cols}, axis=1)
-    df['Note'] = ""
-    for note_col in new_cols:
-        df[note_col] = df[note_col].fillna("")
-        df.loc[df['Note'] != df[note_col], 'Note'] = df['Note'] + "|" + df[note_col].fillna("")
-
-    # add leading and trailing "|" for deduplication    
-    df['Note'] = ("|" + df['Note'] +  "|").str.replace('\|+', '|', regex=True).str.replace("^\|+$", "", regex=True)
-    # do the deduplication
-    df.loc[df['Note'] != "", 'Note'] = df['Note'].str.replace("(\|[^|]+)(\|.*)?\\1", "\\1\\2", regex=True)
-    df = df.drop(new_cols, axis=1)
+    note = aggregate_notes(df, note_cols)
+    df = df.drop(note_cols, axis=1)
+    df['Note'] = note
     return df
 
 
@@ -67,13 +66,13 @@ def merge_DBsamples(DB_file):
     db_dict = read_MSH_DB(DB_file)
 
     # merge wells and samples and flatten notes
-    dbdf = db_dict['Samples'].merge(db_dict['Wells'], on=["SampleName", "Project"], how="right")
+    dbdf = merge_keyed(db_dict['Samples'], db_dict['Wells'], on=["SampleName", "Project"], how="right")
     show_output("Merging Wells and Samples")
     show_dups(dbdf)
 
     dbdf = flatten_notes(dbdf.loc[:, DBmerge_cols])
     # merge with the Biopsies and with the Cases
-    dbdf = flatten_notes(db_dict['Biopsies'].merge(dbdf, how="right"))
+    dbdf = flatten_notes(merge_keyed(db_dict['Biopsies'], dbdf, how="right"))
     show_output("Merging Biopsies")
     show_dups(dbdf)
     return dbdf, db_dict
@@ -96,21 +95,31 @@ def compute_resConc(df):
     # pivot the sample using all informative columns as index
     index_cols = [col for col in df.columns if not col in lumi_cols]
     df = df.set_index(index_cols).pivot(columns="Protein", values="ResConc")
-    return df
+    # database wells without luminex data keep their row but add no (NaN) protein column
+    return df.loc[:, df.columns.notna()]
 
 
-def get_measurements(df, agg_dict):
+def get_measurements(df, agg_dict, replicate_stats=False):
     '''
     compute the doublicate measurements per plate
+    with replicate_stats, the replicate QC is added per protein:
+        <protein>_n as the number of replicates and <protein>_CV as the coefficient of variation (std / mean)
+    all statistics come from the same groupby (the group variance is computed with Welford's method)
     '''
 
-    measure_df = df.drop(['Well',
-       'Type', 'SE'], axis=1).groupby(sample_cols + ['Run', 'RunGroup', 'Plex', 'Plate']).agg(agg_dict).reset_index()
-    
-    # var_df is not really needed - replicats are predicted to be close and are 
-    var_df = df.drop(['Well', 'Note',
-       'Type', 'SE'], axis=1).groupby(sample_cols + ['Run', 'RunGroup', 'Plex', 'Plate']).agg(np.var).fillna(-1).reset_index()
-    return measure_df
+    grouped = df.drop(['Well',
+       'Type', 'SE'], axis=1).groupby(sample_cols + ['Run', 'RunGroup', 'Plex', 'Plate'], observed=True)
+    if not replicate_stats:
+        return grouped.agg(agg_dict).reset_index()
+
+    protein_cols = [col for col, func in agg_dict.items() if func is np.mean]
+    stats_df = grouped.agg({col: ([func, 'count', 'var'] if col in protein_cols else func) for col, func in agg_dict.items()})
+    measure_df = stats_df.loc[:, [(col, "mean" if col in protein_cols else func) for col, func in agg_dict.items()]].droplevel(1, axis=1)
+    n_df = stats_df.xs('count', axis=1, level=1).add_suffix("_n")
+    # CV is undefined for single replicates and mean 0
+    mean_df = measure_df.loc[:, protein_cols]
+    CV_df = (np.sqrt(stats_df.xs('var', axis=1, level=1)) / mean_df.where(mean_df != 0)).add_suffix("_CV")
+    return pd.concat([measure_df, n_df, CV_df], axis=1).reset_index()
 
 
 def make_sample_df(measure_df, agg_dict):
@@ -126,87 +135,128 @@ def make_sample_df(measure_df, agg_dict):
     # get an indicator "repeatPlexes" for the samples with repeat measurements"
     s = run_df.set_index(run_cols).fillna(0).astype(bool).astype(int).groupby([
         'Project', 'BiopsyName', 'SampleName',
-    ]).agg('sum')
+    ], observed=True).agg('sum')
     s['repeatPlexes'] = (np.sum((s > 1).astype(int), axis=1) > 0)
     
     # split by merging with indicator s according to repeat or not repeat
-    measure_df = measure_df.merge(s.reset_index().loc[:, ['SampleName', 'repeatPlexes']], how="outer")
+    measure_df = merge_keyed(measure_df, s.reset_index().loc[:, ['SampleName', 'repeatPlexes']], how="outer")
     repeat_measure_df = measure_df.query('repeatPlexes == True')
     single_measure_df = measure_df.query('repeatPlexes == False')
 
     # for single measurements (no repeats in any plex) everything can be grouped by sample_name
-    single_sample_df = single_measure_df.drop(['Plex', 'Plate', 'repeatPlexes', 'Run'], axis=1).groupby(sample_cols).agg(agg_dict).reset_index()
+    single_sample_df = single_measure_df.drop(['Plex', 'Plate', 'repeatPlexes', 'Run'], axis=1).groupby(sample_cols, observed=True).agg(agg_dict).reset_index()
     single_sample_df['RunGroup'] = "Messung"
     
     # for repeat measurements, we need the RunGroup reduced to Messung or Nachmessung for grouping
     # unify the RunGroups to Messung or Nachmessung
     repeat_measure_df['RunGroup']  = repeat_measure_df['RunGroup'].str.replace('essung.*', 'essung', regex=True)
     # perform the grouping
-    repeat_sample_df = repeat_measure_df.drop(['Plex', 'Plate', 'repeatPlexes', 'Run'], axis=1).groupby(sample_cols + ['RunGroup']).agg(agg_dict).reset_index()
+    repeat_sample_df = repeat_measure_df.drop(['Plex', 'Plate', 'repeatPlexes', 'Run'], axis=1).groupby(sample_cols + ['RunGroup'], observed=True).agg(agg_dict).reset_index()
     # also use simplified RunGroup for run_df for correct merging
     run_df['RunGroup']  = run_df['RunGroup'].str.replace('essung.*', 'essung', regex=True)
     # recombine the 
 
-    run_df = run_df.groupby(run_cols).agg(np.sum).reset_index()
-    sample_df = pd.concat([repeat_sample_df, single_sample_df]).merge(run_df.drop('RunGroup', axis=1)).reset_index(drop=True).sort_values(['Project', 'PatientCode', 'BiopsyName', 'SampleName'])
+    run_df = run_df.groupby(run_cols, observed=True).agg(np.sum).reset_index()
+    sample_df = merge_keyed(concat_keyed([repeat_sample_df, single_sample_df]), run_df.drop('RunGroup', axis=1)).reset_index(drop=True).sort_values(['Project', 'PatientCode', 'BiopsyName', 'SampleName'])
     return sample_df
 
 
-def mergeDB2Lumi(dbdf, luminexcel="", verbose=False):
+def read_lumi_tidy(luminexcel, runs=None):
     '''
-    load in the luminex data and merge in the respective Luminexdata
+    loads the tidyData of a luminexcel file or a luminexresults folder
+    with runs, only the data of these runs is returned (from a store, only these partitions are read)
     '''
-    
-    # load the computed Luminex data per well
-    lumi_dict = read_lumi_data(luminexcel)
-    lumi_df = lumi_dict['tidyData']
-    
-    lumi_df.loc[lumi_df['Plex'] == "21-Plex-StandardOnly", 'Plex'] = "21-Plex"
+
+    if not os.path.isdir(luminexcel):
+        lumi_df = set_key_dtypes(read_lumi_data(luminexcel)['tidyData'].copy())
+        return lumi_df if runs is None else lumi_df.loc[lumi_df['Run'].isin(runs), :].reset_index(drop=True)
+    lumi_df = LumiStore(luminexcel).select(runs=runs, table="tidyData")
+    # the Run is numeric like in the excel sheets
+    lumi_df['Run'] = pd.to_numeric(lumi_df['Run'].astype(object), errors="ignore")
+    return set_key_dtypes(lumi_df)
+
+
+def reconcile_wells(merge_df):
+    '''
+    takes the outer merge (with indicator) of the database and luminex wells
+    returns the tidy reconciliation table with one row per direction, Run and Plate:
+        MissingIn is "Luminex" for database wells without luminex data and "DB" for luminex wells missing in the database
+        nWells is the number of missing wells (over all plexes) and Wells the list of the missing wells
+    '''
+
+    missing_df = merge_df.loc[merge_df['_merge'] != "both", ['Run', 'Plate', 'Well', '_merge']]
+    missing_df['MissingIn'] = missing_df['_merge'].astype(str).map({'left_only': "Luminex", 'right_only': "DB"})
+    missing_df['Well'] = missing_df['Well'].astype(str)
+    group_cols = ['MissingIn', 'Run', 'Plate']
+    # the database wells might have no Run/Plate
+    reconcile_df = missing_df.groupby(group_cols, dropna=False).size().rename("nWells").to_frame()
+    reconcile_df['Wells'] = missing_df.drop_duplicates(group_cols + ['Well']).groupby(group_cols, dropna=False)['Well'].agg(", ".join)
+    return reconcile_df.reset_index()
+
+
+def split_standards(lumi_df):
+    '''
+    splits the luminex data into the standards (std_df) and the data of the wells (lumi_df)
+    '''
+
+    lumi_df['Plex'] = lumi_df['Plex'].replace("21-Plex-StandardOnly", "21-Plex")
     
     # split off the std_df containing all the standards
-    std_df = lumi_df.loc[lumi_df['Type'].str.match("^[BCS]"), :].sort_values(['Run', 'Plex', 'Protein', 'Type'])
+    is_std = lumi_df['Type'].str.match("^[BCS]")
+    std_df = lumi_df.loc[is_std, :].sort_values(['Run', 'Plex', 'Protein', 'Type'])
     
     # keep on with the lumi_data without std data
-    lumi_df = lumi_df.loc[~lumi_df['Type'].str.match("^[BCS]"), :]
-    
-    # CONSISTENCY CHECK
+    return std_df, lumi_df.loc[~is_std, :]
+
+
+def check_wells(dbdf, lumi_wells, verbose=False):
+    '''
+    CONSISTENCY CHECK of the database wells and the luminex wells (Run, Plate, Plex, Well)
+    shows the missing wells and returns the reconcile_df (see reconcile_wells)
+    '''
+
     # merge the database and luminex for consistency check
-    merge_df = dbdf.loc[:, ['Project', 'Run', 'Plate', 'Plex', 'Well']].merge(lumi_df.loc[:, ['Run', 'Plate', 'Plex', 'Well']].drop_duplicates(), how="outer", indicator=True)
+    merge_df = merge_keyed(dbdf.loc[:, ['Project', 'Run', 'Plate', 'Plex', 'Well']], lumi_wells, how="outer", indicator=True)
+    reconcile_df = reconcile_wells(merge_df)
     # check for wells missing in luminex
     if len(ddbdf := merge_df.query('_merge == "left_only"')):
         show_output(f"{len(ddbdf)} database wells were not found in luminex data!", color="warning")
         print(ddbdf)
     else:
         show_output("All database wells have been found in Luminex data!", color="success")
-    # check for wells missing in database using the adhoc merge
-    missing_wells = False
-    missing_length = 0
-    for run in merge_df['Run'].unique():
-        for plate in merge_df.query('Run == @run')['Plate'].unique():
-            df = merge_df.query('Run == @run and Plate == @plate and _merge == "right_only"')
-            if (l := len(df)):
-                missing_wells = True
-                missing_length += l
-                if verbose:
-                    show_output(f"{l} wells missing from Run {run} - Plate {plate}", color="warning")
-                    show_output(list(df['Well'].unique()), color="warning")
-    if missing_wells:
-        if not verbose:
-            show_output(f"{missing_length} luminex wells were missing in database", color="warning")
+    # check for wells missing in database
+    if len(missing_df := reconcile_df.query('MissingIn == "DB"')):
+        if verbose:
+            for _, row in missing_df.iterrows():
+                show_output(f"{row['nWells']} wells missing from Run {row['Run']} - Plate {row['Plate']}", color="warning")
+                show_output(row['Wells'].split(", "), color="warning")
+        else:
+            show_output(f"{missing_df['nWells'].sum()} luminex wells were missing in database", color="warning")
     else:
         show_output("All luminex wells have been found in database")
-    
-    #### MERGE
-    # do the merge with the lumi data
-    merge_df = dbdf.merge(lumi_df, how="left").reset_index(drop=True)
-    
-    # keep the duplicates in a separate df
-    dup_df = pd.concat([
+    return reconcile_df
+
+
+def get_dup_df(std_df, merge_df):
+    '''
+    keep the duplicates in a separate df
+    concCI only exists for plates with conc files
+    '''
+
+    dup_df = concat_keyed([
         # get dups from standards
         std_df.loc[std_df.duplicated(['Run', 'Plex', 'Plate', 'Type', 'Protein'], keep=False), :],
         merge_df.loc[merge_df.duplicated(['Run', 'Plate', 'Plex', 'SampleName', 'Protein'], keep=False), :]
-    ]).loc[:, dup_cols] 
-    
+    ])
+    return dup_df.loc[:, [col for col in dup_cols if col in dup_df.columns]]
+
+
+def aggregate_lumi(merge_df, replicate_stats=False):
+    '''
+    computes the weight-integrated conc of the merged data and aggregates it per measurement and per sample
+    returns well_df, measure_df and sample_df
+    '''
+
     # compute the weight-integrated resConc
     # returns a df indexed for all metadata columns 
     conc_df = compute_resConc(merge_df)
@@ -220,10 +270,230 @@ def mergeDB2Lumi(dbdf, luminexcel="", verbose=False):
     # make an agg_dict that aggregates all proteins with np.mean and note with "first"
     agg_dict = {'Note':"first"}
     agg_dict.update({prot:np.mean for prot in protein_cols})
-    measure_df = get_measurements(well_df, agg_dict)
+    measure_df = get_measurements(well_df, agg_dict, replicate_stats=replicate_stats)
     # sample_df has to be created differently    
-    sample_df = make_sample_df(measure_df, agg_dict).loc[:, sample_cols + ['RunGroup', 'Note'] + plex_cols + protein_cols]
-    return merge_df, std_df, dup_df, well_df, measure_df, sample_df
+    sample_df = make_sample_df(measure_df, agg_dict)
+    # plexes without any measurement of these samples have Run 0
+    sample_df = sample_df.assign(**{plex: 0 for plex in plex_cols if plex not in sample_df.columns})
+    sample_df = sample_df.loc[:, sample_cols + ['RunGroup', 'Note'] + plex_cols + protein_cols]
+    return well_df, measure_df, sample_df
+
+
+def get_lumi_wells(lumi_df):
+    '''
+    the wells (Run, Plate, Plex, Well) of the luminex data
+    '''
+
+    return lumi_df.loc[:, ['Run', 'Plate', 'Plex', 'Well']].drop_duplicates()
+
+
+def merge_lumi(dbdf, lumi_df, verbose=False, replicate_stats=False):
+    '''
+    merges the loaded luminex data into the database rows (see mergeDB2Lumi)
+    returns the tables of mergeDB2Lumi and the luminex wells
+    '''
+
+    std_df, lumi_df = split_standards(lumi_df)
+    lumi_wells = get_lumi_wells(lumi_df)
+    reconcile_df = check_wells(dbdf, lumi_wells, verbose=verbose)
+    
+    #### MERGE
+    # do the merge with the lumi data
+    merge_df = merge_keyed(dbdf, lumi_df, how="left").reset_index(drop=True)
+    dup_df = get_dup_df(std_df, merge_df)
+    well_df, measure_df, sample_df = aggregate_lumi(merge_df, replicate_stats=replicate_stats)
+    return (merge_df, std_df, dup_df, well_df, measure_df, sample_df, reconcile_df), lumi_wells
+
+
+def mergeDB2Lumi(dbdf, luminexcel="", verbose=False, runs=None, replicate_stats=False):
+    '''
+    load in the luminex data and merge in the respective Luminexdata
+    with runs, only the luminex data of these runs is used
+    with replicate_stats, measure_df gets the replicate QC columns (see get_measurements)
+    the consistency check of the wells is returned as reconcile_df (see reconcile_wells)
+    '''
+    
+    # load the computed Luminex data per well
+    lumi_df = read_lumi_tidy(luminexcel, runs=runs)
+    return merge_lumi(dbdf, lumi_df, verbose=verbose, replicate_stats=replicate_stats)[0]
+
+
+def get_state_file(excel_out):
+    '''
+    the state of the incremental DB merge lives next to the output: <folder>/.<excel_out>.state.pkl
+    '''
+
+    folder, name = os.path.split(excel_out)
+    return os.path.join(folder, f".{name}.state.pkl")
+
+
+def load_DB_state(state_file, settings):
+    '''
+    loads the state of the last DB merge if it has been created with the same settings
+    returns None if there is no (usable) state
+    '''
+
+    if not state_file or not os.path.isfile(state_file):
+        return None
+    try:
+        with open(state_file, "rb") as stream:
+            state = pickle.load(stream)
+    except (pickle.UnpicklingError, EOFError, OSError, AttributeError, ImportError):
+        show_output(f"DB state {state_file} could not be read and will be rebuilt", color="warning")
+        return None
+    if state.get('version') != DB_STATE_VERSION or state.get('settings') != settings:
+        return None
+    return state
+
+
+def save_DB_state(state, state_file):
+    '''
+    writes the state of the DB merge (atomic replace)
+    '''
+
+    tmp_file = f"{state_file}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, "wb") as stream:
+            pickle.dump(state, stream, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, state_file)
+    except OSError:
+        show_output(f"DB state {state_file} could not be written", color="warning")
+
+
+def get_sample_keys(df):
+    '''
+    the SampleName of every row as string (the unit of the incremental update)
+    '''
+
+    return df['SampleName'].astype(str)
+
+
+def get_sample_hashes(dbdf):
+    '''
+    a hash per SampleName over all its database rows (independent of the row order)
+    '''
+
+    row_hashes = pd.Series(pd.util.hash_pandas_object(dbdf, index=False).to_numpy())
+    return row_hashes.groupby(get_sample_keys(dbdf).to_numpy()).sum().to_dict()
+
+
+def get_run_versions(luminexcel, runs=None):
+    '''
+    a version per Run of the luminex data to detect changed runs
+    for a store, the version comes from the manifest entries of the plates (no data is read)
+        partitions rewritten for the standards of later plates change the version by their update time
+    for a luminexcel, the tidyData rows are hashed and the loaded tidyData is returned as well
+    returns the versions (Run as in to_run -> version) and the lumi_df (None for a store)
+    '''
+
+    if os.path.isdir(luminexcel):
+        entries = {}
+        for key, entry in sorted(LumiStore(luminexcel).manifest['plates'].items()):
+            entries.setdefault(to_run(entry['Run']), []).append([key, entry['partition'], entry['ingested'], entry.get('updated', "")])
+        versions, lumi_df = {run: json.dumps(entry) for run, entry in entries.items()}, None
+    else:
+        lumi_df = read_lumi_tidy(luminexcel)
+        run_keys = lumi_df['Run'].map(to_run).to_numpy()
+        row_hashes = pd.Series(pd.util.hash_pandas_object(lumi_df, index=False).to_numpy())
+        versions = {run: str(run_hash) for run, run_hash in row_hashes.groupby(run_keys).sum().items()}
+    if runs is not None:
+        runs = {to_run(run) for run in runs}
+        versions = {run: version for run, version in versions.items() if run in runs}
+    return versions, lumi_df
+
+
+def select_runs(luminexcel, runs=None, lumi_df=None):
+    '''
+    the luminex data of the runs (see read_lumi_tidy)
+    taken from lumi_df if the tidyData of a luminexcel has already been loaded
+    '''
+
+    if lumi_df is None:
+        return read_lumi_tidy(luminexcel, runs=runs)
+    if runs is None:
+        return lumi_df
+    return lumi_df.loc[lumi_df['Run'].map(to_run).isin({to_run(run) for run in runs}), :].reset_index(drop=True)
+
+
+def splice_samples(old_df, new_df, samples, protein_cols=[]):
+    '''
+    replaces the rows of the samples in old_df with the rows of new_df
+    the protein columns (and their _n and _CV columns) are sorted after all other columns like in a full merge
+    proteins missing in old_df or new_df have no replicates (_n = 0)
+    '''
+
+    df = concat_keyed([old_df.loc[~get_sample_keys(old_df).isin(samples), :], new_df], ignore_index=True)
+    stat_cols = [col + suff for suff in ["", "_n", "_CV"] for col in sorted(protein_cols) if col + suff in df.columns]
+    df = df.assign(**{col: df[col].fillna(0).astype(int) for col in stat_cols if col.endswith("_n")})
+    return df.loc[:, [col for col in df.columns if col not in stat_cols] + stat_cols]
+
+
+def update_DB2Lumi(dbdf, luminexcel="", state_file="", verbose=False, runs=None, replicate_stats=False, settings={}):
+    '''
+    incremental mergeDB2Lumi using the state of the last merge (state_file)
+    only the samples with new or changed database rows or with wells in new or changed luminex runs are merged and aggregated again
+    the other rows of the last merge are kept
+    without a usable state, everything is merged and the state is created
+    '''
+
+    state = load_DB_state(state_file, settings)
+    versions, lumi_full = get_run_versions(luminexcel, runs=runs)
+    sample_hashes = get_sample_hashes(dbdf)
+    if state is None:
+        show_output("No previous DB merge found - merging all data")
+        tables, lumi_wells = merge_lumi(dbdf, select_runs(luminexcel, runs, lumi_full), verbose=verbose, replicate_stats=replicate_stats)
+    else:
+        merge_df, std_df, dup_df, well_df, measure_df, sample_df, reconcile_df = state['tables']
+        lumi_wells = state['lumi_wells']
+        # the runs with new, changed or removed plates
+        changed_runs = {run for run in set(versions) | set(state['versions']) if versions.get(run) != state['versions'].get(run)}
+        # the samples with new, changed or removed database rows or with wells in the changed runs
+        samples = {sample for sample in set(sample_hashes) | set(state['samples']) if sample_hashes.get(sample) != state['samples'].get(sample)}
+        samples |= set(get_sample_keys(dbdf).loc[dbdf['Run'].map(to_run).isin(changed_runs)])
+        show_output(f"Incremental DB merge: {len(changed_runs)} new or changed runs, merging {len(samples)} of {len(sample_hashes)} samples")
+        if len(samples) or len(changed_runs):
+            sample_dbdf = dbdf.loc[get_sample_keys(dbdf).isin(samples), :]
+            # the luminex data of the changed runs and of all runs of the samples
+            read_runs = changed_runs | (set(sample_dbdf['Run'].map(to_run)) & set(versions))
+            lumi_df = select_runs(luminexcel, read_runs, lumi_full)
+            new_std_df, lumi_df = split_standards(lumi_df)
+            # the standards and wells of the changed runs are replaced
+            std_df = concat_keyed([
+                std_df.loc[~std_df['Run'].map(to_run).isin(changed_runs), :],
+                new_std_df.loc[new_std_df['Run'].map(to_run).isin(changed_runs), :]
+            ]).sort_values(['Run', 'Plex', 'Protein', 'Type'])
+            lumi_wells = concat_keyed([
+                lumi_wells.loc[~lumi_wells['Run'].map(to_run).isin(changed_runs), :],
+                get_lumi_wells(lumi_df.loc[lumi_df['Run'].map(to_run).isin(changed_runs), :])
+            ])
+            reconcile_df = check_wells(dbdf, lumi_wells, verbose=verbose)
+            
+            # merge and aggregate the samples
+            # aggregate_lumi adds ResConc and ResUnit to the merge, so it is spliced afterwards
+            sample_merge_df = merge_keyed(sample_dbdf, lumi_df, how="left").reset_index(drop=True)
+            if len(sample_merge_df.index):
+                sample_tables = aggregate_lumi(sample_merge_df, replicate_stats=replicate_stats)
+            else:
+                sample_tables = [df.iloc[:0] for df in [well_df, measure_df, sample_df]]
+            merge_df = splice_samples(merge_df, sample_merge_df, samples)
+            # all columns that are not in the merge are protein columns
+            index_cols = [col for col in merge_df.columns if col not in lumi_cols]
+            protein_cols = [col for col in set(well_df.columns) | set(sample_tables[0].columns) if col not in index_cols]
+            well_df, measure_df, sample_df = [splice_samples(old_df, new_df, samples, protein_cols) for old_df, new_df in zip([well_df, measure_df, sample_df], sample_tables)]
+            dup_df = get_dup_df(std_df, merge_df)
+        else:
+            show_output("No new or changed data - keeping the last DB merge", color="success")
+        tables = merge_df, std_df, dup_df, well_df, measure_df, sample_df, reconcile_df
+    
+    save_DB_state(dict(
+        version=DB_STATE_VERSION,
+        settings=settings,
+        versions=versions,
+        samples=sample_hashes,
+        lumi_wells=lumi_wells,
+        tables=tables
+    ), state_file)
+    return tables
 
 
 def merge_DBcases(sample_df, db_dict):
@@ -231,10 +501,10 @@ def merge_DBcases(sample_df, db_dict):
     take all levels of the MSHDB and and return the files for the different projects
     '''
 
-    dbdf = flatten_notes(db_dict['Cases'].merge(sample_df, how="left"))
+    dbdf = flatten_notes(merge_keyed(db_dict['Cases'], sample_df, how="left"))
     show_output("Merging Cases")
     show_dups(dbdf)
-    dbdf = flatten_notes(db_dict['Patients'].merge(dbdf, how="left"))
+    dbdf = flatten_notes(merge_keyed(db_dict['Patients'], dbdf, how="left"))
     show_output("Merging Patients")
     show_dups(dbdf)
 
@@ -242,15 +512,39 @@ def merge_DBcases(sample_df, db_dict):
     return dbdf
 
 
-def collect_DB_data(DB_file="", luminexcel="", verbose=False, excel_out=""):
+def collect_DB_data(DB_file="", luminexcel="", verbose=False, excel_out="", projects=None, replicate_stats=False, incremental=False, state_file=""):
     '''
     collect all data 
+    with projects (e.g. ["NAC"]), only the samples of these projects and the luminex data of their runs are used
+    with replicate_stats, the Measurements get n and CV of the replicates per protein (<protein>_n, <protein>_CV)
+    with incremental, the luminex merge is updated from the state of the last call (see update_DB2Lumi)
+        the state is kept in state_file (default: .<excel_out>.state.pkl next to excel_out)
+    the reconciliation of database and luminex wells (reconcile_df) is returned (and written to the sheet Reconciliation with excel_out)
     '''
     # get the sample metadata for merging with luminexcel
     dbdf, db_dict = merge_DBsamples(DB_file)
+    runs = None
+    if projects is not None:
+        dbdf = dbdf.loc[dbdf['Project'].isin(projects), :]
+        runs = list(dbdf['Run'].dropna().unique())
+        # the clinical data are merged onto the samples with how="left" (merge_DBcases)
+        db_dict = {**db_dict, **{sheet: db_dict[sheet].loc[db_dict[sheet]['Project'].isin(projects), :] for sheet in ['Cases', 'Patients']}}
     
     # combine DB data with luminex data
-    merge_df, std_df, dup_df, well_df, measure_df, sample_df = mergeDB2Lumi(dbdf, luminexcel, verbose=verbose)
+    if incremental and not (state_file := state_file or (get_state_file(excel_out) if excel_out else "")):
+        show_output("The incremental DB merge needs a state_file or excel_out - merging all data", color="warning")
+        incremental = False
+    if incremental:
+        settings = dict(
+            luminexcel=os.path.abspath(luminexcel),
+            projects=None if projects is None else sorted(projects),
+            replicate_stats=replicate_stats
+        )
+        merge_df, std_df, dup_df, well_df, measure_df, sample_df, reconcile_df = update_DB2Lumi(
+            dbdf, luminexcel, state_file=state_file, verbose=verbose, runs=runs, replicate_stats=replicate_stats, settings=settings
+        )
+    else:
+        merge_df, std_df, dup_df, well_df, measure_df, sample_df, reconcile_df = mergeDB2Lumi(dbdf, luminexcel, verbose=verbose, runs=runs, replicate_stats=replicate_stats)
     
     # merge the clinical data
     sample_df = flatten_notes(merge_DBcases(sample_df, db_dict))
@@ -276,8 +570,9 @@ def collect_DB_data(DB_file="", luminexcel="", verbose=False, excel_out=""):
             well_df.to_excel(writer, sheet_name="Wells", index=False)
             measure_df.to_excel(writer, sheet_name="Measurements", index=False)
             sample_df.to_excel(writer, sheet_name="Samples", index=False)
+            reconcile_df.to_excel(writer, sheet_name="Reconciliation", index=False)
     
-    return merge_df, std_df, dup_df, well_df, measure_df, sample_df
+    return merge_df, std_df, dup_df, well_df, measure_df, sample_df, reconcile_df
 
 
 ############ ANALYSE #####################################
@@ -294,7 +589,7 @@ def getNAC(measure_df, sample_df):
     # get the statistics for the responders based on plates
     nac_mdf.loc[:, ['CR', 'NR', 'PA', 'PROG']] = pd.get_dummies(nac_mdf['NACresponse'])
     nacc = nac_mdf.loc[:, ['PatientCode', 'Sex', 'Age', 'muscle-invasive', 'SampleName', 'Run', 'Plex', 'Plate', 'CR', 'NR', 'PA', 'PROG']]
-    plate_df = nacc.drop(['PatientCode', 'Sex', 'Age', 'muscle-invasive', 'SampleName'], axis=1).groupby(['Run', 'Plex', 'Plate']).agg(np.sum).loc[lambda x: x.sum(axis=1)>0, :]# 
+    plate_df = nacc.drop(['PatientCode', 'Sex', 'Age', 'muscle-invasive', 'SampleName'], axis=1).groupby(['Run', 'Plex', 'Plate'], observed=True).agg(np.sum).loc[lambda x: x.sum(axis=1)>0, :]# 
     plate_df['ratioCR'] = plate_df['CR'] / plate_df.sum(axis=1)
     plate_df = plate_df.sort_values(['Plex', 'ratioCR']).reset_index()
     return nac_mdf, nac_sdf, plate_df
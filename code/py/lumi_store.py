@@ -0,0 +1,535 @@
+import os
+import re
+import json
+import shutil
+import pandas as pd
+from datetime import datetime
+
+from script_utils import show_output
+from standard_curve import add_curves, export_standards
+from excel_cache import get_file_hash
+from DBcols import key_cols, set_key_dtypes, concat_keyed
+
+# pyarrow is needed for the columnar results (parquet/feather)
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.feather as feather
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+
+# the result tables (same names as the sheets of luminexcel.xlsx)
+RESULT_TABLES = ['Plates', 'Standards', 'ProteinStats', 'tidyData', 'tidyDataFull']
+# tables with few rows per plate are stored as one file
+# PlateStats holds the partial protein stats per plate that add up to the ProteinStats (not part of the excel file)
+FILE_TABLES = ['Plates', 'Standards', 'ProteinStats', 'PlateStats']
+# the data of every plate is stored in its own partition (tidyData is a column subset of it)
+PARTITION_TABLE = "tidyDataFull"
+# the repetitive string columns are stored dictionary-encoded
+KEY_COLS = ['Run', 'Plex', 'PlexName', 'Protein', 'Well', 'Type', 'SE']
+RESULT_FORMATS = {'parquet': ".parquet", 'feather': ".feather"}
+PLATE_COLS = ['Run', 'Plex', 'Plate']
+SOURCE_COLS = ['rawPath', 'concPath']
+# bump if the layout of the store changes
+MANIFEST_VERSION = 1
+
+
+def get_results_folder(analysis_folder):
+    '''
+    the folder of the columnar results of an analysis
+    '''
+
+    return os.path.join(analysis_folder, "luminexresults")
+
+
+def get_result_file(results_folder, table, results_format="parquet"):
+    return os.path.join(results_folder, table + RESULT_FORMATS[results_format])
+
+
+def get_manifest_file(results_folder):
+    return os.path.join(results_folder, "manifest.json")
+
+
+def get_plate_key(run, plex, plate):
+    return f"{run}|{plex}|{plate}"
+
+
+def get_partition(run, plex, plate, results_format="parquet"):
+    '''
+    the file of a plate partition relative to the results_folder
+    '''
+
+    name = re.sub(r"[^\w.-]", "_", f"{run}_{plex}_Plate{plate}")
+    return os.path.join(PARTITION_TABLE, name + RESULT_FORMATS[results_format])
+
+
+def load_manifest(results_folder):
+    '''
+    loads the manifest of the store in results_folder
+    returns None if there is no (usable) store
+    the manifest contains
+        results_format
+        tidy_cols: the columns of tidyData
+        plates: Run|Plex|Plate -> {Run, Plex, Plate, partition, proteins, sources: {rawPath/concPath: {path, size, mtime, hash}}, ingested}
+            partitions rewritten for the standards of later plates also have the time of that update (updated)
+    '''
+
+    manifest_file = get_manifest_file(results_folder)
+    if not os.path.isfile(manifest_file):
+        return None
+    try:
+        with open(manifest_file, "r") as stream:
+            manifest = json.load(stream)
+    except (ValueError, OSError):
+        show_output(f"Manifest {manifest_file} could not be read!", color="warning")
+        return None
+    return manifest if manifest.get('version') == MANIFEST_VERSION else None
+
+
+def save_manifest(manifest, results_folder):
+    '''
+    writes the manifest (atomic replace), this commits the written partitions
+    '''
+
+    manifest_file = get_manifest_file(results_folder)
+    tmp_file = f"{manifest_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "w") as stream:
+        json.dump(manifest, stream, indent=1)
+    os.replace(tmp_file, manifest_file)
+
+
+def has_results(results_folder):
+    '''
+    checks if results_folder contains a store
+    '''
+
+    return load_manifest(results_folder) is not None
+
+
+def get_source_info(file, data_path=""):
+    '''
+    the manifest entry of a source file (path relative to data_path)
+    '''
+
+    if not file or not os.path.isfile(abs_file := os.path.join(data_path, file)):
+        return {}
+    stat = os.stat(abs_file)
+    return dict(path=file, size=stat.st_size, mtime=stat.st_mtime, hash=get_file_hash(abs_file))
+
+
+def is_unchanged(source, file, data_path=""):
+    '''
+    checks a source file against its manifest entry
+    the hash is only computed if mtime or size have changed
+    '''
+
+    if not file:
+        return not source
+    if source.get('path') != file or not os.path.isfile(abs_file := os.path.join(data_path, file)):
+        return False
+    stat = os.stat(abs_file)
+    if (source['size'], source['mtime']) == (stat.st_size, stat.st_mtime):
+        return True
+    return source['size'] == stat.st_size and source['hash'] == get_file_hash(abs_file)
+
+
+def get_source_files(plate):
+    '''
+    the source files of a plate row (rawPath and concPath relative to data_path)
+    '''
+
+    return {col: file if isinstance(file := plate.get(col), str) else "" for col in SOURCE_COLS}
+
+
+def get_new_plates(plate_df, results_folder, data_path=""):
+    '''
+    reduces the plate_df (from get_luminex_plates) to the plates that are not in the store
+    or whose source files have changed since they were stored
+    '''
+
+    plates = load_manifest(results_folder)['plates']
+    is_new = []
+    for _, plate in plate_df.iterrows():
+        if (entry := plates.get(get_plate_key(*plate[PLATE_COLS]))) is None:
+            is_new.append(True)
+            continue
+        sources = get_source_files(plate)
+        is_new.append(not all(is_unchanged(entry['sources'].get(col, {}), file, data_path) for col, file in sources.items()))
+    return plate_df.loc[is_new, :]
+
+
+def fix_mixed_col(col):
+    '''
+    object columns with strings and numbers (like SE: "1,4" and 1.0) cannot be stored by arrow
+    the numbers are stored as strings ("1" for 1.0)
+    '''
+
+    return col.map(lambda v: v if isinstance(v, str) or v is None or v != v else f"{v:g}" if isinstance(v, float) else str(v))
+
+
+def to_arrow(df):
+    '''
+    converts a result df into an arrow table with dictionary-encoded KEY_COLS
+    '''
+
+    df = df.reset_index(drop=True)
+    for col in df.columns[df.dtypes == object]:
+        if set(df[col].dropna().map(type)) - {str}:
+            df[col] = fix_mixed_col(df[col])
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for i, field in enumerate(table.schema):
+        if field.name in KEY_COLS and pa.types.is_string(field.type):
+            table = table.set_column(i, field.name, table.column(i).dictionary_encode())
+    return table
+
+
+def from_arrow(table):
+    '''
+    converts a stored arrow table back into a result df
+    the key columns stay categoricals (see DBcols), the other dictionary columns are decoded
+    '''
+
+    df = set_key_dtypes(table.to_pandas())
+    for col in df.columns[df.dtypes == "category"]:
+        if col not in key_cols:
+            df[col] = df[col].astype(object)
+    return df
+
+
+def write_table(df, result_file, results_format="parquet", compression="zstd"):
+    '''
+    writes one result table (via a tmp file so an interrupted write leaves the old table intact)
+    '''
+
+    tmp_file = result_file + ".tmp"
+    table = to_arrow(df)
+    if results_format == "parquet":
+        pq.write_table(table, tmp_file, compression=compression)
+    else:
+        feather.write_feather(table, tmp_file, compression=compression)
+    os.replace(tmp_file, result_file)
+
+
+def read_table(result_file, columns=None):
+    '''
+    reads one result table (parquet or feather)
+    '''
+
+    if result_file.endswith(RESULT_FORMATS['parquet']):
+        table = pq.read_table(result_file, columns=columns)
+    else:
+        table = feather.read_table(result_file, columns=columns)
+    return from_arrow(table)
+
+
+def write_partitions(data_df, results_folder, results_format="parquet", compression="zstd"):
+    '''
+    writes the data of every plate into its partition
+    returns the partition and the proteins of every plate key
+    '''
+
+    partitions = {}
+    os.makedirs(os.path.join(results_folder, PARTITION_TABLE), exist_ok=True)
+    for (run, plex, plate), df in data_df.groupby(PLATE_COLS, sort=False, observed=True):
+        partition = get_partition(run, plex, plate, results_format)
+        write_table(df, os.path.join(results_folder, partition), results_format=results_format, compression=compression)
+        partitions[get_plate_key(run, plex, plate)] = dict(partition=partition, proteins=sorted(df['Protein'].astype(str).unique()))
+    return partitions
+
+
+def update_table(old_df, new_df, sort_cols):
+    '''
+    replaces the plates of new_df in old_df
+    '''
+
+    if old_df is None or not len(old_df.index):
+        return new_df
+    old_keys = old_df.loc[:, PLATE_COLS].astype(str).agg("|".join, axis=1)
+    new_keys = set(new_df.loc[:, PLATE_COLS].astype(str).agg("|".join, axis=1))
+    return concat_keyed([old_df.loc[~old_keys.isin(new_keys), :], new_df]).sort_values(sort_cols).reset_index(drop=True)
+
+
+def write_results(tables, results_folder, results_format="parquet", data_path="", append=False, compression="zstd"):
+    '''
+    writes the result tables (dict of dfs with RESULT_TABLES as keys) to the store in results_folder
+        Plates, Standards and ProteinStats are stored as one file each
+        tidyDataFull is stored in one partition per plate (tidyData is not stored separately)
+        the manifest records the source files of every plate (paths relative to data_path)
+    with append, only the plates in tables are written (replacing stored plates with the same Run-Plex-Plate)
+    and Plates, Standards and PlateStats are updated, the partitions of all other plates are not touched
+    stored plates that are only in tidyDataFull (not in Plates) get their partition rewritten (see read_protein_plates)
+    the curves of the Standards are stored as params strings (full precision)
+    '''
+
+    if pa is None:
+        show_output("pyarrow is needed for writing the results as parquet/feather!", color="warning")
+        return False
+    if append and (manifest := load_manifest(results_folder)) is not None:
+        # an existing store keeps its format
+        results_format = manifest['results_format']
+    else:
+        if results_format not in RESULT_FORMATS:
+            show_output(f"Unknown results_format {results_format}! Use one of {list(RESULT_FORMATS)}", color="warning")
+            return False
+        append = False
+        manifest = dict(version=MANIFEST_VERSION, results_format=results_format, tidy_cols=[], plates={})
+        # a new store replaces everything of the old one
+        shutil.rmtree(os.path.join(results_folder, PARTITION_TABLE), ignore_errors=True)
+        for table in FILE_TABLES:
+            for ext in RESULT_FORMATS.values():
+                if os.path.isfile(result_file := os.path.join(results_folder, table + ext)):
+                    os.remove(result_file)
+    os.makedirs(results_folder, exist_ok=True)
+
+    # the tables with one file
+    sort_cols = dict(Plates=PLATE_COLS, Standards=PLATE_COLS + ['Protein'], PlateStats=PLATE_COLS + ['Protein'])
+    for table in FILE_TABLES:
+        if (df := tables.get(table)) is None:
+            continue
+        # the stored params keep their full precision
+        if table == "Standards":
+            df = export_standards(df, decimals=None)
+        result_file = get_result_file(results_folder, table, results_format)
+        if append and table in sort_cols:
+            df = update_table(read_table(result_file) if os.path.isfile(result_file) else None, df, sort_cols[table])
+        write_table(df, result_file, results_format=results_format, compression=compression)
+
+    # the plate partitions
+    partitions = write_partitions(tables[PARTITION_TABLE], results_folder, results_format=results_format, compression=compression) if PARTITION_TABLE in tables else {}
+    ingested = datetime.now().isoformat(timespec="seconds")
+    for _, plate in tables.get('Plates', pd.DataFrame()).iterrows():
+        key = get_plate_key(*plate[PLATE_COLS])
+        # a replaced plate without data loses its old partition
+        if (old_partition := manifest['plates'].get(key, {}).get('partition')) and key not in partitions:
+            if os.path.isfile(old_file := os.path.join(results_folder, old_partition)):
+                os.remove(old_file)
+        partition = partitions.pop(key, dict(partition="", proteins=[]))
+        manifest['plates'][key] = dict(
+            Run=plate['Run'],
+            Plex=plate['Plex'],
+            Plate=int(plate['Plate']),
+            **partition,
+            sources={col: get_source_info(file, data_path) for col, file in get_source_files(plate).items()},
+            ingested=ingested
+        )
+    # the rewritten partitions of stored plates
+    for key, partition in partitions.items():
+        if key in manifest['plates']:
+            manifest['plates'][key].update(**partition, updated=ingested)
+    if (tidy_df := tables.get('tidyData')) is not None:
+        manifest['tidy_cols'] += [col for col in tidy_df.columns if col not in manifest['tidy_cols']]
+    save_manifest(manifest, results_folder)
+    return True
+
+
+def read_partitions(results_folder, manifest, columns=None):
+    '''
+    concats the partitions of all plates in the manifest
+    the rows are sorted like the tidyData of read_luminex_folder
+    '''
+
+    dfs = [read_table(os.path.join(results_folder, entry['partition']), columns=columns) for entry in manifest['plates'].values() if entry['partition']]
+    if not len(dfs):
+        return pd.DataFrame(columns=columns or manifest['tidy_cols'])
+    df = concat_keyed(dfs)
+    sort_cols = [col for col in ['Run', 'Plex', 'Protein', 'Type', 'Well'] if col in df.columns]
+    return df.sort_values(sort_cols, kind="stable").reset_index(drop=True)
+
+
+def get_plate_proteins(results_folder, entry):
+    '''
+    the proteins of a stored plate (from the manifest or, for older stores, from its partition)
+    '''
+
+    if 'proteins' in entry:
+        return entry['proteins']
+    if not entry['partition']:
+        return []
+    return list(read_table(os.path.join(results_folder, entry['partition']), columns=['Protein'])['Protein'].astype(str).unique())
+
+
+def read_protein_plates(results_folder, proteins, exclude=[]):
+    '''
+    loads the tidyDataFull of the stored plates that contain any of the proteins
+    the plates with the keys in exclude (Run|Plex|Plate) are skipped
+    '''
+
+    manifest = load_manifest(results_folder)
+    proteins, exclude = set(proteins), set(exclude)
+    plates = {
+        key: entry for key, entry in manifest['plates'].items()
+        if key not in exclude and proteins.intersection(get_plate_proteins(results_folder, entry))
+    }
+    return read_partitions(results_folder, dict(manifest, plates=plates))
+
+
+def read_results(results_folder, tables=RESULT_TABLES):
+    '''
+    loads the result tables from the store in results_folder into a dict of dfs
+    the params strings of the Standards become typed curves again
+    '''
+
+    if (manifest := load_manifest(results_folder)) is None:
+        show_output(f"No results found in {results_folder}", color="warning")
+        return {}
+    results = {}
+    for table in tables:
+        if table not in FILE_TABLES:
+            continue
+        if os.path.isfile(result_file := get_result_file(results_folder, table, manifest['results_format'])):
+            results[table] = read_table(result_file)
+        else:
+            show_output(f"Result table {table} not found in {results_folder}", color="warning")
+    if PARTITION_TABLE in tables or "tidyData" in tables:
+        data_full = read_partitions(results_folder, manifest)
+        if PARTITION_TABLE in tables:
+            results[PARTITION_TABLE] = data_full
+        if "tidyData" in tables:
+            results['tidyData'] = data_full.loc[:, [col for col in manifest['tidy_cols'] if col in data_full.columns]]
+    if "Standards" in results:
+        results['Standards'] = add_curves(results['Standards'])
+    return results
+
+
+def to_values(values):
+    '''
+    turns a scalar or a list-like into a list (None stays None)
+    '''
+
+    if values is None:
+        return None
+    if isinstance(values, (str, int, float)):
+        return [values]
+    return list(values)
+
+
+def to_run(run):
+    '''
+    runs are stored as strings (220906.0 from a float column becomes "220906")
+    '''
+
+    return str(int(run)) if isinstance(run, float) and run.is_integer() else str(run)
+
+
+class LumiStore:
+    '''
+    lazy access to the store in results_folder (see write_results)
+    select only loads the matching rows and columns of the plate partitions:
+        runs, plex and plates select the partitions via the manifest
+        proteins and types are pushed down to the parquet reader (row groups) together with the columns
+    '''
+
+    def __init__(self, results_folder):
+        self.results_folder = results_folder
+        self.manifest = load_manifest(results_folder)
+        if self.manifest is None:
+            raise FileNotFoundError(f"No results found in {results_folder}")
+
+    def __repr__(self):
+        return f"LumiStore({self.results_folder}, {len(self.manifest['plates'])} plates)"
+
+    @property
+    def tidy_cols(self):
+        return self.manifest['tidy_cols']
+
+    def get_partitions(self, runs=None, plex=None, plates=None):
+        '''
+        the partition files of the plates matching runs, plex and plates
+        '''
+
+        runs = None if runs is None else {to_run(run) for run in to_values(runs)}
+        plex, plates = to_values(plex), to_values(plates)
+        return [
+            os.path.join(self.results_folder, entry['partition']) for entry in self.manifest['plates'].values()
+            if entry['partition']
+            and (runs is None or entry['Run'] in runs)
+            and (plex is None or entry['Plex'] in plex)
+            and (plates is None or entry['Plate'] in plates)
+        ]
+
+    def read_partition(self, partition, columns=None, filters=None):
+        '''
+        reads the columns of one partition that are stored in it
+        the filters [(col, "in", values)] are applied while reading
+        '''
+
+        if self.manifest['results_format'] == "parquet":
+            schema = pq.read_schema(partition)
+            cols = None if columns is None else [col for col in columns if col in schema.names]
+            return from_arrow(pq.read_table(partition, columns=cols, filters=filters or None))
+        table = feather.read_table(partition)
+        for col, _, values in filters or []:
+            table = table.filter(pc.is_in(table.column(col).cast(pa.string()), value_set=pa.array(values)))
+        cols = None if columns is None else [col for col in columns if col in table.column_names]
+        return from_arrow(table.select(cols) if cols is not None else table)
+
+    def select(self, runs=None, proteins=None, plex=None, types=None, plates=None, columns=None, table="tidyDataFull"):
+        '''
+        returns the rows of tidyDataFull (or tidyData) matching all given filters
+        every filter can be a single value or a list
+        columns restricts the output to these columns (default: all columns of the table)
+        '''
+
+        if table == "tidyData" and columns is None:
+            columns = self.tidy_cols
+        filters = [(col, "in", values) for col, values in [('Protein', to_values(proteins)), ('Type', to_values(types))] if values is not None]
+        dfs = [self.read_partition(partition, columns=columns, filters=filters) for partition in self.get_partitions(runs=runs, plex=plex, plates=plates)]
+        if not len(dfs):
+            return pd.DataFrame(columns=columns or self.tidy_cols)
+        df = concat_keyed(dfs)
+        if columns is not None:
+            df = df.loc[:, [col for col in columns if col in df.columns]]
+        sort_cols = [col for col in ['Run', 'Plex', 'Protein', 'Type', 'Well'] if col in df.columns]
+        return df.sort_values(sort_cols, kind="stable").reset_index(drop=True)
+
+    def table(self, name, runs=None, plex=None, proteins=None, columns=None):
+        '''
+        loads one of the single file tables (Plates, Standards, ProteinStats) with optional filters
+        '''
+
+        result_file = get_result_file(self.results_folder, name, self.manifest['results_format'])
+        df = read_table(result_file, columns=None if columns is None else list(columns))
+        for col, values in [('Run', runs), ('Plex', plex), ('Protein', proteins)]:
+            if values is not None and col in df.columns:
+                values = [to_run(run) for run in to_values(values)] if col == "Run" else to_values(values)
+                df = df.loc[df[col].isin(values), :]
+        df = df.reset_index(drop=True)
+        return add_curves(df) if name == "Standards" else df
+
+
+def write_results_excel(tables, excel_file, untidy_proteins=[]):
+    '''
+    writes the result tables to the luminexcel file
+    for untidy_proteins, the pivot tables of FI, conc, concCI and Fpos are added as sheets
+    '''
+
+    with pd.ExcelWriter(excel_file, mode="w") as writer:
+        # the sheets in the order of RESULT_TABLES (other tables like PlateStats are not exported)
+        for table, df in [(table, tables[table]) for table in RESULT_TABLES if table in tables]:
+            # drop the dfs in standard_df and write the curves as params strings
+            if table == "Standards":
+                df = export_standards(df)
+            df.to_excel(writer, sheet_name=table, index=False)
+        if not len(untidy_proteins):
+            return
+        data_df = tables['tidyData']
+        # concCI only exists if there are conc files
+        for col in [col for col in ['FI', 'conc', 'concCI', 'Fpos'] if col in data_df.columns]:
+            set_cols = ['Run', 'Plex', 'Plate', 'Well', 'Type', 'SE']
+            pivot_df = data_df.set_index(set_cols).pivot(columns="Protein", values=col).loc[:, untidy_proteins].dropna(how="all").reset_index(drop=False)
+            pivot_df.to_excel(writer, sheet_name=col, index=False)
+
+
+def results2excel(results_folder, excel_file="", output_untidy=True):
+    '''
+    derives the luminexcel file from the columnar results
+    '''
+
+    if not excel_file:
+        excel_file = os.path.join(os.path.dirname(os.path.normpath(results_folder)), "luminexcel.xlsx")
+    tables = read_results(results_folder)
+    untidy_proteins = list(tables['tidyData']['Protein'].unique()) if output_untidy else []
+    show_output(f"Writing excel output to {excel_file}")
+    write_results_excel(tables, excel_file, untidy_proteins=untidy_proteins)
+    return excel_file
@@ -0,0 +1,51 @@
+from itertools import chain
+import numpy as np
+import pandas as pd
+
+
+def get_note_tokens(note, sep="|"):
+    '''
+    the ordered tokens of a note (split at sep, empty tokens are skipped)
+    '''
+
+    return [token for token in str(note).split(sep) if token]
+
+
+def join_note_tokens(tokens, sep="|", wrap=True):
+    '''
+    joins the tokens into a note without duplicates (keeping the first occurrence)
+    with wrap, the note is enclosed in sep ("|a|b|"), no tokens give ""
+    '''
+
+    tokens = list(dict.fromkeys(tokens))
+    if not tokens:
+        return ""
+    note = sep.join(tokens)
+    return sep + note + sep if wrap else note
+
+
+def aggregate_notes(df, note_cols, sep="|", wrap=True):
+    '''
+    aggregates the notes of note_cols row-wise into one note (see join_note_tokens)
+    notes are treated as ordered sets of tokens, so duplicate tokens are removed exactly
+    the note columns are factorized and the note is only built once per distinct combination of notes
+    '''
+
+    if not len(note_cols) or not len(df.index):
+        return pd.Series("", index=df.index, dtype=object)
+    codes, tokens = [], []
+    # the combination of the notes of a row as one code (factorized after every column to stay small)
+    combo_codes = np.zeros(len(df.index), dtype=np.int64)
+    for col in note_cols:
+        col_codes, uniques = pd.factorize(df[col])
+        codes.append(col_codes)
+        # missing notes have code -1 --> the appended empty tokens
+        tokens.append([get_note_tokens(note, sep=sep) for note in uniques] + [[]])
+        combo_codes = pd.factorize(combo_codes * (len(uniques) + 1) + col_codes + 1)[0]
+    # the first row of every combination (factorize numbers the combinations in order of appearance)
+    first = np.flatnonzero(np.r_[True, combo_codes[1:] > np.maximum.accumulate(combo_codes)[:-1]])
+    notes = np.array([
+        join_note_tokens(chain.from_iterable(col_tokens[col_codes[row]] for col_tokens, col_codes in zip(tokens, codes)), sep=sep, wrap=wrap)
+        for row in first
+    ], dtype=object)
+    return pd.Series(notes[combo_codes], index=df.index)
@@ -0,0 +1,140 @@
+import re
+import numpy as np
+import pandas as pd
+
+
+def match_types(types, pattern):
+    '''
+    boolean mask of the types matching the regex pattern (from the start like str.match)
+    the pattern is only matched once per distinct type
+    '''
+
+    names, codes = np.unique(np.asarray(types, dtype=str), return_inverse=True)
+    return np.array([bool(re.match(pattern, name)) for name in names], dtype=bool)[codes.reshape(-1)]
+
+
+def encode(values):
+    '''
+    integer codes (-1 for missing) and the distinct values of an array
+    '''
+
+    codes, uniques = pd.factorize(values)
+    return codes.astype(np.int16), uniques
+
+
+def decode(codes, uniques):
+    '''
+    the values of encoded codes (missing values become NaN)
+    '''
+
+    return pd.Series(uniques).reindex(codes).to_numpy()
+
+
+class PlateMatrix:
+    '''
+    compact representation of the raw data of one plate
+    holds the FI as a float array (wells x proteins) and per well the Well name, Type and Sampling Errors
+    Type and SE are stored as integer codes into the distinct values of the plate
+    conc and Fpos (from the standards of the plate) and concCI (from the conc file) are (wells x proteins) arrays as well
+    the fits work on views of the protein columns (get_protein), the long tidy frame is only created by to_frame
+    '''
+
+    __slots__ = ('Run', 'Plex', 'Plate', 'wells', 'type_codes', 'type_names', 'se_codes', 'se_values', 'proteins', 'FI', 'conc', 'Fpos', 'concCI')
+
+    def __init__(self, Run, Plex, Plate, wells, types, se, proteins, FI):
+        self.Run, self.Plex, self.Plate = Run, Plex, Plate
+        self.wells = np.asarray(wells, dtype=object)
+        self.type_codes, self.type_names = encode(np.asarray(types, dtype=object))
+        self.se_codes, self.se_values = encode(se)
+        self.proteins = list(proteins)
+        self.FI = np.asarray(FI, dtype=float).reshape(len(self.wells), len(self.proteins))
+        self.conc = self.Fpos = self.concCI = None
+
+    def __repr__(self):
+        return f"PlateMatrix({self.Run} {self.Plex} Plate{self.Plate}: {len(self.wells)} wells x {len(self.proteins)} proteins)"
+
+    @classmethod
+    def from_data_df(cls, data_df, Run, Plex, Plate):
+        '''
+        builds the matrix from the data_df of a raw data reader (Well, Type, the FI columns and SE)
+        '''
+
+        return cls(Run, Plex, Plate, data_df['Well'], data_df['Type'], data_df['SE'], data_df.columns[2:-1], data_df.iloc[:, 2:-1].to_numpy(dtype=float))
+
+    @property
+    def types(self):
+        return self.type_names[self.type_codes]
+
+    @property
+    def se(self):
+        return decode(self.se_codes, self.se_values)
+
+    def match_types(self, pattern):
+        '''
+        boolean mask of the wells whose Type matches the regex pattern
+        '''
+
+        return match_types(self.type_names, pattern)[self.type_codes] if len(self.type_names) else np.zeros(len(self.wells), dtype=bool)
+
+    def get_col(self, protein):
+        return self.proteins.index(protein)
+
+    def get_protein(self, protein):
+        '''
+        the data of one protein as dict of arrays (FI, conc and Fpos are views into the matrix)
+        '''
+
+        j = self.get_col(protein)
+        view = dict(Well=self.wells, Type=self.types, FI=self.FI[:, j])
+        if self.conc is not None:
+            view.update(conc=self.conc[:, j], Fpos=self.Fpos[:, j])
+        return view
+
+    def set_conc(self, protein, conc, Fpos):
+        '''
+        stores conc and Fpos of one protein and returns the view of the protein
+        '''
+
+        if self.conc is None:
+            self.conc = np.full(self.FI.shape, np.nan)
+            self.Fpos = np.full(self.FI.shape, np.nan)
+        j = self.get_col(protein)
+        self.conc[:, j], self.Fpos[:, j] = conc, Fpos
+        return self.get_protein(protein)
+
+    def add_concCI(self, conc_df):
+        '''
+        fills concCI from the long conc_df (Well, Protein, concCI) of read_conc_plate
+        wells and proteins that are not on the plate are ignored
+        '''
+
+        self.concCI = np.full(self.FI.shape, np.nan)
+        if not len(conc_df.index):
+            return
+        rows = pd.Series(np.arange(len(self.wells))).groupby(self.wells, sort=False).first()
+        cols = pd.Series(np.arange(len(self.proteins)), index=self.proteins)
+        conc_df = conc_df.loc[conc_df['Well'].isin(rows.index) & conc_df['Protein'].isin(cols.index), :].drop_duplicates(['Well', 'Protein'])
+        self.concCI[rows[conc_df['Well']].to_numpy(), cols[conc_df['Protein']].to_numpy()] = conc_df['concCI'].to_numpy(dtype=float)
+
+    def to_frame(self):
+        '''
+        the long tidy frame of the plate (one row per well and protein)
+        rows are sorted by Type, Protein and Well, conc, Fpos and concCI are added if present
+        '''
+
+        n_wells, n_proteins = self.FI.shape
+        data = dict(
+            Run=self.Run,
+            Plex=self.Plex,
+            Plate=self.Plate,
+            Well=np.tile(self.wells, n_proteins),
+            Type=np.tile(self.types, n_proteins),
+            SE=np.tile(self.se, n_proteins),
+            Protein=np.repeat(np.array(self.proteins, dtype=object), n_wells),
+            FI=self.FI.ravel(order="F")
+        )
+        for col in ['conc', 'Fpos', 'concCI']:
+            if (values := getattr(self, col)) is not None:
+                data[col] = values.ravel(order="F")
+        df = pd.DataFrame(data, index=pd.RangeIndex(n_wells * n_proteins))
+        return df.sort_values(['Type', 'Protein', 'Well'])
@@ -101,9 +101,10 @@ def plot_fitting(
     ####### OUTPUT ########################
     if plot_folder:
         # set (and create if neccessary) the fig_plot_path ( = plot_folder/Run) 
-        if not os.path.isdir(fig_plot_path := os.path.join(plot_folder, standard_row['Run'])):
-            os.makedirs(fig_plot_path)
-        fig_file_path = os.path.join(fig_plot_path, f"{standard_row['Protein']}.{plot_type}")
+        # exist_ok as the plots are rendered in parallel processes
+        os.makedirs(fig_plot_path := os.path.join(plot_folder, standard_row['Run']), exist_ok=True)
+        # every plate of a Run gets its own file
+        fig_file_path = os.path.join(fig_plot_path, f"{standard_row['Protein']}_Plate{standard_row['Plate']}.{plot_type}")
         fig.savefig(fig_file_path)
         if hide:
             plt.close()
@@ -214,8 +215,7 @@ def plot_multi(standard_df,data_df,
     ####### OUTPUT ########################
     if plot_folder:
         # set (and create if neccessary) the fig_plot_path ( = plot_folder/Run) 
-        if not os.path.isdir(fig_plot_path := os.path.join(plot_folder, "ProtPlots")):
-            os.makedirs(fig_plot_path)
+        os.makedirs(fig_plot_path := os.path.join(plot_folder, "ProtPlots"), exist_ok=True)
         fig_file_path = os.path.join(fig_plot_path, f"{standard_row['Protein']}.{plot_type}")
         fig.savefig(fig_file_path)
         if hide:
@@ -0,0 +1,136 @@
+import matplotlib
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+
+from script_utils import show_output
+from plot_fit import plot_fitting, plot_multi
+
+# the fields of a standard_row (and the arrays of its views) that the plots use
+PLOT_FIELDS = ['Run', 'Plate', 'Protein', 'curve', 'R^2', 'StMax', 'C1fit', 'C2fit', 'Fmin', 'Fmax', 'ConcMin', 'ConcMax', 'ss', 'sc', 'data']
+PLOT_COLS = dict(
+    ss=['Type', 'conc', 'FI'],
+    sc=['Cmin', 'Cmax', 'conc', 'FI'],
+    data=['FI', 'conc']
+)
+
+
+def get_plot_row(standard_row):
+    '''
+    reduces a standard_row to the compact description needed for plotting
+    the views in ss, sc and data (dicts of arrays) are reduced to the plotted arrays
+    '''
+
+    plot_row = standard_row.reindex(PLOT_FIELDS)
+    for col, cols in PLOT_COLS.items():
+        if isinstance(view := plot_row[col], (dict, pd.DataFrame)):
+            plot_row[col] = {c: np.asarray(view[c]) for c in cols if c in view}
+    return plot_row
+
+
+def get_plot_data(prot_df, prot_standard):
+    '''
+    reduces the data of one protein to the columns plot_external needs
+    '''
+
+    conc_cols = [f"conc{run}" for run in prot_standard['Run'].unique()]
+    return prot_df.loc[:, [col for col in ['Protein', 'FI', 'conc', 'concMean'] + conc_cols if col in prot_df.columns]]
+
+
+def init_plot_worker():
+    '''
+    initializer for the render processes: no display needed
+    '''
+
+    matplotlib.use("Agg")
+
+
+def render_fitting(plot_row, plot_config):
+    '''
+    renders and closes one plot_fitting figure
+    '''
+
+    fig, _ = plot_fitting(plot_row, **plot_config)
+    plt.close(fig)
+    return plot_row['Protein']
+
+
+def render_multi(prot_standard, prot_df, protein, plot_config):
+    '''
+    renders and closes one plot_multi figure
+    '''
+
+    fig, _ = plot_multi(prot_standard, prot_df, protein=protein, **plot_config)
+    plt.close(fig)
+    return protein
+
+
+class PlotQueue:
+    '''
+    renders the fit plots in background processes (Agg backend)
+    ingestion only enqueues the plot jobs and waits for them in drain()
+    with plot_workers=0 every plot is rendered right away in the calling process
+    '''
+
+    def __init__(self, plot_workers=2, verbose=False):
+        self.verbose = verbose
+        self.jobs = []
+        self.pool = ProcessPoolExecutor(max_workers=plot_workers, initializer=init_plot_worker) if plot_workers > 0 else None
+
+    def submit(self, render, *args):
+        if self.pool:
+            self.jobs.append(self.pool.submit(render, *args))
+        else:
+            render(*args)
+
+    def add_fitting(self, standard_df, **plot_config):
+        '''
+        enqueues plot_fitting for all rows of a standard_df
+        '''
+
+        plot_config = dict(plot_config, verbose=self.verbose, hide=True)
+        for _, standard_row in standard_df.iterrows():
+            self.submit(render_fitting, get_plot_row(standard_row), plot_config)
+
+    def add_multi(self, standard_df, data_df, **plot_config):
+        '''
+        enqueues plot_multi for all proteins of standard_df
+        '''
+
+        plot_config = dict(plot_config, verbose=self.verbose, hide=True)
+        # the rows of every protein (data_df is only grouped once)
+        protein_rows = data_df.groupby('Protein', sort=False, observed=True).indices
+        for protein, prot_standard in standard_df.groupby('Protein', sort=False, observed=True):
+            prot_standard = prot_standard.apply(get_plot_row, axis=1)
+            prot_df = data_df.iloc[protein_rows.get(protein, []), :]
+            self.submit(render_multi, prot_standard, get_plot_data(prot_df, prot_standard), protein, plot_config)
+
+    def drain(self):
+        '''
+        waits for all plot jobs and shuts down the render processes
+        failed plots are reported but do not stop the analysis
+        '''
+
+        if not self.pool:
+            return
+        if self.jobs:
+            show_output(f"Waiting for {len(self.jobs)} plots to be rendered")
+        for job in self.jobs:
+            if (error := job.exception()):
+                show_output(f"Plot could not be rendered: {error}", color="warning")
+        self.jobs = []
+        self.pool.shutdown()
+        self.pool = None
+
+    def close(self):
+        '''
+        shuts down the render processes after an error or an early return
+        plots that have not started yet are cancelled (a no-op after drain)
+        '''
+
+        if not self.pool:
+            return
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        self.pool = None
+        self.jobs = []
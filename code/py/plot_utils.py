@@ -43,27 +43,27 @@ def plot_standard(
     '''
 
     # extract data from standard_row
-    params, ss = list(standard_row.loc[['params', 'ss']])
-    # copy to keep standard_df['ss'] immutable
-    ss = ss.copy()
-    params = [float(p) for p in params.split(" | ")]
+    curve, ss = list(standard_row.loc[['curve', 'ss']])
+    # copy the conc to keep standard_df['ss'] immutable
+    ss_conc, ss_FI = np.array(ss['conc'], dtype=float), np.asarray(ss['FI'], dtype=float)
     ### adjust the zero_value
-    # get the minimum conc above the blank
-    min_conc = ss.drop_duplicates('Type').reset_index()['conc'].iloc[-2]
+    # get the minimum conc above the blank (conc of the second last Type)
+    _, first = np.unique(np.asarray(ss['Type'], dtype=str), return_index=True)
+    min_conc = ss_conc[np.sort(first)][-2]
     # take the next lower 10x level (with a dist)
     zero_conc = math.pow(10,math.floor(np.log10(min_conc)-zero_log_dist))
-    ss.loc[ss['conc'] == 0, 'conc'] = zero_conc
-    max_conc = ss['conc'].max()
-    max_FI = ss['FI'].max()
+    ss_conc[ss_conc == 0] = zero_conc
+    max_conc = np.nanmax(ss_conc)
+    max_FI = np.nanmax(ss_FI)
     ### fit the curve
     # plot one decade more than needed
-    conc, fit = fit_curve(params, xmin=zero_conc, ymax=max_conc*10)
+    conc, fit = fit_curve(curve.params, xmin=zero_conc, ymax=max_conc*10)
     _ = ax.scatter(conc, fit, s=.1, alpha=0.5, **kwargs)
-    _ = ax.scatter(ss['conc'], ss['FI'],  s=s, alpha=alpha, **kwargs)
+    _ = ax.scatter(ss_conc, ss_FI,  s=s, alpha=alpha, **kwargs)
     # plot the zero-plot a bit nicer
     _ = ax.scatter(
-        ss.loc[ss['conc'] == zero_conc, 'conc'],
-        ss.loc[ss['conc'] == zero_conc, 'FI'],
+        ss_conc[ss_conc == zero_conc],
+        ss_FI[ss_conc == zero_conc],
         s=s*15, alpha=alpha*0.1,**kwargs
     )
     # return maximum y value
@@ -80,19 +80,20 @@ def plot_controls(ax, standard_row,
     color in kwargs
     '''
     sc = standard_row['sc']
-    if len(sc):
+    if sc is not None and len(sc['FI']):
+        Cmin, Cmax, FI = [np.asarray(sc[col], dtype=float) for col in ['Cmin', 'Cmax', 'FI']]
         # fit the curve
-        for i in range(len(sc)):
-            _ = ax.plot(sc.loc[:,['Cmin', 'Cmax']].iloc[i], sc.loc[:,['FI', 'FI']].iloc[i],
+        for i in range(len(FI)):
+            _ = ax.plot([Cmin[i], Cmax[i]], [FI[i], FI[i]],
                 lw=lw,
                 **kwargs
             )
-        for c in ['Cmin', 'Cmax']:
-            _ = ax.scatter(sc[c], sc['FI'], 
+        for C in [Cmin, Cmax]:
+            _ = ax.scatter(C, FI, 
             s=s, 
             **kwargs
             ) #  - np.abs(data_df['Coff']) * 74)
-        return sc['FI'].max(), sc['conc'].max()
+        return np.nanmax(FI), np.nanmax(sc['conc'])
     return 0, 0
 
 
@@ -116,26 +117,27 @@ def plot_values(ax, standard_row,
     if multi:
         sample_off_color=sample_color
 
-    data_df, Fmin, Fmax = list(standard_row.loc[['data', 'Fmin', 'Fmax']])
-    if len(data_df):
-        in_range = (data_df['FI']>= Fmin) & (data_df['FI']<= Fmax)
-        out_off_range = ~in_range & (data_df['conc'] > plot_zero)
+    data, Fmin, Fmax = list(standard_row.loc[['data', 'Fmin', 'Fmax']])
+    FI, conc = np.asarray(data['FI'], dtype=float), np.asarray(data['conc'], dtype=float)
+    if len(FI):
+        in_range = (FI >= Fmin) & (FI <= Fmax)
+        out_off_range = ~in_range & (conc > plot_zero)
         # plot all computed values 
-        _ = ax.scatter(data_df.loc[in_range, 'conc'], data_df.loc[in_range, 'FI'], 
+        _ = ax.scatter(conc[in_range], FI[in_range], 
             marker=sample_marker,
             fc='none',
             color=sample_color,
             s=sample_point_size,
             alpha=sample_alpha,
             )
-        _ = ax.scatter(data_df.loc[out_off_range, 'conc'], data_df.loc[out_off_range, 'FI'], 
+        _ = ax.scatter(conc[out_off_range], FI[out_off_range], 
             marker=sample_off_marker, 
             color=sample_off_color,
             s=sample_off_size,
             alpha=sample_off_alpha,
             )
         # return maximum y value
-        return data_df['FI'].max(), data_df['conc'].max()
+        return np.nanmax(FI), np.nanmax(conc)
     return 0, 0
 
 
@@ -170,8 +172,8 @@ def plot_info(
     '''
     
     # extract the required data fields
-    params, R, StQ, C1fit, C2fit = list(standard_row.loc[['params', 'R^2', 'StMax', 'C1fit', 'C2fit']])
-    params = [float(p) for p in params.split(" | ")]
+    curve, R, StQ, C1fit, C2fit = list(standard_row.loc[['curve', 'R^2', 'StMax', 'C1fit', 'C2fit']])
+    params = curve.params
 
     # either show params or info field
     if show_fit_params:
@@ -305,7 +307,7 @@ def log_tick_x(
     ax.set_xscale('log')
     ax.xaxis.grid(True, which="both")
     major_ticks, minor_ticks, major_tick_labels = log_tick_steps(xmin,xmax,log_tick_step)
-    ax.get_xaxis().set_ticks(major_ticks, which="major")
+    ax.get_xaxis().set_ticks(major_ticks)
     ax.get_xaxis().set_ticks(minor_ticks, minor=True)
     ax.tick_params(which="major", width=1, length=8, bottom=True, left=True)
     ax.tick_params(which="minor", width=1, length=4, bottom=True, 
@@ -1,4 +1,7 @@
 import os
+from time import perf_counter
+from contextlib import contextmanager
+from collections import defaultdict
 from yaml import CLoader as Loader, load
 from datetime import datetime as dt
 
@@ -33,6 +36,32 @@ def show_output(text, color="normal", multi=False, time=False, **kwargs):
     print(time + proc + text, **kwargs)
 
 
+# run times of the analysis stages in seconds (summed up by time_stage)
+stage_times = defaultdict(float)
+
+
+@contextmanager
+def time_stage(stage):
+    '''
+    adds the run time of the with-block to stage_times[stage]
+    '''
+
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        stage_times[stage] += perf_counter() - start
+
+
+def add_stage_times(times):
+    '''
+    adds stage times (e.g. from a worker process) to stage_times
+    '''
+
+    for stage, seconds in times.items():
+        stage_times[stage] += seconds
+
+
 def load_config(config_file):
     '''
     loads a yaml_config
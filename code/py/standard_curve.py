@@ -0,0 +1,120 @@
+import numpy as np
+
+from kernel_5PL import PL5, get_inv_params, retro_conc, get_Fpos
+
+
+class StandardCurve:
+    '''
+    typed record of one fitted standard curve
+    holds the 5PL params A-E as float64, R^2, the confidence range Fmin/Fmax and ConcMin/ConcMax
+    and the constants of the inverse 5PL (computed once per curve)
+    the "A | B | C | D | E" params string is only produced for the excel output (to_string)
+    '''
+
+    __slots__ = ('A', 'B', 'C', 'D', 'E', 'R', 'Fmin', 'Fmax', 'ConcMin', 'ConcMax', 'inv_params')
+
+    def __init__(self, params, R=np.nan, fraction=0.9):
+        self.A, self.B, self.C, self.D, self.E = [float(p) for p in params]
+        self.R = float(R)
+        self.inv_params = get_inv_params(self.params)
+        self.set_confidence(fraction)
+
+    def __repr__(self):
+        return f"StandardCurve({self.to_string()}, R^2={round(self.R, 6)})"
+
+    @property
+    def params(self):
+        return np.array([self.A, self.B, self.C, self.D, self.E])
+
+    def set_confidence(self, fraction=0.9):
+        '''
+        sets Fmin, Fmax, ConcMin and ConcMax as confidence range around the mean of the curve
+        this is calculated from the definition of the params
+        '''
+
+        FoffSet = (self.B - self.A) * (1-fraction) / 2
+        self.Fmin = self.A + FoffSet
+        self.Fmax = self.B - FoffSet
+        self.ConcMin, self.ConcMax = [float(c) for c in self.conc(np.array([self.Fmin, self.Fmax]))]
+
+    def FI(self, conc):
+        '''
+        forward 5PL for plotting
+        '''
+
+        return PL5(conc, self.params)
+
+    def conc(self, fi, decimals=2):
+        '''
+        conc from FI (array) with the rules of retro_conc
+        '''
+
+        return retro_conc(fi, self.params, decimals=decimals, inv_params=self.inv_params)
+
+    def Fpos(self, fi):
+        '''
+        relative position of fi between Fmin and Fmax
+        '''
+
+        return get_Fpos(fi, self.Fmin, self.Fmax)
+
+    def to_string(self, decimals=3):
+        '''
+        the "A | B | C | D | E" params string (decimals=None keeps the full precision)
+        '''
+
+        return " | ".join([str(p if decimals is None else round(p, decimals)) for p in self.params])
+
+    @classmethod
+    def from_string(cls, params, R=np.nan, fraction=0.9):
+        '''
+        parses the "A | B | C | D | E" params string of older excel output
+        '''
+
+        return cls([float(p) for p in params.split(" | ")], R=R, fraction=fraction)
+
+    @classmethod
+    def from_row(cls, standard_row, fraction=0.9):
+        '''
+        returns the curve of a standard_row
+        rows of older excel output only have the params string (and the stored confidence range)
+        '''
+
+        if isinstance(curve := standard_row.get('curve'), cls):
+            return curve
+        if not isinstance(params := standard_row.get('params'), str):
+            return None
+        curve = cls.from_string(params, R=standard_row.get('R^2', np.nan), fraction=fraction)
+        # keep the stored confidence range if present
+        for col in ['Fmin', 'Fmax', 'ConcMin', 'ConcMax']:
+            if (value := standard_row.get(col)) is not None and value == value:
+                setattr(curve, col, float(value))
+        return curve
+
+
+def add_curves(standard_df, fraction=0.9):
+    '''
+    converts the params strings of older excel output into a curve column
+    '''
+
+    if 'params' not in standard_df.columns:
+        return standard_df
+    standard_df = standard_df.copy()
+    curves = [StandardCurve.from_row(row, fraction=fraction) for _, row in standard_df.iterrows()]
+    standard_df.insert(list(standard_df.columns).index('params'), 'curve', curves)
+    return standard_df.drop('params', axis=1)
+
+
+def export_standards(standard_df, decimals=3):
+    '''
+    makes the standard_df ready for the excel output:
+        - the curve column is replaced by the params string (rounded to decimals)
+        - the dfs in ss, sc and data are dropped
+    '''
+
+    export_df = standard_df.drop(['ss', 'sc', 'data'], axis=1, errors="ignore")
+    if 'curve' in export_df.columns:
+        params = [curve.to_string(decimals=decimals) if isinstance(curve, StandardCurve) else np.nan for curve in export_df['curve']]
+        export_df.insert(list(export_df.columns).index('curve'), 'params', params)
+        export_df = export_df.drop('curve', axis=1)
+    return export_df
@@ -0,0 +1,86 @@
+import os
+import sys
+import shutil
+import tarfile
+import pytest
+
+# the modules of code/py are imported flat (like in the notebooks)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_luminex import make_bench_data, write_bench_config
+from collect_luminex import read_luminex_folder
+from lumi_store import get_results_folder
+
+
+class BenchRuns:
+    '''
+    synthetic luminex runs (see bench_luminex) that are ingested run by run
+    the generated runs are kept in <bench_folder>/runs and copied to the data_path for every ingest
+    '''
+
+    def __init__(self, bench_folder):
+        self.bench_folder = str(bench_folder)
+        self.data_path = os.path.join(self.bench_folder, "data")
+        make_bench_data(self.bench_folder, n_plates=6, plates_per_run=2, plexes=[3], no_standard=0.5, seed=1)
+        shutil.move(self.data_path, runs_path := os.path.join(self.bench_folder, "runs"))
+        self.runs_path = runs_path
+        self.runs = sorted(os.listdir(runs_path))
+
+    def ingest(self, analysis_name, runs, **config):
+        '''
+        runs read_luminex_folder on the data_path holding only these runs
+        returns the results of read_luminex_folder and the results_folder of the analysis
+        '''
+
+        shutil.rmtree(self.data_path, ignore_errors=True)
+        for run in runs:
+            shutil.copytree(os.path.join(self.runs_path, run), os.path.join(self.data_path, run))
+        config = dict(dict(plot_fit=False, fit_cache=dict(use_cache=False), results_format="parquet", write_excel=False), **config)
+        config_file = write_bench_config(self.bench_folder, **config)
+        results = read_luminex_folder(analysis_name=analysis_name, config_file=config_file)
+        return results, get_results_folder(os.path.join(self.bench_folder, "output", analysis_name))
+
+
+@pytest.fixture(scope="session")
+def bench_runs(tmp_path_factory):
+    return BenchRuns(tmp_path_factory.mktemp("bench"))
+
+
+@pytest.fixture(scope="session")
+def testdata(tmp_path_factory):
+    '''
+    the folder of the luminex test plates (unpacked from testdata/LuminexDataTest.tar.gz)
+    '''
+
+    testdata_folder = tmp_path_factory.mktemp("testdata")
+    tar_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../../testdata/LuminexDataTest.tar.gz")
+    with tarfile.open(tar_file) as tar:
+        tar.extractall(testdata_folder, members=[member for member in tar.getmembers() if not os.path.basename(member.name).startswith(".")])
+    return os.path.join(testdata_folder, "LuminexDataTest")
+
+
+@pytest.fixture(scope="session")
+def stores(bench_runs):
+    '''
+    the store of all runs ingested at once ("full")
+    and the store after ingesting the first runs ("first") and appending the last run to a copy ("appended")
+    '''
+
+    runs = bench_runs.runs
+    _, full = bench_runs.ingest("full", runs)
+    _, first = bench_runs.ingest("appended", runs[:-1])
+    shutil.copytree(first, first_copy := os.path.join(bench_runs.bench_folder, "first"))
+    appended_results, appended = bench_runs.ingest("appended", runs, use_existing=True)
+    return dict(full=full, first=first_copy, appended=appended, appended_results=appended_results, runs=runs)
+
+
+def norm_table(df, sort_cols):
+    '''
+    the table with sorted columns and rows and the floats rounded to 10 digits (as strings for the comparison)
+    the column names become strings as well (DB wells without luminex data have a NaN protein column)
+    '''
+
+    df = df.set_axis(df.columns.map(str), axis=1)
+    df = df.loc[:, sorted(df.columns)]
+    df = df.assign(**{col: df[col].map(lambda value: float(f"{value:.10g}")) for col in df.columns if df[col].dtype.kind == "f"})
+    return df.astype(object).astype(str).sort_values(sort_cols).reset_index(drop=True)
@@ -0,0 +1,30 @@
+import os
+import pandas as pd
+
+from lumi_store import get_plate_key
+
+
+def get_plate_keys(df):
+    return sorted(get_plate_key(*row) for row in df.loc[:, ['Run', 'Plex', 'Plate']].itertuples(index=False))
+
+
+def test_append_to_luminexcel(bench_runs):
+    # without results_format, use_existing adds the new plates to luminexcel.xlsx
+    runs = bench_runs.runs
+    excel_config = dict(results_format="", write_excel=True)
+    full_results, _ = bench_runs.ingest("excel_full", runs, **excel_config)
+    first_results, _ = bench_runs.ingest("excel", runs[:-1], **excel_config)
+    results, results_folder = bench_runs.ingest("excel", runs, use_existing=True, **excel_config)
+    assert not os.path.isdir(results_folder)
+
+    sheets = pd.read_excel(os.path.join(os.path.dirname(results_folder), "luminexcel.xlsx"), sheet_name=None)
+    assert get_plate_keys(first_results[0]) < get_plate_keys(sheets['Plates']) == get_plate_keys(full_results[0])
+    # every standard once
+    standard_keys = ['Run', 'Plex', 'Plate', 'Protein']
+    assert not sheets['Standards'].duplicated(standard_keys).any()
+    assert len(sheets['Standards'].index) == len(full_results[1].index)
+    for name, df in [('Plates', results[0]), ('Standards', results[1])]:
+        assert len(sheets[name].index) == len(df.index)
+    # the new plates are in the data
+    assert set(sheets['tidyData']['Run'].astype(str)) == set(full_results[3]['Run'].astype(str))
+    assert len(sheets['tidyData'].index) == len(full_results[3].index)
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from bench_luminex import make_proteins, make_plate_data, S1
+from compute_5PL import fit_standards, fit_standard, r_squared, get_standard_series, param_cov, residuals, get_external_means
+from test_kernel_5PL import num_jac
+
+CONC = [20000.0, 20000.0, 5000.0, 5000.0, 1250.0, 1250.0, 312.5, 312.5, 78.125, 78.125, 19.53125, 19.53125, 0.0, 0.0]
+# standards of the testdata plates with flat optima, where the bound handling decides which optimum is found
+ILL_CONDITIONED = {
+    'CXCL7': [14448.0, 14579.0, 5227.0, 5071.0, 1382.0, 1163.0, 210.0, 200.0, 56.0, 49.0, 18.5, 17.0, 10.0, 11.0],
+    'CXCL11': [5245.0, 5473.0, 996.0, 1004.5, 191.0, 187.0, 32.0, 29.0, 11.0, 10.0, 8.0, 8.0, 7.0, 7.5],
+    'PDGFAB': [4186.5, 4318.0, 1033.0, 994.5, 256.0, 278.5, 111.0, 125.5, 85.0, 92.0, 84.0, 82.0, 84.0, 83.5]
+}
+
+
+@pytest.fixture
+def plate_standards():
+    '''
+    the standard dilution series of every protein of a synthetic 11-Plex plate
+    '''
+
+    protein_df = make_proteins([11], seed=0)
+    plate_df = make_plate_data(protein_df, rng=np.random.default_rng(0))
+    return [
+        get_standard_series(dict(S1=S1), dict(
+            Well=plate_df['Well'],
+            Type=plate_df['Type'],
+            FI=plate_df[plex_name].str.replace(",", ".").astype(float)
+        ))
+        for plex_name in protein_df['PlexName']
+    ]
+
+
+def assert_same_fits(ss_list, **fit_config):
+    params, R, status = fit_standards(ss_list, **fit_config)
+    assert len(params) == len(R) == len(status) == len(ss_list)
+    for ss, curve_params, curve_R in zip(ss_list, params, R):
+        single_params, single_R = fit_standard(ss, **fit_config)
+        # the same optimum up to the solver tolerances (A is in FI units and can be close to 0)
+        np.testing.assert_allclose(curve_params, single_params, rtol=1e-3, atol=1e-2)
+        assert curve_R == pytest.approx(single_R, abs=1e-9)
+
+
+@pytest.mark.parametrize("B_bound", [np.inf, 37000])
+def test_fit_standards_matches_fit_standard(plate_standards, B_bound):
+    assert_same_fits(plate_standards, B_bound=B_bound)
+
+
+@pytest.mark.parametrize("B_bound", [np.inf, 37000])
+def test_fit_standards_ill_conditioned(plate_standards, B_bound):
+    # together with well-conditioned curves of the same batch
+    ss_list = [dict(conc=np.array(CONC), FI=np.array(FI)) for FI in ILL_CONDITIONED.values()]
+    assert_same_fits(ss_list + plate_standards[:3], B_bound=B_bound)
+
+
+def test_r_squared_skips_missing_FI(plate_standards):
+    # missing FI (OOR) do not enter R^2
+    ss = plate_standards[0]
+    params = fit_standards([ss])[0][0]
+    oor_ss = dict(ss, FI=np.where(np.arange(len(ss['FI'])) == 0, np.nan, ss['FI']))
+    assert r_squared(params, oor_ss) == pytest.approx(r_squared(params, dict(conc=ss['conc'][1:], FI=ss['FI'][1:])))
+
+
+def test_param_cov_matches_finite_differences(plate_standards):
+    ss = plate_standards[0]
+    params, _ = fit_standard(ss)
+    J = num_jac(ss['conc'], params)
+    res_ss = np.sum(residuals(params, ss['conc'], ss['FI']) ** 2)
+    np.testing.assert_allclose(param_cov(params, ss), np.linalg.pinv(J.T @ J) * res_ss / (len(ss['FI']) - 5), rtol=1e-3)
+
+
+def test_fit_standards_empty():
+    assert fit_standards([]) == ([], [], [])
+
+
+def mean_row(row, standard_df=pd.DataFrame(), external_mean_method="arithmetic", minFpos=0, **kwargs):
+    '''
+    the row-wise mean of the external standards before get_external_means (reference)
+    '''
+    conc = []
+    Fpos = []
+    for run in standard_df['Run'].unique():
+        ccol = f"conc{run}"
+        fcol = f"Fpos{run}"
+        if row[fcol] == row[fcol]:
+            Fpos.append(row[fcol])
+        if row[fcol] > minFpos:
+            conc.append(row[ccol])
+    if (l := len(conc)):
+        if external_mean_method == "arithmetic":
+            return pd.Series(dict(concMean=sum(conc) / len(conc), concStd=np.std(conc), FposMean=sum(Fpos) / len(Fpos)))
+        elif external_mean_method == "geometric":
+            geo_mean = np.power(np.prod(np.abs(conc)), 1/l)
+            return pd.Series(dict(concMean=round(geo_mean, 3), concStd=np.std(conc), FposMean=sum(Fpos) / len(Fpos)))
+
+
+@pytest.mark.parametrize("external_mean_method", ["arithmetic", "geometric"])
+@pytest.mark.parametrize("minFpos", [0, 0.1])
+def test_get_external_means_matches_mean_row(external_mean_method, minFpos):
+    rng = np.random.default_rng(0)
+    runs = [181030, 181101, 181127]
+    conc = np.power(10, rng.uniform(-1, 4, (200, len(runs))))
+    Fpos = rng.uniform(-0.2, 1.1, (200, len(runs)))
+    # missing Fpos (no standard for that protein in the run) and rows without any valid conc
+    Fpos[rng.uniform(size=Fpos.shape) < 0.2] = np.nan
+    Fpos[:5] = np.nan
+    Fpos[5:10] = -0.1
+    data_df = pd.DataFrame({f"{col}{run}": values[:, i] for col, values in [('conc', conc), ('Fpos', Fpos)] for i, run in enumerate(runs)})
+    # mean_row returns None for rows without a valid conc
+    expected = [mean_row(row, standard_df=pd.DataFrame(dict(Run=runs)), external_mean_method=external_mean_method, minFpos=minFpos) for _, row in data_df.iterrows()]
+    expected_df = pd.DataFrame([row if row is not None else {} for row in expected], columns=['concMean', 'concStd', 'FposMean'], dtype=float)
+    mean_df = get_external_means(conc, Fpos, external_mean_method=external_mean_method, minFpos=minFpos)
+    assert mean_df.iloc[:10].isna().all().all()
+    pd.testing.assert_frame_equal(mean_df, expected_df, rtol=1e-9)
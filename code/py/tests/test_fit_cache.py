@@ -0,0 +1,107 @@
+import time
+import numpy as np
+import pytest
+
+import collect_luminex
+from compute_5PL import fit_standards
+from fit_cache import (
+    load_fit_cache, save_fit_cache, evict_fits, get_fit_key, get_cached_fit, get_warm_start, store_fit,
+    overlay_fit_cache, get_cache_updates, update_fit_cache
+)
+
+SS = dict(
+    Type=np.array(["S1", "S1", "S2", "S2", "S8", "S8"], dtype=object),
+    Well=np.array(["A1", "B1", "C1", "D1", "E1", "F1"], dtype=object),
+    FI=np.array([14448.0, 14579.0, 5227.0, 5071.0, 10.0, 11.0])
+)
+PARAMS = [13.45, 93228.8, 2735.5, -0.4, 5.0]
+
+
+def test_fit_key():
+    key = get_fit_key(SS, 20000, B_bound=37000, confidence=0.9)
+    # the order of the wells does not matter
+    order = [1, 0, 3, 2, 5, 4]
+    assert get_fit_key({col: values[order] for col, values in SS.items()}, 20000, B_bound=37000) == key
+    # the settings that do not change the fit keep the key
+    assert get_fit_key(SS, 20000, B_bound=37000, confidence=0.5, minFpos=0.1) == key
+    # FI, S1, dilution and the fit settings change it
+    assert get_fit_key(dict(SS, FI=SS['FI'] + 0.5), 20000, B_bound=37000) != key
+    assert get_fit_key(SS, 10000, B_bound=37000) != key
+    assert get_fit_key(SS, 20000, dilution=2, B_bound=37000) != key
+    assert get_fit_key(SS, 20000, B_bound=30000) != key
+
+
+def test_cache_hit_and_miss():
+    cache = load_fit_cache("")
+    key = get_fit_key(SS, 20000)
+    assert get_cached_fit(cache, key) is None
+    store_fit(cache, key, "CXCL7", "11-Plex", PARAMS, 0.999, 2)
+    used = cache['fits'][key]['used']
+    time.sleep(0.01)
+    assert get_cached_fit(cache, key) == (PARAMS, 0.999)
+    assert cache['fits'][key]['used'] > used
+    assert get_cached_fit(cache, get_fit_key(SS, 10000)) is None
+
+
+def test_warm_start():
+    cache = load_fit_cache("")
+    assert get_warm_start(cache, "CXCL7", "11-Plex") is None
+    # only converged fits become the warm start
+    store_fit(cache, "a", "CXCL7", "11-Plex", [1, 2, 3, -1, 1], 0.9, 0)
+    assert get_warm_start(cache, "CXCL7", "11-Plex") is None
+    store_fit(cache, "b", "CXCL7", "11-Plex", PARAMS, 0.999, 2)
+    assert get_warm_start(cache, "CXCL7", "11-Plex") == PARAMS
+    assert get_warm_start(cache, "CXCL7", "3-Plex") is None
+
+
+def test_evict_fits():
+    now = time.time()
+    cache = dict(fits={f"key{i}": dict(params=PARAMS, R=1, status=2, created=now, used=now - i * 86400) for i in range(10)}, warm={})
+    assert set(evict_fits(dict(cache), max_age=5.5)['fits']) == {f"key{i}" for i in range(6)}
+    # the most recently used are kept
+    assert set(evict_fits(dict(cache), max_entries=3)['fits']) == {"key0", "key1", "key2"}
+
+
+def test_save_and_load(tmp_path):
+    cache_file = str(tmp_path / "cache" / "fit_cache.json")
+    cache = load_fit_cache(cache_file)
+    store_fit(cache, "a", "CXCL7", "11-Plex", PARAMS, 0.999, 2)
+    save_fit_cache(cache, cache_file, max_entries=10, max_age=365)
+    loaded = load_fit_cache(cache_file)
+    assert get_cached_fit(loaded, "a") == (PARAMS, 0.999)
+    assert get_warm_start(loaded, "CXCL7", "11-Plex") == PARAMS
+    # a broken cache file is rebuilt
+    with open(cache_file, "w") as stream:
+        stream.write("{")
+    assert load_fit_cache(cache_file) == dict(fits={}, warm={})
+
+
+def test_overlay_cache():
+    cache = load_fit_cache("")
+    store_fit(cache, "a", "CXCL7", "11-Plex", PARAMS, 0.999, 2)
+    overlay = overlay_fit_cache(cache)
+    assert get_cached_fit(overlay, "a") == (PARAMS, 0.999)
+    store_fit(overlay, "b", "CXCL9", "11-Plex", PARAMS, 0.99, 2)
+    # the base cache only changes with update_fit_cache
+    assert "b" not in cache['fits']
+    updates = get_cache_updates(overlay)
+    assert set(updates['fits']) == {"a", "b"}
+    update_fit_cache(cache, updates)
+    assert get_cached_fit(cache, "b") == (PARAMS, 0.99)
+    assert get_warm_start(cache, "CXCL9", "11-Plex") == PARAMS
+
+
+def test_ingest_reuses_cached_fits(bench_runs, monkeypatch):
+    fitted = []
+    def count_fits(ss_list, **fit_config):
+        fitted.extend(ss_list)
+        return fit_standards(ss_list, **fit_config)
+    monkeypatch.setattr(collect_luminex, "fit_standards", count_fits)
+    cache = dict(fit_cache=dict(use_cache=True), n_workers=1)
+    first_results, _ = bench_runs.ingest("cached", bench_runs.runs[:1], **cache)
+    assert len(fitted) == len(first_results[1].index) > 0
+    # unchanged standards are taken from the cache
+    second_results, _ = bench_runs.ingest("cached", bench_runs.runs[:1], **cache)
+    assert len(fitted) == len(first_results[1].index)
+    for col in ['R^2', 'ConcMin', 'ConcMax']:
+        np.testing.assert_allclose(second_results[1][col], first_results[1][col])
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from kernel_5PL import PL5, jac_5PL
+
+CONC = np.array([0, 19.53125, 78.125, 312.5, 1250, 5000, 20000])
+PARAMS = [
+    [10, 1000, 10000, -1, 1],
+    [43.98, 20308.0, 32729.9, -0.315, 5.0],
+    [2449.14, 14684.57, 3015.65, -0.944, 1.442],
+    [-5.24, 6122.41, 284.91, -0.6, 0.5]
+]
+
+
+def num_jac(conc, params, rel_step=1e-6):
+    '''
+    central finite differences of PL5 with respect to the 5 params
+    '''
+
+    params = np.array(params, dtype=float)
+    J = np.zeros(conc.shape + (5,))
+    for k in range(5):
+        step = rel_step * max(abs(params[k]), 1)
+        up, down = params.copy(), params.copy()
+        up[k] += step
+        down[k] -= step
+        J[..., k] = (PL5(conc, up) - PL5(conc, down)) / (2 * step)
+    return J
+
+
+@pytest.mark.parametrize("params", PARAMS)
+def test_jac_5PL_matches_finite_differences(params):
+    J = jac_5PL(CONC, params)
+    assert J.shape == CONC.shape + (5,)
+    np.testing.assert_allclose(J, num_jac(CONC, params), rtol=1e-5, atol=1e-6 * max(abs(params[1]), 1))
+
+
+def test_jac_5PL_blank_limit():
+    # at the blank (conc = 0) only the floor A counts
+    np.testing.assert_array_equal(jac_5PL(np.array([0.0]), PARAMS[0])[0], [1, 0, 0, 0, 0])
+
+
+def test_jac_5PL_broadcasts_curves():
+    # params as (1, curves) arrays give (points, curves, 5)
+    P = np.array(PARAMS).T[:, None, :]
+    J = jac_5PL(CONC[:, None], P)
+    for i, params in enumerate(PARAMS):
+        np.testing.assert_allclose(J[:, i], jac_5PL(CONC, params))
@@ -0,0 +1,172 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import lumIO
+from lumIO import collect_DB_data, mergeDB2Lumi, update_DB2Lumi, merge_DBsamples, read_lumi_tidy, split_standards, get_lumi_wells, check_wells
+from DBcols import concat_keyed, sample_cols
+from lumi_store import read_results
+from conftest import norm_table
+
+TABLES = ['merge_df', 'std_df', 'dup_df', 'well_df', 'measure_df', 'sample_df', 'reconcile_df']
+
+
+@pytest.fixture(autouse=True)
+def plex_cols(monkeypatch):
+    # the bench data only has the 3-Plex
+    monkeypatch.setattr(lumIO, "plex_cols", ["3-Plex"])
+
+
+@pytest.fixture
+def DB_file(stores, tmp_path):
+    '''
+    a database workbook with a sample for every two sample wells of the bench plates
+    the samples of the last run belong to the project RC, all others to NAC
+    '''
+
+    data_df = read_results(stores['full'], ['tidyDataFull'])['tidyDataFull']
+    wells = data_df.loc[data_df['Type'] == "X", ['Run', 'Plex', 'Plate', 'Well']].drop_duplicates().astype(str)
+    # the two wells of a sample are on the same plate
+    wells = wells.sort_values(['Run', 'Plex', 'Plate', 'Well']).reset_index(drop=True)
+    well_df = wells.assign(
+        Project=np.where(wells['Run'] == wells['Run'].max(), "RC", "NAC"),
+        SampleName=[f"S{run}_{plate}_{i // 2}" for i, (run, plate) in enumerate(zip(wells['Run'], wells['Plate']))],
+        RunGroup="Messung",
+        Note_Well=""
+    ).astype(dict(Run=int, Plate=int))
+    sample_df = well_df.loc[:, ['Project', 'SampleName']].drop_duplicates().reset_index(drop=True)
+    sample_df = sample_df.assign(
+        BiopsyName="B" + sample_df['SampleName'],
+        LumiDOX=pd.Timestamp("2020-01-01"),
+        Method="ProteinExtraction",
+        SourceAmount=20,
+        SourceUnit="mg",
+        ExtractVolume=300,
+        Note_Sample=""
+    )
+    biopsy_df = sample_df.loc[:, ['Project', 'BiopsyName']].assign(PatientCode=[f"P{i // 4}" for i in sample_df.index], BioType="Tumor", Tissue="Bladder", Note_Biopsy="")
+    patient_df = biopsy_df.loc[:, ['Project', 'PatientCode']].drop_duplicates()
+    DB_file = tmp_path / "MSH_DB.xlsx"
+    with pd.ExcelWriter(DB_file) as writer:
+        for sheet, df in [
+            ('PatientCodes', patient_df.assign(Note_PatCode="")),
+            ('Patients', patient_df.assign(Sex="M", DOD=pd.Timestamp("1950-01-01"), Note_Patient="")),
+            ('Cases', patient_df.assign(Disease="bladder tumor", Therapy="NAC", Note_Case="")),
+            ('Biopsies', biopsy_df),
+            ('Samples', sample_df),
+            ('Wells', well_df)
+        ]:
+            df.to_excel(writer, sheet_name=sheet, index=False)
+    return str(DB_file)
+
+
+
+def missing_wells_per_plate(merge_df):
+    '''
+    the luminex wells missing in the database per Run and Plate like the loop of mergeDB2Lumi before reconcile_wells (reference)
+    '''
+    missing = {}
+    for run in merge_df['Run'].unique():
+        for plate in merge_df.query('Run == @run')['Plate'].unique():
+            df = merge_df.query('Run == @run and Plate == @plate and _merge == "right_only"')
+            if (l := len(df)):
+                missing[(str(run), str(plate))] = (l, list(df['Well'].astype(str).unique()))
+    return missing
+
+
+def test_reconcile_wells(stores, DB_file):
+    dbdf, _ = merge_DBsamples(DB_file)
+    _, lumi_df = split_standards(read_lumi_tidy(stores['appended']))
+    lumi_wells = get_lumi_wells(lumi_df)
+    # every 7th database well is removed and wells of an unknown run and without Run/Plate are added
+    unknown_df = dbdf.iloc[:4].assign(Run=999999)
+    no_plate_df = dbdf.iloc[4:6].assign(Run=np.nan, Plate=np.nan)
+    dbdf = concat_keyed([dbdf.drop(index=dbdf.index[::7]), unknown_df, no_plate_df]).reset_index(drop=True)
+
+    reconcile_df = check_wells(dbdf, lumi_wells, verbose=True)
+    assert list(reconcile_df.columns) == ['MissingIn', 'Run', 'Plate', 'nWells', 'Wells']
+    merge_df = dbdf.loc[:, ['Project', 'Run', 'Plate', 'Plex', 'Well']].merge(lumi_wells, how="outer", indicator=True)
+    db_df = reconcile_df.loc[reconcile_df['MissingIn'] == "DB", :]
+    assert len(db_df.index) > 0
+    assert {
+        (str(row['Run']), str(row['Plate'])): (row['nWells'], row['Wells'].split(", ")) for _, row in db_df.iterrows()
+    } == missing_wells_per_plate(merge_df)
+    # the database wells without luminex data
+    lumi_missing_df = reconcile_df.loc[reconcile_df['MissingIn'] == "Luminex", :]
+    assert lumi_missing_df['nWells'].sum() == (merge_df['_merge'] == "left_only").sum() == len(unknown_df.index) + len(no_plate_df.index)
+    assert lumi_missing_df['Run'].isna().sum() == 1
+    # a complete database has nothing to reconcile
+    dbdf, _ = merge_DBsamples(DB_file)
+    assert check_wells(dbdf, lumi_wells).empty
+
+
+def test_collect_DB_data_projects(stores, DB_file):
+    tables = dict(zip(TABLES, collect_DB_data(DB_file, stores['appended'], projects=["NAC"])))
+    all_tables = dict(zip(TABLES, collect_DB_data(DB_file, stores['appended'])))
+    for name in ['merge_df', 'well_df', 'measure_df', 'sample_df']:
+        assert set(tables[name]['Project'].astype(str)) == {"NAC"}, name
+        assert {"NAC", "RC"} <= set(all_tables[name]['Project'].astype(str)), name
+    # only the luminex data of the NAC runs is read
+    nac_runs = set(all_tables['merge_df'].query('Project == "NAC"')['Run'].astype(str))
+    assert set(tables['merge_df']['Run'].astype(str)) == set(tables['std_df']['Run'].astype(str)) == nac_runs
+    # the clinical data of the NAC samples is the same
+    sample_df = all_tables['sample_df'].loc[all_tables['sample_df']['Project'] == "NAC", :]
+    assert len(sample_df.index) > 0
+    pd.testing.assert_frame_equal(tables['sample_df'].reset_index(drop=True), sample_df.reset_index(drop=True), check_categorical=False)
+    for col in ['SourceAmount', 'ExtractVolume']:
+        assert tables['measure_df'][col].dtype == all_tables['measure_df'][col].dtype, col
+
+
+def test_replicate_stats(stores, DB_file):
+    dbdf, _ = merge_DBsamples(DB_file)
+    tables = dict(zip(TABLES, mergeDB2Lumi(dbdf, stores['appended'], replicate_stats=True)))
+    measure_df = tables['measure_df']
+    # without replicate_stats only the stats columns are missing
+    plain_df = mergeDB2Lumi(dbdf, stores['appended'])[TABLES.index('measure_df')]
+    pd.testing.assert_frame_equal(measure_df.loc[:, plain_df.columns], plain_df)
+
+    group_cols = sample_cols + ['Run', 'RunGroup', 'Plex', 'Plate']
+    proteins = [col for col in tables['well_df'].columns if str(col).startswith("P0")]
+    grouped = tables['well_df'].groupby(group_cols, observed=True)[proteins]
+    expected_df = pd.concat([grouped.count().add_suffix("_n"), (grouped.std() / grouped.mean()).add_suffix("_CV")], axis=1).reset_index()
+    stats_cols = [f"{protein}_{stat}" for stat in ["n", "CV"] for protein in proteins]
+    assert set(stats_cols) <= set(measure_df.columns)
+    # samples with two replicates (and a single well at the end of a plate with an odd number of sample wells)
+    n_df = measure_df.loc[:, [f"{protein}_n" for protein in proteins]]
+    assert n_df.isin([1, 2]).all().all() and (n_df == 2).mean().min() > 0.9
+    assert measure_df.loc[(n_df == 1).any(axis=1), [f"{protein}_CV" for protein in proteins]].isna().all().all()
+    pd.testing.assert_frame_equal(
+        norm_table(measure_df.loc[:, group_cols + stats_cols], group_cols),
+        norm_table(expected_df.loc[:, group_cols + stats_cols], group_cols)
+    )
+
+
+def assert_same_merge(tables, full_tables):
+    for name, df, full_df in zip(TABLES, tables, full_tables):
+        sort_cols = sorted(full_df.columns.map(str))
+        assert sorted(df.columns.map(str)) == sort_cols, name
+        pd.testing.assert_frame_equal(norm_table(df, sort_cols), norm_table(full_df, sort_cols), obj=name)
+
+
+def test_incremental_matches_full(stores, DB_file, tmp_path):
+    dbdf, _ = merge_DBsamples(DB_file)
+    state_file = str(tmp_path / "state.pkl")
+    # the state of the store before the last run was appended (the database wells of the last run have no luminex data yet)
+    assert_same_merge(update_DB2Lumi(dbdf, stores['first'], state_file=state_file), mergeDB2Lumi(dbdf, stores['first']))
+    # new run (and the stored plates updated for its standards)
+    assert_same_merge(update_DB2Lumi(dbdf, stores['appended'], state_file=state_file), mergeDB2Lumi(dbdf, stores['appended']))
+    # nothing changed
+    assert_same_merge(update_DB2Lumi(dbdf, stores['appended'], state_file=state_file), mergeDB2Lumi(dbdf, stores['appended']))
+    # changed and removed database rows
+    # (the SourceAmount of a sample changes for all its wells)
+    changed_dbdf = dbdf.drop(index=dbdf.index[:3]).assign(SourceAmount=lambda df: df['SourceAmount'].where(df['SampleName'] != df['SampleName'].iloc[5], 99))
+    assert_same_merge(update_DB2Lumi(changed_dbdf, stores['appended'], state_file=state_file), mergeDB2Lumi(changed_dbdf, stores['appended']))
+
+
+def test_incremental_keeps_unchanged_samples(stores, DB_file, tmp_path, monkeypatch):
+    dbdf, _ = merge_DBsamples(DB_file)
+    state_file = str(tmp_path / "state.pkl")
+    tables = update_DB2Lumi(dbdf, stores['appended'], state_file=state_file)
+    # without changes, the last merge is kept and no luminex data is read
+    monkeypatch.setattr(lumIO, "select_runs", lambda *args, **kwargs: pytest.fail("luminex data read without changes"))
+    assert_same_merge(update_DB2Lumi(dbdf, stores['appended'], state_file=state_file), tables)
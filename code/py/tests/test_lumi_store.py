@@ -0,0 +1,43 @@
+import pandas as pd
+import pytest
+
+from lumi_store import read_results, LumiStore
+from conftest import norm_table
+
+SORT_COLS = {
+    'Plates': ['Run', 'Plex', 'Plate'],
+    'Standards': ['Run', 'Plex', 'Plate', 'Protein'],
+    'ProteinStats': ['Protein'],
+    'tidyDataFull': ['Run', 'Plex', 'Plate', 'Protein', 'Well']
+}
+
+
+@pytest.mark.parametrize("table", list(SORT_COLS))
+def test_append_matches_full(stores, table):
+    # the last run has standards for the plates without standard of the first runs
+    full_df = read_results(stores['full'], [table])[table]
+    appended_df = read_results(stores['appended'], [table])[table]
+    pd.testing.assert_frame_equal(norm_table(appended_df, SORT_COLS[table]), norm_table(full_df, SORT_COLS[table]))
+
+
+def test_append_adds_plates(stores):
+    first, appended = LumiStore(stores['first']), LumiStore(stores['appended'])
+    assert set(first.manifest['plates']) < set(appended.manifest['plates'])
+    assert len(appended.manifest['plates']) == len(read_results(stores['full'], ['Plates'])['Plates'].index)
+
+
+
+def test_select_matches_read_results(stores):
+    store = LumiStore(stores['appended'])
+    data_df = read_results(stores['appended'], ['tidyDataFull'])['tidyDataFull']
+    run, protein = data_df['Run'].iloc[-1], data_df['Protein'].iloc[0]
+
+    select_df = store.select(runs=run, proteins=protein, types=["X", "S1"])
+    expected_df = data_df.loc[(data_df['Run'] == run) & (data_df['Protein'] == protein) & data_df['Type'].isin(["X", "S1"]), :]
+    assert len(select_df.index) == len(expected_df.index) > 0
+    pd.testing.assert_frame_equal(norm_table(select_df, SORT_COLS['tidyDataFull']), norm_table(expected_df, SORT_COLS['tidyDataFull']))
+
+    tidy_df = store.select(runs=run, table="tidyData")
+    assert list(tidy_df.columns) == store.tidy_cols
+    assert len(tidy_df.index) == (data_df['Run'] == run).sum()
+    assert store.select(runs="999999").empty
@@ -0,0 +1,66 @@
+import os
+import glob
+import numpy as np
+import pandas as pd
+import pytest
+
+import lumipy_utils
+from lumipy_utils import read_excel_plate, read_excel_header, read_csv_plate, read_csv_header
+from bench_luminex import write_raw_csv
+
+
+def baseline_FI(values):
+    '''
+    the FI strings converted like the melt of the baseline (decimal comma, *** is 0), OOR markers and empty cells are NaN
+    '''
+
+    return pd.to_numeric(values.astype(str).str.replace(",", ".", regex=False).str.replace("***", "0", regex=False), errors="coerce")
+
+
+def read_reference(data_df):
+    return data_df.assign(**{col: baseline_FI(data_df[col]) for col in data_df.columns[2:-1]})
+
+
+@pytest.fixture(scope="module")
+def raw_files(testdata):
+    return sorted(glob.glob(os.path.join(testdata, "*_RawData.xlsx")))
+
+
+def test_read_excel_plate(raw_files):
+    assert len(raw_files)
+    for raw_file in raw_files:
+        plate_info, data_df = read_excel_plate(raw_file)
+        pd.testing.assert_series_equal(plate_info, read_excel_header(raw_file))
+        pd.testing.assert_frame_equal(data_df, read_reference(pd.read_excel(raw_file, skiprows=7)))
+
+
+def write_csv_plate(raw_file, csv_file, rng):
+    '''
+    writes an excel raw plate as a csv raw plate (decimal comma) with *** / OOR markers and empty cells
+    '''
+
+    data_df = pd.read_excel(raw_file, skiprows=7, dtype=str).fillna("")
+    fi_cols = data_df.columns[2:-1]
+    for col in fi_cols:
+        data_df[col] = data_df[col].str.replace(".", ",", regex=False)
+    for marker in ["***", "OOR <", "OOR >", ""]:
+        rows, cols = rng.integers(0, len(data_df.index), 3), rng.integers(0, len(fi_cols), 3)
+        for row, col in zip(rows, cols):
+            data_df.loc[row, fi_cols[col]] = marker
+    header = list(pd.read_excel(raw_file, nrows=6, header=None)[0])
+    write_raw_csv(csv_file, header, data_df)
+
+
+@pytest.mark.parametrize("arrow_min_rows", [lumipy_utils.ARROW_MIN_ROWS, 0])
+@pytest.mark.parametrize("use_arrow", [True, False])
+def test_read_csv_plate(raw_files, tmp_path, monkeypatch, arrow_min_rows, use_arrow):
+    # ARROW_MIN_ROWS = 0 parses the 96-well plates with pyarrow as well
+    monkeypatch.setattr(lumipy_utils, "ARROW_MIN_ROWS", arrow_min_rows)
+    rng = np.random.default_rng(0)
+    for raw_file in raw_files:
+        csv_file = str(tmp_path / os.path.basename(raw_file).replace(".xlsx", ".csv"))
+        write_csv_plate(raw_file, csv_file, rng)
+        plate_info, data_df = read_csv_plate(csv_file, use_arrow=use_arrow)
+        pd.testing.assert_series_equal(plate_info, read_csv_header(csv_file))
+        reference_df = read_reference(pd.read_csv(csv_file, skiprows=7, sep=";", encoding="ISO-8859-1", dtype={col: str for col in data_df.columns[2:-1]}))
+        pd.testing.assert_frame_equal(data_df, reference_df.loc[:, list(data_df.columns)])
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import lumIO
+import PANKLOTINOhelper
+from note_utils import aggregate_notes, get_note_tokens
+
+# no token is the prefix of another (the regex deduplication of the old flatten_notes also matched prefixes)
+TOKENS = ["fresh", "hemolytic", "repeat", "low volume", "thawed twice", "lipemic"]
+
+
+def lumIO_flatten_notes(df):
+    '''
+    the flatten_notes of lumIO before aggregate_notes (reference)
+    '''
+    note_cols = [col for col in df.columns if col.startswith("Note")]
+    new_cols = [col + "_1" for col in note_cols]
+    df = df.rename({col:col + "_1" for col in note_cols}, axis=1)
+    df['Note'] = ""
+    for note_col in new_cols:
+        df[note_col] = df[note_col].fillna("")
+        df.loc[df['Note'] != df[note_col], 'Note'] = df['Note'] + "|" + df[note_col].fillna("")
+    df['Note'] = ("|" + df['Note'] +  "|").str.replace(r'\|+', '|', regex=True).str.replace(r"^\|+$", "", regex=True)
+    df.loc[df['Note'] != "", 'Note'] = df['Note'].str.replace(r"(\|[^|]+)(\|.*)?\1", r"\1\2", regex=True)
+    return df.drop(new_cols, axis=1)
+
+
+def PANKLOTINO_flatten_notes(df):
+    '''
+    the flatten_notes of PANKLOTINOhelper before aggregate_notes (reference)
+    '''
+    for col in ["Note_x", "Note_y"]:
+        df[col] = df[col].fillna("")
+    df.loc[(df['Note_x'] ==  "") & (df['Note_y'] ==  ""), 'Note'] = ""
+    df.loc[(df['Note'] != "") & (df['Note_x'] ==  df['Note_y']), 'Note'] = df['Note_x']
+    df.loc[(df['Note'] != "") & (df['Note_x'] !=  df['Note_y']), 'Note'] = df['Note_x'].fillna("").astype(str) + "|" + df['Note_y'].fillna("").astype(str) .fillna("")
+    df.loc[:, 'Note'] = df['Note'].str.strip("|")
+    return df.drop(['Note_x', 'Note_y'], axis=1)
+
+
+def make_notes(note_cols, n=500, seed=0):
+    '''
+    random notes of 0-2 tokens ("a|b"), missing notes and empty notes
+    '''
+    rng = np.random.default_rng(seed)
+    notes = ["|".join(rng.choice(TOKENS, size=rng.integers(3), replace=False)) for _ in range(n * len(note_cols))]
+    note_df = pd.DataFrame(np.array(notes, dtype=object).reshape(n, len(note_cols)), columns=note_cols)
+    return note_df.mask(rng.uniform(size=note_df.shape) < 0.1)
+
+
+def assert_dedup_of(note, old_note, wrap):
+    # the old deduplication only removed the first repeat of a token in a note
+    tokens = list(dict.fromkeys(get_note_tokens(old_note)))
+    assert note == ("|" + "|".join(tokens) + "|" if wrap and tokens else "|".join(tokens))
+
+
+@pytest.mark.parametrize("note_cols", [["Note_Well"], ["Note_Sample", "Note_Well"], ["Note_Biopsy", "Note", "Note_Sample"]])
+def test_lumIO_flatten_notes_matches_reference(note_cols):
+    df = make_notes(note_cols).assign(SampleName=lambda df: [f"S{i}" for i in df.index])
+    flat_df = lumIO.flatten_notes(df.copy())
+    old_df = lumIO_flatten_notes(df.copy())
+    assert list(flat_df.columns) == list(old_df.columns)
+    pd.testing.assert_frame_equal(flat_df.drop('Note', axis=1), old_df.drop('Note', axis=1))
+    for note, old_note in zip(flat_df['Note'], old_df['Note']):
+        assert_dedup_of(note, old_note, wrap=True)
+    # without repeated tokens the notes are the same
+    old_tokens = old_df['Note'].map(get_note_tokens)
+    unique = old_tokens.map(len) == old_tokens.map(lambda tokens: len(set(tokens)))
+    assert unique.mean() > 0.5
+    pd.testing.assert_series_equal(flat_df.loc[unique, 'Note'], old_df.loc[unique, 'Note'])
+
+
+def test_PANKLOTINO_flatten_notes_matches_reference():
+    df = make_notes(["Note_x", "Note_y"])
+    flat_df = PANKLOTINOhelper.flatten_notes(df.copy())
+    old_df = PANKLOTINO_flatten_notes(df.copy())
+    for note, old_note in zip(flat_df['Note'], old_df['Note']):
+        assert_dedup_of(note, old_note, wrap=False)
+
+
+def test_aggregate_notes_exact_tokens():
+    df = pd.DataFrame(dict(Note_x=["fresh|fresh-frozen", "a|b|a", np.nan, ""], Note_y=["fresh", "b|a|c", "", np.nan]))
+    assert list(aggregate_notes(df, ['Note_x', 'Note_y'])) == ["|fresh|fresh-frozen|", "|a|b|c|", "", ""]
+    assert list(aggregate_notes(df, ['Note_x', 'Note_y'], wrap=False)) == ["fresh|fresh-frozen", "a|b|c", "", ""]
+    assert aggregate_notes(df, []).eq("").all()